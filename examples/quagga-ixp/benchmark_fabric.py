@@ -0,0 +1,100 @@
+#!/usr/bin/python
+
+"""
+Compares IXP fabric types for the Quagga IXP example: the time until all of
+the route server's BGP sessions are established, and the CPU time used by
+the whole system meanwhile, with an OVS switch (and controller) versus a
+kernel bridge
+"""
+
+import sys
+import time
+
+# patch isShellBuiltin
+import mininet.util
+import mininext.util
+mininet.util.isShellBuiltin = mininext.util.isShellBuiltin
+sys.modules['mininet.util'] = mininet.util
+
+from mininet.node import OVSController
+from mininet.log import setLogLevel, info, output
+
+from mininext.metrics import CLOCK_TICKS
+from mininext.net import MiniNExT
+from mininext.services.quagga import QuaggaService
+
+from topo import QuaggaTopo
+
+
+def systemCPUSeconds():
+    "Returns the CPU time (all CPUs, excluding idle) used by the system"
+    with open('/proc/stat') as statFile:
+        fields = [int(field) for field in statFile.readline().split()[1:]]
+    # user nice system idle iowait irq softirq steal
+    return (sum(fields[:8]) - fields[3] - fields[4]) / float(CLOCK_TICKS)
+
+
+def establishedSessions(service, node):
+    "Returns (established, configured) BGP sessions of a node"
+    try:
+        summary = service.query(node, 'show ip bgp summary')
+    except Exception:  # bgpd not answering yet
+        return 0, None
+    established, configured = 0, 0
+    for line in summary.splitlines():
+        fields = line.split()
+        if len(fields) < 10 or fields[0].count('.') != 3:
+            continue
+        configured += 1
+        # State/PfxRcd holds the prefix count once established
+        if fields[-1].isdigit():
+            established += 1
+    return established, configured
+
+
+def runFabric(fabric, timeout):
+    """Start the example network on a fabric and wait for the route
+       server's sessions; returns (setup seconds, BGP seconds, CPU seconds)"""
+    topo = QuaggaTopo(fabric=fabric)
+    params = {'controller': OVSController} if topo.needsController() else {}
+    started, cpuStarted = time.time(), systemCPUSeconds()
+    net = MiniNExT(topo, **params)
+    try:
+        net.start()
+        netStarted = time.time()
+        rs = net.get('rs')
+        service = [svc for svc in rs.services
+                   if isinstance(svc, QuaggaService)][0]
+        while True:
+            established, configured = establishedSessions(service, rs)
+            if configured and established == configured:
+                break
+            if time.time() - netStarted > timeout:
+                info('*** %s: timed out with %d/%s sessions\n'
+                     % (fabric, established, configured))
+                break
+            time.sleep(0.1)
+        return (netStarted - started, time.time() - netStarted,
+                systemCPUSeconds() - cpuStarted)
+    finally:
+        net.stop()
+
+
+def benchmark(fabrics=('ovs', 'bridge'), runs=3, timeout=180):
+    "Run each fabric several times and print the mean results"
+    results = dict((fabric, []) for fabric in fabrics)
+    for run in range(runs):
+        for fabric in fabrics:
+            info('*** Run %d: %s fabric\n' % (run + 1, fabric))
+            results[fabric].append(runFabric(fabric, timeout))
+    output('%-8s %12s %16s %12s\n' % ('fabric', 'setup (s)',
+                                      'sessions up (s)', 'cpu (s)'))
+    for fabric in fabrics:
+        means = [sum(values) / len(values)
+                 for values in zip(*results[fabric])]
+        output('%-8s %12.2f %16.2f %12.2f\n' % ((fabric,) + tuple(means)))
+
+
+if __name__ == '__main__':
+    setLogLevel('info')
+    benchmark(runs=int(sys.argv[1]) if len(sys.argv) > 1 else 3)
@@ -6,6 +6,7 @@ Example network of Quagga routers
 """
 
 import sys
+import time
 import atexit
 
 # patch isShellBuiltin
@@ -40,8 +41,12 @@ def startNetwork():
     info('** Dumping host connections\n')
     dumpNodeConnections(net.hosts)
 
-    info('** Testing network connectivity\n')
-    net.ping(net.hosts)
+    info('** Testing network connectivity (including loopbacks)\n')
+    reachability = net.checkReachability()
+    if reachability.failed():
+        info('** Re-checking unreachable pairs\n')
+        time.sleep(5)
+        net.checkReachability(previous=reachability)
 
     info('** Dumping host processes\n')
     for host in net.hosts:
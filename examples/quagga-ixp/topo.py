@@ -17,11 +17,12 @@ class QuaggaTopo(Topo):
 
     "Creates a topology of Quagga routers"
 
-    def __init__(self):
+    def __init__(self, fabric='ovs'):
         """Initialize a Quagga topology with 5 routers, configure their IP
            addresses, loop back interfaces, and paths to their private
-           configuration directories."""
-        Topo.__init__(self)
+           configuration directories.
+           fabric: IXP fabric type ('ovs' switch or kernel 'bridge')"""
+        Topo.__init__(self, fabric=fabric)
 
         # Directory where this file / script is located"
         selfPath = os.path.dirname(os.path.abspath(
@@ -49,7 +50,7 @@ class QuaggaTopo(Topo):
                                       loIP=None))
 
         # Add switch for IXP fabric
-        ixpfabric = self.addSwitch('fabric-sw1')
+        ixpfabric = self.addFabric('fabric-sw1')
 
         # Setup each Quagga router, add a link between it and the IXP fabric
         for host in quaggaHosts:
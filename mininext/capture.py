@@ -0,0 +1,446 @@
+"""
+Bounded, low-overhead packet capture on node interfaces.
+
+Instead of a tcpdump process per interface, each capture is a packet socket
+opened inside the node's network namespace, receiving into a memory-mapped
+ring buffer (PACKET_RX_RING, TPACKET_V2) shared with the kernel. A single
+background thread polls every capture's socket and writes the packets to
+pcap files. Filters are classic BPF programs attached to the sockets, so
+unwanted packets are dropped in the kernel.
+
+Output is bounded: each capture rotates its file by size and / or age, and
+a global byte budget is shared by all captures; when it is reached the
+oldest rotated files are removed, and packets are dropped (and counted)
+once only the files being written remain.
+"""
+
+import ctypes
+import mmap
+import os
+import select
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from subprocess import Popen, PIPE
+
+from mininet.log import debug, warn
+
+from mininext.netlink import callInNetNamespace
+
+DEFAULT_DIR = '/tmp/mininext-captures'
+DEFAULT_BUDGET = 1 << 30  # bytes of pcap files kept by all captures
+
+# Packet socket constants #
+
+ETH_P_ALL = 0x0003
+SOL_PACKET = 263
+SO_ATTACH_FILTER = 26
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V2 = 1
+TP_STATUS_USER = 1
+TPACKET_ALIGNMENT = 16
+
+TPACKET_REQ = struct.Struct('=IIII')  # block size / nr, frame size / nr
+TPACKET_STATS = struct.Struct('=II')  # packets, drops
+TPACKET2_HDR = struct.Struct('=IIIHHIIHH4x')  # status, len, snaplen, mac,
+#                                              net, sec, nsec, vlan
+
+# pcap file format (microsecond timestamps, Ethernet)
+PCAP_HEADER = struct.Struct('=IHHiIII')
+PCAP_RECORD = struct.Struct('=IIII')
+PCAP_MAGIC = 0xa1b2c3d4
+LINKTYPE_ETHERNET = 1
+
+# Filters #
+
+SOCK_FILTER = struct.Struct('=HBBI')  # code, jt, jf, k
+
+_compiled = {}  # tcpdump expression -> BPF program
+
+
+def portFilter(port, proto='tcp'):
+    """Returns a BPF program accepting IPv4 packets from or to a port
+       port: TCP / UDP port (e.g. 179 for BGP)
+       proto: 'tcp' or 'udp'"""
+    protoNumber = {'tcp': 6, 'udp': 17}[proto]
+    return [(0x28, 0, 0, 12),          # ldh [12] (ethertype)
+            (0x15, 0, 10, 0x0800),     # IPv4?
+            (0x30, 0, 0, 23),          # ldb [23] (protocol)
+            (0x15, 0, 8, protoNumber),
+            (0x28, 0, 0, 20),          # ldh [20] (fragment offset)
+            (0x45, 6, 0, 0x1fff),      # not the first fragment?
+            (0xb1, 0, 0, 14),          # ldxb 4*([14]&0xf) (header length)
+            (0x48, 0, 0, 14),          # ldh [x + 14] (source port)
+            (0x15, 2, 0, port),
+            (0x48, 0, 0, 16),          # ldh [x + 16] (destination port)
+            (0x15, 0, 1, port),
+            (0x06, 0, 0, 0x40000),     # accept
+            (0x06, 0, 0, 0)]           # drop
+
+
+def compileFilter(expression):
+    """Returns the BPF program of a tcpdump filter expression (compiled with
+       tcpdump -ddd once per expression)"""
+    if expression not in _compiled:
+        popen = Popen(['tcpdump', '-ddd', '-i', 'lo', expression],
+                      stdout=PIPE, stderr=PIPE)
+        out, err = popen.communicate()
+        if popen.wait() != 0:
+            raise Exception("Unable to compile capture filter %r: %s\n"
+                            % (expression, err.strip()))
+        lines = out.decode('ascii').split('\n')
+        _compiled[expression] = [tuple(int(value) for value in line.split())
+                                 for line in lines[1:int(lines[0]) + 1]]
+    return _compiled[expression]
+
+
+def makeFilter(bpfFilter):
+    "Returns a BPF program for a program, tcpdump expression or None"
+    if bpfFilter is None or isinstance(bpfFilter, list):
+        return bpfFilter
+    if isinstance(bpfFilter, basestring):
+        return compileFilter(bpfFilter)
+    raise Exception("Invalid capture filter %r\n" % (bpfFilter,))
+
+
+def attachFilter(sock, program):
+    "Attach a BPF program to a socket (SO_ATTACH_FILTER)"
+    code = b''.join(SOCK_FILTER.pack(*instruction)
+                    for instruction in program)
+    buf = ctypes.create_string_buffer(code, len(code))
+    # struct sock_fprog (the kernel copies the program)
+    fprog = struct.pack('@HP', len(program), ctypes.addressof(buf))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+
+# Captures #
+
+
+class PacketCapture(object):
+
+    "Capture of one node interface into rotated pcap files"
+
+    def __init__(self, node, intf, directory=DEFAULT_DIR, bpfFilter=None,
+                 snaplen=65535, frames=256, frameSize=2048,
+                 rotateBytes=None, rotateSeconds=None):
+        """node: node the interface belongs to
+           intf: interface name
+           directory: directory of the pcap files
+                      (<node>-<intf>.<number>.pcap)
+           bpfFilter: BPF program ([(code, jt, jf, k)], see portFilter()),
+                      tcpdump expression or None to capture everything
+           snaplen: maximum bytes kept per packet (packets are also
+                    truncated to the ring's frame size)
+           frames: number of frames of the ring buffer
+           frameSize: bytes per frame of the ring buffer (rounded up to
+                      a multiple of TPACKET_ALIGNMENT)
+           rotateBytes: start a new file once a file reaches this size
+           rotateSeconds: start a new file once a file is this old"""
+        self.node = node
+        self.intf = str(intf)
+        self.directory = directory
+        self.program = makeFilter(bpfFilter)
+        self.snaplen = snaplen
+        frameSize = -(-frameSize // TPACKET_ALIGNMENT) * TPACKET_ALIGNMENT
+        self.frameSize = frameSize
+        pageSize = mmap.PAGESIZE
+        self.blockSize = (frameSize + pageSize - 1) // pageSize * pageSize
+        self.framesPerBlock = self.blockSize // frameSize
+        self.blocks = (frames + self.framesPerBlock - 1) // \
+            self.framesPerBlock
+        self.frames = self.blocks * self.framesPerBlock
+        self.rotateBytes = rotateBytes
+        self.rotateSeconds = rotateSeconds
+        self.sock = None
+        self.ring = None
+        self.frame = 0
+        self.engine = None
+        self.pcapFile = None
+        self.path = None
+        self.fileBytes = 0
+        self.opened = 0
+        self.fileNumber = 0
+        self.files = []  # pcap files written (including removed ones)
+        self.packets = 0
+        self.bytes = 0
+        self.dropped = 0  # packets dropped for the byte budget
+        self.kernelDrops = 0
+
+    def prefix(self):
+        "Returns the path prefix of the capture's files"
+        return os.path.join(self.directory, '%s-%s' % (self.node, self.intf))
+
+    def openSocket(self):
+        """Open the capture's socket and ring (in the current thread's
+           namespace)"""
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+        try:
+            if self.program is not None:
+                attachFilter(sock, self.program)
+            sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V2)
+            sock.setsockopt(SOL_PACKET, PACKET_RX_RING, TPACKET_REQ.pack(
+                self.blockSize, self.blocks, self.frameSize, self.frames))
+            ring = mmap.mmap(sock.fileno(), self.blockSize * self.blocks,
+                             mmap.MAP_SHARED,
+                             mmap.PROT_READ | mmap.PROT_WRITE)
+            sock.bind((self.intf, ETH_P_ALL))
+        except Exception:
+            sock.close()
+            raise
+        self.sock, self.ring = sock, ring
+
+    def fileno(self):
+        "Returns the socket's file descriptor (for poll())"
+        return self.sock.fileno()
+
+    def read(self, now):
+        "Write the packets waiting in the ring, returns how many there were"
+        count = 0
+        ring = self.ring
+        while True:
+            # frames do not span blocks (blocks may end with unused space)
+            offset = (self.frame // self.framesPerBlock * self.blockSize +
+                      self.frame % self.framesPerBlock * self.frameSize)
+            (status, length, snaplen, mac, _net, sec,
+             nsec, _tci, _tpid) = TPACKET2_HDR.unpack_from(ring, offset)
+            if not status & TP_STATUS_USER:
+                return count
+            caplen = min(snaplen, self.snaplen)
+            self.write(sec, nsec // 1000, length,
+                       ring[offset + mac:offset + mac + caplen], now)
+            ring[offset:offset + 4] = b'\0\0\0\0'  # back to the kernel
+            self.frame = (self.frame + 1) % self.frames
+            count += 1
+
+    def write(self, sec, usec, length, data, now):
+        "Write a packet record, rotating the file and respecting the budget"
+        size = PCAP_RECORD.size + len(data)
+        if self.pcapFile is not None and self.fileBytes > PCAP_HEADER.size \
+            and ((self.rotateBytes is not None and
+                  self.fileBytes + size > self.rotateBytes) or
+                 (self.rotateSeconds is not None and
+                  now - self.opened >= self.rotateSeconds)):
+            self.closeFile()
+        if self.pcapFile is None:
+            size += PCAP_HEADER.size
+        if not self.engine.reserve(size):
+            self.dropped += 1
+            return
+        if self.pcapFile is None:
+            self.openFile(now)
+        self.pcapFile.write(PCAP_RECORD.pack(sec, usec, len(data), length))
+        self.pcapFile.write(data)
+        self.fileBytes += size
+        self.packets += 1
+        self.bytes += len(data)
+
+    def openFile(self, now):
+        "Start a new pcap file"
+        self.path = '%s.%d.pcap' % (self.prefix(), self.fileNumber)
+        self.fileNumber += 1
+        self.pcapFile = open(self.path, 'wb', 1 << 16)
+        self.pcapFile.write(PCAP_HEADER.pack(PCAP_MAGIC, 2, 4, 0, 0,
+                                             self.snaplen,
+                                             LINKTYPE_ETHERNET))
+        self.fileBytes = 0  # the header is counted with the first record
+        self.opened = now
+        self.files.append(self.path)
+
+    def closeFile(self):
+        "Close the current pcap file, handing it to the engine's budget"
+        if self.pcapFile is None:
+            return
+        self.pcapFile.close()
+        self.engine.fileClosed(self.path, self.fileBytes)
+        self.pcapFile, self.path = None, None
+
+    def rotate(self, now):
+        "Close the current file if it is older than rotateSeconds"
+        if self.rotateSeconds is not None and self.pcapFile is not None and \
+                now - self.opened >= self.rotateSeconds:
+            self.closeFile()
+
+    def close(self):
+        "Write the remaining packets and close the socket and file"
+        if self.sock is None:
+            return
+        self.read(time.time())
+        try:
+            self.kernelDrops += TPACKET_STATS.unpack(self.sock.getsockopt(
+                SOL_PACKET, PACKET_STATISTICS, TPACKET_STATS.size))[1]
+        except socket.error:
+            pass
+        self.ring.close()
+        self.sock.close()
+        self.sock, self.ring = None, None
+        self.closeFile()
+
+    def stats(self):
+        "Returns the capture's packet, byte, drop and file counts"
+        return {'packets': self.packets, 'bytes': self.bytes,
+                'dropped': self.dropped, 'kernelDrops': self.kernelDrops,
+                'files': self.files}
+
+    def __repr__(self):
+        return '<%s %s:%s>' % (self.__class__.__name__, self.node, self.intf)
+
+
+# Engine #
+
+
+class CaptureEngine(object):
+
+    """Runs packet captures from a single background thread and enforces
+       the byte budget shared by their files"""
+
+    def __init__(self, budget=DEFAULT_BUDGET, pollInterval=0.2):
+        """budget: maximum bytes of pcap files kept by all captures
+           pollInterval: seconds between checks for time-based rotation"""
+        self.budget = budget
+        self.pollInterval = pollInterval
+        self.used = 0  # bytes of pcap files on disk
+        self.closedFiles = deque()  # rotated files, oldest first
+        self.captures = {}  # fd -> PacketCapture
+        self.lock = threading.Lock()
+        self.poller = select.poll()
+        self.thread = None
+        self.running = False
+
+    # Budget #
+
+    def reserve(self, size):
+        "Account for size more bytes, removing old files; returns if it fits"
+        while self.used + size > self.budget and self.closedFiles:
+            path, fileBytes = self.closedFiles.popleft()
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.used -= fileBytes
+            debug('*** Removed capture file %s (byte budget)\n' % path)
+        if self.used + size > self.budget:
+            return False
+        self.used += size
+        return True
+
+    def fileClosed(self, path, size):
+        "Record a rotated file (removable to respect the budget)"
+        self.closedFiles.append((path, size))
+
+    # Captures #
+
+    def start(self, captures):
+        """Open captures (one namespace switch per node) and start reading
+           them
+           captures: PacketCapture objects"""
+        byNode = {}
+        for capture in captures:
+            byNode.setdefault(capture.node, []).append(capture)
+        started = []
+        try:
+            for node, nodeCaptures in byNode.items():
+                if not os.path.isdir(nodeCaptures[0].directory):
+                    os.makedirs(nodeCaptures[0].directory)
+
+                def openSockets(nodeCaptures=nodeCaptures):
+                    "Open the node's capture sockets"
+                    for capture in nodeCaptures:
+                        capture.openSocket()
+                        started.append(capture)
+                if getattr(node, 'inNamespace', False):
+                    callInNetNamespace(node.pid, openSockets)
+                else:
+                    openSockets()
+        except Exception:
+            for capture in started:
+                capture.close()
+            raise
+        with self.lock:
+            for capture in started:
+                capture.engine = self
+                self.captures[capture.fileno()] = capture
+                self.poller.register(capture.fileno(), select.POLLIN)
+            if not self.running:
+                self.running = True
+                self.thread = threading.Thread(target=self.run,
+                                               name='mininext-capture')
+                self.thread.daemon = True
+                self.thread.start()
+        debug('*** Started %d captures\n' % (len(started)))
+        return started
+
+    def stop(self, captures=None):
+        """Stop captures (default: all), writing their remaining packets
+           returns: {capture: stats}"""
+        with self.lock:
+            if captures is None:
+                captures = list(self.captures.values())
+            for capture in captures:
+                if capture.sock is None:
+                    continue
+                fd = capture.fileno()
+                self.poller.unregister(fd)
+                del self.captures[fd]
+                capture.close()
+            if not self.captures and self.running:
+                self.running = False
+                thread = self.thread
+            else:
+                thread = None
+        if thread is not None:
+            thread.join()
+        stats = dict((capture, capture.stats()) for capture in captures)
+        for capture, captureStats in stats.items():
+            if captureStats['dropped'] or captureStats['kernelDrops']:
+                warn('*** %s dropped %d packets (budget) and %d (ring)\n'
+                     % (capture, captureStats['dropped'],
+                        captureStats['kernelDrops']))
+        return stats
+
+    def nodeCaptures(self, node):
+        "Returns the node's running captures"
+        with self.lock:
+            return [capture for capture in self.captures.values()
+                    if capture.node is node]
+
+    def run(self):
+        "Read packets from every capture (runs in the background)"
+        timeout = int(self.pollInterval * 1000)
+        while self.running:
+            try:
+                events = self.poller.poll(timeout)
+            except select.error:
+                continue
+            now = time.time()
+            with self.lock:
+                for fd, _event in events:
+                    capture = self.captures.get(fd)
+                    if capture is not None:
+                        capture.read(now)
+                for capture in self.captures.values():
+                    capture.rotate(now)
+
+
+_engine = None
+
+
+def getCaptureEngine():
+    "Returns the shared CaptureEngine"
+    global _engine
+    if _engine is None:
+        _engine = CaptureEngine()
+    return _engine
+
+
+def makeCaptures(node, intfs=None, **params):
+    """Returns PacketCapture objects for a node's interfaces
+       intfs: interface names (default: all but loopbacks)
+       params: PacketCapture parameters"""
+    if intfs is None:
+        intfs = [intf.name for intf in node.intfList()
+                 if intf.name != 'lo' and ':' not in intf.name]
+    return [PacketCapture(node, intf, **params) for intf in intfs]
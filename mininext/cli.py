@@ -2,6 +2,7 @@
 Extended CLI object for MiniNExT.
 """
 from mininet.cli import CLI as BaseCLI
+from mininet.log import output, error
 
 
 class CLI(BaseCLI):
@@ -9,3 +10,45 @@ class CLI(BaseCLI):
     "Simple command-line interface to talk to nodes."
 
     prompt = 'mininext> '
+
+    def do_top(self, line):
+        """Show the nodes using the most CPU or memory.
+           Usage: top [count] [cpu|mem]"""
+        sampler = getattr(self.mn, 'sampler', None)
+        if sampler is None:
+            error('resource sampler not running (see startSampler())\n')
+            return
+        args = line.split()
+        count, key = 10, 'cpu'
+        for arg in args:
+            if arg.isdigit():
+                count = int(arg)
+            elif arg in ('cpu', 'mem'):
+                key = arg
+            else:
+                error('usage: top [count] [cpu|mem]\n')
+                return
+        output('%-16s %8s %12s %8s\n' % ('node', 'cpu%', 'rss (KiB)',
+                                         'zombies'))
+        for name, cpuPercent, rss in sampler.topConsumers(count, key):
+            latest = sampler.series[name].latest()
+            zombies = latest[4] if latest is not None else 0
+            output('%-16s %8.1f %12d %8d\n' % (name, cpuPercent, rss // 1024,
+                                               zombies))
+
+    def do_placement(self, _line):
+        "Show the CPUs assigned to each node."
+        placement = self.mn.getPlacement()
+        if not placement:
+            output('no CPU placement in use\n')
+            return
+        for name in sorted(placement):
+            output('%s: cpus %s\n' % (name, placement[name]))
+
+    def do_mounts(self, _line):
+        "Show the size of the mount table of each node and the host."
+        sizes = self.mn.getMountTableSizes()
+        output('%-16s %8d\n' % ('(host)', sizes.pop(None)))
+        for name in sorted(sizes):
+            size = sizes[name]
+            output('%-16s %8s\n' % (name, '-' if size is None else size))
@@ -0,0 +1,244 @@
+"""
+BGP convergence measurement for MiniNExT networks running QuaggaService.
+"""
+
+import json
+import time
+from multiprocessing.pool import ThreadPool
+
+from mininet.log import info
+
+from mininext.services.quagga import QuaggaService
+
+
+class ConvergenceReport(object):
+
+    """Results of a convergence measurement. Times are in seconds relative
+       to the moment the change was injected; a router's time-to-stable is
+       the time of its last RIB change before the quiescence window. A run
+       only converges once a change was observed and no router is failing
+       to return its RIB"""
+
+    def __init__(self, event, quiescence, timeout):
+        """event: description of the injected change
+           quiescence: seconds without RIB changes that define 'stable'
+           timeout: maximum measurement duration in seconds"""
+        self.event = event
+        self.quiescence = quiescence
+        self.timeout = timeout
+        self.startTime = None
+        self.routers = {}  # name -> {firstChange, stable, changes, routes}
+        self.errors = {}  # name -> error string
+        self.samples = 0
+        self.converged = False
+
+    def networkFirstChange(self):
+        "Returns the earliest time any router's RIB changed"
+        times = [router['firstChange'] for router in self.routers.values()
+                 if router['firstChange'] is not None]
+        return min(times) if times else None
+
+    def networkStable(self):
+        "Returns the time the last router's RIB stopped changing"
+        times = [router['stable'] for router in self.routers.values()
+                 if router['stable'] is not None]
+        return max(times) if times else None
+
+    def toDict(self):
+        "Returns the report as a dict (suitable for JSON)"
+        return {'event': self.event,
+                'startTime': self.startTime,
+                'quiescence': self.quiescence,
+                'timeout': self.timeout,
+                'converged': self.converged,
+                'samples': self.samples,
+                'network': {'firstChange': self.networkFirstChange(),
+                            'stable': self.networkStable()},
+                'routers': self.routers,
+                'errors': self.errors}
+
+    def toJSON(self, path=None):
+        "Returns the report as JSON, also writing it to path if set"
+        report = json.dumps(self.toDict(), indent=2, sort_keys=True)
+        if path is not None:
+            with open(path, 'w') as reportFile:
+                reportFile.write(report + '\n')
+        return report
+
+    def __str__(self):
+        if self.converged:
+            status = 'converged'
+        elif self.networkFirstChange() is None:
+            status = 'no change observed'
+        else:
+            status = 'timed out'
+        lines = ['Convergence after %s (%s)' % (self.event, status)]
+        for name in sorted(self.routers):
+            router = self.routers[name]
+            lines.append('  %-12s first change %s, stable %s, %d changes'
+                         % (name, formatSeconds(router['firstChange']),
+                            formatSeconds(router['stable']),
+                            router['changes']))
+        lines.append('  %-12s first change %s, stable %s'
+                     % ('network', formatSeconds(self.networkFirstChange()),
+                        formatSeconds(self.networkStable())))
+        for name in sorted(self.errors):
+            lines.append('  %-12s error: %s' % (name, self.errors[name]))
+        return '\n'.join(lines)
+
+
+def formatSeconds(seconds):
+    "Format an optional number of seconds"
+    return '-' if seconds is None else '%.3fs' % (seconds)
+
+
+class ConvergenceMeasurement(object):
+
+    """Injects a routing change, then samples every router's BGP table
+       concurrently until no table has changed for a quiescence window"""
+
+    def __init__(self, net, service=None, routers=None, interval=0.5,
+                 quiescence=5.0, timeout=120.0, propagation=None,
+                 maxThreads=32):
+        """net: running MiniNExT network
+           service: QuaggaService instance (found on the hosts if None)
+           routers: nodes to sample (default: hosts running the service)
+           interval: minimum seconds between sampling rounds
+           quiescence: seconds without changes (counted from the last
+                       observed change) for the network to be stable
+           timeout: maximum seconds to wait for stability
+           propagation: maximum seconds to wait for a first change (e.g.
+                        less than timeout for changes that may have no
+                        effect; default: timeout)
+           maxThreads: maximum number of concurrent RIB queries"""
+        self.net = net
+        self.service = service if service is not None else \
+            self.findService(net)
+        if routers is None:
+            routers = [host for host in net.hosts
+                       if self.service in getattr(host, 'services', {})]
+        self.routers = list(routers)
+        self.interval = interval
+        self.quiescence = quiescence
+        self.timeout = timeout
+        self.propagation = propagation
+        self.maxThreads = maxThreads
+
+    @staticmethod
+    def findService(net):
+        "Returns the QuaggaService used by the network's hosts"
+        for host in net.hosts:
+            for service in getattr(host, 'services', {}):
+                if isinstance(service, QuaggaService):
+                    return service
+        raise Exception("No QuaggaService found in network\n")
+
+    # Sampling #
+
+    def snapshot(self, pool):
+        """Returns {router: (timestamp, best routes or exception)}, with the
+           RIBs of all routers fetched concurrently"""
+        def sample(router):
+            "Fetch and summarize a single router's RIB"
+            try:
+                routes = self.service.getRIB(router).bestRoutes()
+            except Exception as e:  # reported per router
+                routes = e
+            return router, (time.time(), routes)
+        return dict(pool.map(sample, self.routers))
+
+    def run(self, change, event=None):
+        """Measure convergence after a change
+           change: callable that injects the change
+           event: description of the change for the report
+           returns: ConvergenceReport"""
+        report = ConvergenceReport(event or getattr(change, '__name__',
+                                                    'change'),
+                                   self.quiescence, self.timeout)
+        if not self.routers:
+            return report
+        pool = ThreadPool(min(self.maxThreads, len(self.routers)))
+        try:
+            previous = self.snapshot(pool)
+            for router, (_, routes) in previous.items():
+                report.routers[router.name] = {
+                    'firstChange': None, 'stable': None, 'changes': 0,
+                    'routes': None if isinstance(routes, Exception)
+                    else len(routes)}
+
+            startTime = report.startTime = time.time()
+            change()
+            lastChange = None  # quiescence counts from the first change
+            while True:
+                roundStart = time.time()
+                current = self.snapshot(pool)
+                report.samples += 1
+                failing = False
+                for router, (timestamp, routes) in current.items():
+                    if isinstance(routes, Exception):
+                        report.errors[router.name] = str(routes)
+                        failing = True
+                        continue
+                    if isinstance(previous[router][1], Exception):
+                        # no baseline for this router, use this sample
+                        previous[router] = (timestamp, routes)
+                        continue
+                    if routes == previous[router][1]:
+                        continue
+                    elapsed = timestamp - startTime
+                    stats = report.routers[router.name]
+                    if stats['firstChange'] is None:
+                        stats['firstChange'] = elapsed
+                    stats['stable'] = elapsed
+                    stats['changes'] += 1
+                    stats['routes'] = len(routes)
+                    lastChange = timestamp if lastChange is None else \
+                        max(lastChange, timestamp)
+                    previous[router] = (timestamp, routes)
+                now = time.time()
+                if lastChange is not None and not failing and \
+                        now - lastChange >= self.quiescence:
+                    report.converged = True
+                    break
+                if now - startTime >= self.timeout:
+                    break
+                if lastChange is None and self.propagation is not None and \
+                        now - startTime >= self.propagation:
+                    break
+                time.sleep(max(0, self.interval - (now - roundStart)))
+        finally:
+            pool.close()
+            pool.join()
+        info('%s\n' % report)
+        return report
+
+    # Changes #
+
+    def announce(self, node, prefix, asn=None):
+        "Measure convergence after node announces prefix"
+        asn = asn if asn is not None else self.service.getASN(node)
+        return self.run(lambda: self.service.configure(
+            node, ['router bgp %d' % asn, 'network %s' % prefix]),
+            'announce %s from %s' % (prefix, node))
+
+    def withdraw(self, node, prefix, asn=None):
+        "Measure convergence after node withdraws prefix"
+        asn = asn if asn is not None else self.service.getASN(node)
+        return self.run(lambda: self.service.configure(
+            node, ['router bgp %d' % asn, 'no network %s' % prefix]),
+            'withdraw %s from %s' % (prefix, node))
+
+    def sessionDown(self, node, neighbor, asn=None):
+        "Measure convergence after node shuts down its session to neighbor"
+        asn = asn if asn is not None else self.service.getASN(node)
+        return self.run(lambda: self.service.configure(
+            node, ['router bgp %d' % asn, 'neighbor %s shutdown' % neighbor]),
+            'session %s-%s down' % (node, neighbor))
+
+    def sessionUp(self, node, neighbor, asn=None):
+        "Measure convergence after node re-enables its session to neighbor"
+        asn = asn if asn is not None else self.service.getASN(node)
+        return self.run(lambda: self.service.configure(
+            node, ['router bgp %d' % asn,
+                   'no neighbor %s shutdown' % neighbor]),
+            'session %s-%s up' % (node, neighbor))
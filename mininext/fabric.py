@@ -0,0 +1,70 @@
+"""
+Controller-less shared segments (fabrics) for MiniNExT topologies.
+"""
+
+from mininet.log import warn
+from mininet.node import Switch
+from mininet.util import quietRun
+
+# ovs: default switch class (requires a controller)
+# bridge: kernel bridge (FabricBridge), no controller
+# direct: a two member segment built as a single veth link, no switch
+FABRICS = ('ovs', 'bridge', 'direct')
+
+
+class FabricBridge(Switch):
+
+    """A shared L2 segment (e.g. an IXP peering LAN) built as a kernel
+       bridge with iproute2. It needs no controller, and spanning tree is
+       disabled so that ports forward as soon as they are attached"""
+
+    def __init__(self, name, ageingTime=None, **params):
+        """name: name of bridge
+           ageingTime: MAC ageing time in seconds (None for the default)
+           params: Switch parameters"""
+        self.ageingTime = ageingTime
+        Switch.__init__(self, name, **params)
+
+    @classmethod
+    def setup(cls):
+        "Warn if bridged traffic is passed to iptables"
+        for table in ('arp', 'ip', 'ip6'):
+            out = quietRun('sysctl -n net.bridge.bridge-nf-call-%stables'
+                           % (table)).strip()
+            if out == '1':
+                warn('Warning: bridge-nf-call-%stables is enabled, '
+                     'fabric traffic will traverse iptables\n' % (table))
+
+    def connected(self):
+        "Bridges forward immediately (no controller, no STP)"
+        return True
+
+    def start(self, _controllers):
+        "Create the bridge and attach its ports in one shell command"
+        options = 'stp_state 0 forward_delay 0'
+        if self.ageingTime is not None:
+            options += ' ageing_time %d' % (self.ageingTime * 100)
+        commands = ['ip link del %s 2>/dev/null' % (self),
+                    'ip link add name %s type bridge %s' % (self, options)]
+        commands += ['ip link set %s master %s up' % (intf, self)
+                     for intf in self.intfList() if self.name in intf.name]
+        commands.append('ip link set %s up' % (self))
+        self.cmd('; '.join(commands))
+
+    def attach(self, intf):
+        "Attach a port added while the bridge is running"
+        self.cmd('ip link set %s master %s up' % (intf, self))
+
+    def detach(self, intf):
+        "Detach a port"
+        self.cmd('ip link set %s nomaster' % (intf))
+
+    def stop(self, *args, **kwargs):
+        "Delete the bridge"
+        self.cmd('ip link del %s' % (self))
+        Switch.stop(self, *args, **kwargs)
+
+    def dpctl(self, *args):
+        "Show the bridge's ports and forwarding table"
+        return self.cmd('bridge link show master %s; bridge fdb show br %s'
+                        % (self, self))
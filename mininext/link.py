@@ -9,9 +9,11 @@ class LoopbackIntf(Intf):
 
     "A special interface object that handles a loopback interface for a node"
 
-    def __init__(self, node, loNum=None, **params):
+    def __init__(self, node, loNum=None, configure=True, **params):
         """node: owning node (where this loopback intf is being created)
            loNum: the loopback number (lo:X)
+           configure: apply params now (False if the node applies them
+                      later in bulk, see Node.setupLoopbacks())
            other arguments are passed to Intf.config"""
         self.node = node
         self.loNum = loNum
@@ -27,7 +29,23 @@ class LoopbackIntf(Intf):
         node.addNodeLoopbackIntf(loIntf=self, loNum=self.loNum)
 
         # we don't actually need to instantiate the lo:X intf, just config it
-        self.config(**params)
+        if configure:
+            self.config(**params)
+        elif params.get('ip') is not None:
+            # only record the address, the node will configure it
+            self.setIPRecord(params['ip'])
+
+    def setIPRecord(self, ipstr, prefixLen=None):
+        """Record the IP address / prefix length without configuring it
+           ipstr: IP address, with or without /prefixLen"""
+        if '/' in ipstr:
+            self.ip, prefixLen = ipstr.split('/')
+        else:
+            self.ip = ipstr
+        if prefixLen is None:
+            raise Exception('No prefix length set for IP address %s'
+                            % (ipstr,))
+        self.prefixLen = int(prefixLen)
 
     # block out those interface operations that don't make sense here...
     def rename(self, newname):
@@ -0,0 +1,327 @@
+"""
+Resource metrics sampling for MiniNExT nodes.
+"""
+
+import os
+import threading
+import time
+from array import array
+
+from mininet.log import debug
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+# /proc and cgroup helpers #
+
+
+def getNamespaceID(pid, nsType):
+    "Returns the namespace identifier (e.g. 'pid:[4026531836]') of a process"
+    try:
+        return os.readlink('/proc/%d/ns/%s' % (pid, nsType))
+    except OSError:
+        return None
+
+
+def listPIDs():
+    "Returns the list of PIDs currently visible in /proc"
+    return [int(entry) for entry in os.listdir('/proc') if entry.isdigit()]
+
+
+def getNamespacePIDs(nsTypes, pids=None):
+    """Returns {nsType: {namespaceID: [pids]}} with a single pass over /proc
+       nsTypes: namespace types to group by (e.g. ['pid', 'net'])
+       pids: PIDs to inspect (defaults to every PID in /proc)"""
+    groups = dict((nsType, {}) for nsType in nsTypes)
+    if pids is None:
+        pids = listPIDs()
+    for pid in pids:
+        for nsType in nsTypes:
+            nsID = getNamespaceID(pid, nsType)
+            if nsID is not None:
+                groups[nsType].setdefault(nsID, []).append(pid)
+    return groups
+
+
+def readProcStat(pid):
+    """Returns (state, cpuTicks, rssPages) from /proc/<pid>/stat
+       Returns None if the process has exited"""
+    try:
+        with open('/proc/%d/stat' % pid) as statFile:
+            stat = statFile.read()
+    except IOError:
+        return None
+    # comm may contain spaces / parens, fields resume after the last ')'
+    fields = stat[stat.rfind(')') + 2:].split()
+    # state is field 3, utime/stime are fields 14/15, rss is field 24
+    return fields[0], int(fields[11]) + int(fields[12]), int(fields[21])
+
+
+def countZombies(pids):
+    "Returns the number of zombie (exited, unreaped) processes in pids"
+    zombies = 0
+    for pid in pids:
+        stat = readProcStat(pid)
+        if stat is not None and stat[0] == 'Z':
+            zombies += 1
+    return zombies
+
+
+def readCgroupValue(controller, group, valueFile):
+    "Returns the integer stored in a cgroup value file, or None if missing"
+    try:
+        with open(os.path.join(CGROUP_ROOT, controller, group,
+                               valueFile)) as cgFile:
+            return int(cgFile.read().split()[0])
+    except (IOError, ValueError, IndexError):
+        return None
+
+
+def readCgroupStats(group):
+    """Returns (cpuSeconds, memoryBytes, processCount, zombieCount) for a
+       cgroup. Returns None if the node has no cpuacct/memory cgroup"""
+    cpuNanos = readCgroupValue('cpuacct', group, 'cpuacct.usage')
+    memBytes = readCgroupValue('memory', group, 'memory.usage_in_bytes')
+    if cpuNanos is None or memBytes is None:
+        return None
+    try:
+        with open(os.path.join(CGROUP_ROOT, 'cpuacct', group,
+                               'cgroup.procs')) as procsFile:
+            pids = [int(line) for line in procsFile]
+    except IOError:
+        pids = []
+    return cpuNanos / 1e9, memBytes, len(pids), countZombies(pids)
+
+# Time series storage #
+
+
+class NodeTimeSeries(object):
+
+    """Compact, array-backed resource time series for a single node.
+       cpu is cumulative CPU time (seconds), rss is resident memory (bytes),
+       zombies counts exited processes that have not been reaped"""
+
+    def __init__(self, name, maxSamples=None):
+        """name: name of node
+           maxSamples: number of samples to retain (None for unbounded);
+                       at least two are kept for cpuPercent()"""
+        self.name = name
+        self.maxSamples = maxSamples
+        self.timestamps = array('d')
+        self.cpu = array('d')
+        self.rss = array('L')
+        self.procs = array('L')
+        self.zombies = array('L')
+
+    def append(self, timestamp, cpu, rss, procs, zombies=0):
+        "Record a sample, discarding the oldest samples if full"
+        self.timestamps.append(timestamp)
+        self.cpu.append(cpu)
+        self.rss.append(rss)
+        self.procs.append(procs)
+        self.zombies.append(zombies)
+        if self.maxSamples is not None and \
+                len(self.timestamps) > max(2, self.maxSamples):
+            # trim in blocks to keep the amortized cost of trimming low
+            excess = len(self.timestamps) - max(2, self.maxSamples // 2)
+            for series in (self.timestamps, self.cpu, self.rss, self.procs,
+                           self.zombies):
+                del series[:excess]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def cpuPercent(self, window=None):
+        """Returns CPU utilization (% of one core) between the last sample
+           and the sample window samples earlier (default: first sample)"""
+        if len(self) < 2:
+            return 0.0
+        first = 0 if window is None else max(0, len(self) - 1 - window)
+        elapsed = self.timestamps[-1] - self.timestamps[first]
+        if elapsed <= 0:
+            return 0.0
+        return 100.0 * (self.cpu[-1] - self.cpu[first]) / elapsed
+
+    def maxRSS(self):
+        "Returns the peak resident memory seen for this node"
+        return max(self.rss) if len(self) else 0
+
+    def latest(self):
+        "Returns the most recent (timestamp, cpu, rss, procs, zombies) sample"
+        if not len(self):
+            return None
+        return (self.timestamps[-1], self.cpu[-1], self.rss[-1],
+                self.procs[-1], self.zombies[-1])
+
+# Sampler #
+
+
+class ResourceSampler(object):
+
+    """Periodically samples the CPU and memory used by each node.
+       Uses the node's cgroup when available, otherwise sums /proc data
+       over all processes that share the node's PID (or network) namespace"""
+
+    def __init__(self, nodes, interval=1.0, maxSamples=None, useCgroups=True):
+        """nodes: list of nodes to sample
+           interval: seconds between samples
+           maxSamples: number of samples retained per node (None: unbounded)
+           useCgroups: read a node's cgroup stats when it has a cgroup"""
+        self.nodes = list(nodes)
+        self.interval = interval
+        self.useCgroups = useCgroups
+        self.series = dict((node.name, NodeTimeSeries(node.name, maxSamples))
+                           for node in self.nodes)
+        self.namespaceIDs = {}  # node -> (nsType, namespace ID)
+        self.thread = None
+        self.stopEvent = threading.Event()
+
+    # Sampler control #
+
+    def start(self):
+        "Start sampling in a background thread"
+        if self.isRunning():
+            return
+        self.stopEvent.clear()
+        self.thread = threading.Thread(target=self.run,
+                                       name='mininext-sampler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        "Stop the background sampling thread"
+        if self.thread is None:
+            return
+        self.stopEvent.set()
+        self.thread.join()
+        self.thread = None
+
+    def isRunning(self):
+        "Returns if the background sampling thread is running"
+        return self.thread is not None and self.thread.is_alive()
+
+    def run(self):
+        "Sampling loop (runs in the background thread)"
+        while not self.stopEvent.is_set():
+            started = time.time()
+            try:
+                self.sampleOnce()
+            except Exception as e:  # keep sampling even if a node vanishes
+                debug('*** Resource sampler error: %s\n' % e)
+            self.stopEvent.wait(max(0, self.interval -
+                                    (time.time() - started)))
+
+    # Sampling #
+
+    def namespaceFor(self, node):
+        "Returns the (nsType, namespace ID) used to find a node's processes"
+        if node not in self.namespaceIDs:
+            nsType = None
+            if node.inPIDNamespace:
+                nsType = 'pid'
+            elif node.inNamespace:
+                nsType = 'net'
+            nsID = None
+            if nsType is not None:
+                nsID = getNamespaceID(node.pid, nsType)
+            self.namespaceIDs[node] = (nsType, nsID)
+        return self.namespaceIDs[node]
+
+    def sampleOnce(self):
+        "Take a single sample for every node"
+        now = time.time()
+        pending = []
+        for node in self.nodes:
+            stats = None
+            if self.useCgroups:
+                stats = readCgroupStats(node.name)
+            if stats is not None:
+                self.series[node.name].append(now, *stats)
+            else:
+                pending.append(node)
+        if not pending:
+            return
+
+        # Walk /proc once for all nodes that are not backed by a cgroup
+        nsTypes = set(self.namespaceFor(node)[0] for node in pending)
+        nsTypes.discard(None)
+        groups = getNamespacePIDs(nsTypes) if nsTypes else {}
+        for node in pending:
+            nsType, nsID = self.namespaceFor(node)
+            if nsType is None:
+                pids = [node.pid]
+            else:
+                pids = groups[nsType].get(nsID, [])
+            cpuTicks, rssPages, procs, zombies = 0, 0, 0, 0
+            for pid in pids:
+                stat = readProcStat(pid)
+                if stat is None:
+                    continue
+                cpuTicks += stat[1]
+                rssPages += stat[2]
+                procs += 1
+                if stat[0] == 'Z':
+                    zombies += 1
+            self.series[node.name].append(now, float(cpuTicks) / CLOCK_TICKS,
+                                          rssPages * PAGE_SIZE, procs,
+                                          zombies)
+
+    # Reporting #
+
+    def topConsumers(self, count=5, key='cpu', window=None):
+        """Returns [(name, cpuPercent, rssBytes)] for the top consumers
+           count: number of nodes to return
+           key: 'cpu' (utilization) or 'mem' (latest resident memory)
+           window: number of trailing samples used to compute utilization"""
+        if key not in ('cpu', 'mem'):
+            raise Exception("Unknown resource key %s (expected cpu or mem)"
+                            % (key))
+        summary = []
+        for name, series in self.series.items():
+            latest = series.latest()
+            rss = latest[2] if latest is not None else 0
+            summary.append((name, series.cpuPercent(window), rss))
+        sortIndex = 1 if key == 'cpu' else 2
+        summary.sort(key=lambda entry: entry[sortIndex], reverse=True)
+        return summary[:count]
+
+    def writeCSV(self, path):
+        """Write all samples as CSV
+           (node,timestamp,cpu_seconds,rss_bytes,procs,zombies)"""
+        with open(path, 'w') as csvFile:
+            csvFile.write('node,timestamp,cpu_seconds,rss_bytes,procs,'
+                          'zombies\n')
+            for name in sorted(self.series):
+                series = self.series[name]
+                for i in range(len(series)):
+                    csvFile.write('%s,%.3f,%.3f,%d,%d,%d\n'
+                                  % (name, series.timestamps[i],
+                                     series.cpu[i], series.rss[i],
+                                     series.procs[i], series.zombies[i]))
+
+    def writePrometheus(self, path):
+        """Write the latest sample of each node in Prometheus text format
+           (for the node_exporter textfile collector); replaced atomically"""
+        metrics = [('mininext_node_cpu_seconds_total', 'counter',
+                    'Cumulative CPU time used by the node', 1, '%.3f'),
+                   ('mininext_node_memory_rss_bytes', 'gauge',
+                    'Resident memory used by the node', 2, '%d'),
+                   ('mininext_node_processes', 'gauge',
+                    'Processes running in the node', 3, '%d'),
+                   ('mininext_node_zombie_processes', 'gauge',
+                    'Exited processes not yet reaped in the node', 4, '%d')]
+        lines = []
+        for metric, metricType, helpStr, index, fmt in metrics:
+            lines.append('# HELP %s %s' % (metric, helpStr))
+            lines.append('# TYPE %s %s' % (metric, metricType))
+            for name in sorted(self.series):
+                latest = self.series[name].latest()
+                if latest is None:
+                    continue
+                lines.append(('%s{node="%s"} ' + fmt)
+                             % (metric, name, latest[index]))
+        tmpPath = path + '.tmp'
+        with open(tmpPath, 'w') as promFile:
+            promFile.write('\n'.join(lines) + '\n')
+        os.rename(tmpPath, path)
@@ -15,3 +15,14 @@ def serviceCheck(*args, **kwargs):
             error('Cannot find required service %s in /etc/init.d/.\n' % arg +
                   'Please make sure that %s is installed ' % moduleName)
             exit(1)
+
+
+def executableCheck(*args, **kwargs):
+    "Make sure each executable path in *args exists."
+    moduleName = kwargs.get('moduleName', 'it')
+    for arg in args:
+        _, _, ret = errRun('test -x ' + arg)
+        if ret != 0:
+            error('Cannot find required executable %s.\n' % arg +
+                  'Please make sure that %s is installed ' % moduleName)
+            exit(1)
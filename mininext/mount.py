@@ -7,12 +7,41 @@ class MountProperties(object):
 
     "Contains the properties needed by a mount handler"
 
-    def __init__(self, target, source=None):
+    def __init__(self, target, source=None, mode='bind', base=None,
+                 perms=None, tmpfsSize=None):
         """initializes a mount properties object
            target: either a PathProperties object or a path string
-           source: either a PathProperties object or a path string"""
+           source: either a PathProperties object or a path string
+           mode: 'bind' (bind source over target) or 'overlay' (mount an
+                 overlayfs of source over base, with a writable tmpfs upper
+                 layer private to the node; sources are never modified)
+           base: shared read-only path(s) below source (overlay mode)
+           perms: ObjectPermissions applied on the overlay (overlay mode)
+           tmpfsSize: size of the overlay's tmpfs (e.g. '16m', overlay mode)"""
         self.target = target
         self.source = source
+        self.mode = mode
+        self.base = base
+        self.perms = perms
+        self.tmpfsSize = tmpfsSize
+
+    def hasSource(self):
+        "Returns if there is anything to mount (a source path or a base)"
+        if self.mode == 'overlay' and self.base:
+            return True
+        return getattr(self.source, 'path', self.source) is not None
+
+    def layers(self):
+        "Returns the paths of the read-only layers, topmost first"
+        layers = []
+        source = getattr(self.source, 'path', self.source)
+        if source is not None:
+            layers.append(source)
+        if isinstance(self.base, (list, tuple)):
+            layers += list(self.base)
+        elif self.base is not None:
+            layers.append(self.base)
+        return layers
 
 
 class PathProperties(object):
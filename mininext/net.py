@@ -5,6 +5,19 @@ Extended "net" module for MiniNExT.
 from mininet.log import info
 from mininet.net import Mininet
 
+from mininext.capture import getCaptureEngine, makeCaptures
+from mininext.fabric import FabricBridge
+from mininext.metrics import ResourceSampler
+from mininext.node import Node
+from mininext.placement import makePlacement, formatCPUList
+from mininext.preflight import preflightTopo
+from mininext.reachability import ReachabilityChecker
+from mininext.shaping import LinkProfile, LinkShaper
+from mininext.shard import (applyNodeState, callShards, startShards,
+                            stopShards)
+from mininext.topo import Topo
+from mininext.trace import startTracing, stopTracing
+
 
 class MiniNExT(Mininet):
 
@@ -12,46 +25,316 @@ class MiniNExT(Mininet):
        hosts"""
 
     def __init__(self, *args, **kwargs):
+        """placement: CPU placement policy for hosts ('roundrobin',
+                      'weighted', 'numa', or a Placement object)
+           placementParams: parameters used to construct the policy
+           lazyShell: start hosts without a resident shell (see Node)
+           statelessCmd: with lazyShell, run each cmd() of hosts in its own
+                         bash -c instead of starting their shell (see Node)
+           fabric: 'bridge' to use kernel bridges (FabricBridge) for all
+                   switches; no controller is started unless one is given
+                   or the topology needs one (see Topo.addFabric())
+           shellPool: ShellPool of pre-started shells for hosts; it is
+                      refilled in the background by stop()
+           trace: file to write a trace of the commands run in nodes to
+                  (see mininext.trace); tracing ends with stop()
+           preflight: check the topology's hosts and services before any
+                      node is created, reporting all problems at once
+                      (default True, see mininext.preflight)
+           shards: number of worker processes hosts are partitioned over;
+                   workers configure their hosts, run their services and
+                   shell commands (see mininext.shard), 0 to disable
+           other arguments are passed to Mininet"""
         info("** Using Mininet Extended (MiniNExT) Handler\n")
+        self.sampler = None
+        self.placement = makePlacement(kwargs.pop('placement', None),
+                                       **kwargs.pop('placementParams', {}))
+        self.lazyShell = kwargs.pop('lazyShell', False)
+        self.statelessCmd = kwargs.pop('statelessCmd', False)
+        self.shellPool = kwargs.pop('shellPool', None)
+        self.shardCount = kwargs.pop('shards', 0)
+        self.shards = []
+        self.shaper = LinkShaper()
+        fabric = kwargs.pop('fabric', None)
+        if fabric == 'bridge':
+            kwargs.setdefault('switch', FabricBridge)
+        topo = kwargs.get('topo', args[0] if args else None)
+        if kwargs.pop('preflight', True) and topo is not None:
+            self.preflight(topo)
+        if 'controller' not in kwargs and (
+                fabric == 'bridge' or
+                (isinstance(topo, Topo) and not topo.needsController())):
+            kwargs['controller'] = None
+        self.trace = kwargs.pop('trace', None)
+        if self.trace is not None:
+            startTracing(self.trace)
         Mininet.__init__(self, *args, **kwargs)
 
+    def preflight(self, topo=None):
+        """Check a topology (default: the network's) before it is built,
+           raising an exception that lists every problem found
+           returns: Preflight object (see mininext.preflight)"""
+        topo = topo if topo is not None else self.topo
+        info('*** Running preflight checks\n')
+        return preflightTopo(topo)
+
+    def addHost(self, name, cls=None, **params):
+        """Add host, assigning it a cpuset if a placement policy is set,
+           making it shell-less if lazyShell is set and letting it use the
+           shell pool (if any)
+           name: name of host to add
+           cls: custom host class/constructor (optional)
+           params: parameters for host
+           returns: added host"""
+        hostCls = cls if cls is not None else self.host
+        isNode = isinstance(hostCls, type) and issubclass(hostCls, Node)
+        if self.placement is not None and 'cpuset' not in params and isNode:
+            params['cpuset'], params['cpusetMems'] = \
+                self.placement.place(name, params)
+        if self.lazyShell and isNode:
+            params.setdefault('lazyShell', True)
+            params.setdefault('statelessCmd', self.statelessCmd)
+        if self.shellPool is not None and isNode:
+            params.setdefault('shellPool', self.shellPool)
+        return Mininet.addHost(self, name, cls=cls, **params)
+
+    def getPlacement(self):
+        "Returns {host name: CPU list string} for hosts with a cpuset"
+        return dict((host.name, formatCPUList(host.cpuset))
+                    for host in self.hosts
+                    if getattr(host, 'cpuset', None) is not None)
+
+    def getMountTableSizes(self):
+        """Returns {name: mount table entries} for each host with a mount
+           namespace, plus the host system's table under None"""
+        sizes = dict((host.name, host.mountTableSize())
+                     for host in self.hosts
+                     if getattr(host, 'inMountNamespace', False))
+        with open('/proc/self/mountinfo') as mountFile:
+            sizes[None] = sum(1 for _ in mountFile)
+        return sizes
+
+    def checkReachability(self, hosts=None, loopbacks=True, previous=None,
+                          **params):
+        """Ping every host and loopback address from every host, with all
+           hosts probing concurrently (see ReachabilityChecker)
+           hosts: hosts to check (default: all hosts)
+           loopbacks: include loopback (lo:X) addresses as targets
+           previous: ReachabilityMatrix of an earlier check; only its
+                     failed pairs are probed again and it is updated
+           params: ReachabilityChecker parameters (count, timeout, ...)
+           returns: ReachabilityMatrix"""
+        hosts = hosts if hosts is not None else self.hosts
+        checker = ReachabilityChecker(**params)
+        if previous is not None:
+            matrix = checker.recheck(previous, hosts)
+        else:
+            matrix = checker.check(hosts, loopbacks)
+        info('%s\n' % (matrix))
+        return matrix
+
     def configHosts(self):
         "Configure the networks hosts."
 
+        # Shape links before services (e.g. routing daemons) start
+        self.applyLinkProfiles()
+
+        # Sharded: configure and start services in the worker processes
+        if self.shardCount:
+            return self.configShards()
+
         # Let Mininet handle the baseline initialization
         Mininet.configHosts(self)
 
         info('*** Starting host services\n')
         for host in self.hosts:
-            returnCodes = host.autoStartServices()
-            if returnCodes:
-                # print detailed information on the started services
-                statusStr = "%s: " % (host)
-                for service, returnCode in returnCodes.iteritems():
-                    if returnCode['ret'] == 0:
-                        result = 'OK'
-                    else:
-                        result = 'FAIL'
-                    statusStr += "%s (%s) " % (service, result)
-                info(statusStr + '\n')
+            self.reportServices(host, host.autoStartServices())
+
+    def reportServices(self, host, returnCodes):
+        "Print the results of starting / stopping a host's services"
+        if returnCodes:
+            # print detailed information on the started / stopped services
+            statusStr = "%s: " % (host)
+            for service, returnCode in returnCodes.iteritems():
+                if returnCode['ret'] == 0:
+                    result = 'OK'
+                else:
+                    result = 'FAIL'
+                statusStr += "%s (%s) " % (service, result)
+            info(statusStr + '\n')
+
+    # Sharded orchestration #
+
+    def configShards(self):
+        """Fork the worker processes, then have them configure their hosts
+           and start their services concurrently"""
+        hosts = [host for host in self.hosts if isinstance(host, Node)]
+        info('*** Starting %d shard workers for %d hosts\n'
+             % (self.shardCount, len(hosts)))
+        self.shards = startShards(hosts, self.shardCount)
+        for name, state in callShards(self.shards, 'configure').items():
+            applyNodeState(self.nameToNode[name], state)
+
+        info('*** Starting host services\n')
+        results = callShards(self.shards, 'services', 'autoStartServices')
+        for host in hosts:
+            self.reportServices(host, results.get(host.name))
+
+    def stopShards(self):
+        "Stop the worker processes"
+        if self.shards:
+            info('*** Stopping %d shard workers\n' % (len(self.shards)))
+            stopShards(self.shards)
+            self.shards = []
+
+    # Link shaping #
+
+    def applyLinkProfiles(self):
+        "Apply the topology's link profiles (see Topo.addLink()) in batch"
+        if not isinstance(self.topo, Topo):
+            return
+        shaping = self.topo.getShaping()
+        if not shaping:
+            return
+        settings = []
+        for link in self.links:
+            for intf, peer in ((link.intf1, link.intf2),
+                               (link.intf2, link.intf1)):
+                profile = shaping.get((intf.node.name, peer.node.name))
+                if profile is not None:
+                    settings.append((intf, profile))
+        info('*** Applying link profiles\n')
+        return self.reportShaping(self.shaper.apply(settings))
+
+    def setLinkProfiles(self, profiles):
+        """Change the profiles of many links at once (one tc batch per
+           namespace)
+           profiles: {(node1, node2): profile}, where nodes are nodes or
+                     names, and a profile is a name from the topology's
+                     addLinkProfile(), a LinkProfile, a dict of its
+                     parameters or None to remove shaping; both ends of
+                     every link between the nodes are changed
+           returns: report of LinkShaper.apply()"""
+        settings = []
+        for (node1, node2), profile in profiles.items():
+            if isinstance(profile, basestring) and isinstance(self.topo,
+                                                              Topo):
+                profile = self.topo.getLinkProfile(profile)
+            else:
+                profile = LinkProfile.make(profile)
+            nodes = set(self.nameToNode[node]
+                        if isinstance(node, basestring) else node
+                        for node in (node1, node2))
+            links = [link for link in self.links
+                     if set([link.intf1.node, link.intf2.node]) == nodes]
+            if not links:
+                raise Exception("No link between %s and %s\n"
+                                % (node1, node2))
+            for link in links:
+                settings += [(link.intf1, profile), (link.intf2, profile)]
+        return self.reportShaping(self.shaper.apply(settings))
+
+    def reportShaping(self, report):
+        "Print the timing of a shaping batch, raising if any of it failed"
+        info('*** Shaped %d interfaces in %d namespaces in %.3f s\n'
+             % (report['interfaces'], report['namespaces'], report['time']))
+        if report['errors']:
+            raise Exception("Unable to shape links:\n%s\n" % '\n'.join(
+                '  %s: %s' % (namespace or 'host', err)
+                for namespace, err in sorted(report['errors'].items())))
+        return report
+
+    # Packet capture #
+
+    def startCaptures(self, nodes=None, intfs=None, budget=None, **params):
+        """Capture packets on the interfaces of many nodes with one call
+           nodes: nodes or names (default: all hosts)
+           intfs: names of the interfaces to capture, on the nodes that
+                  have them (default: all but loopbacks)
+           budget: byte budget of all capture files (see CaptureEngine)
+           params: PacketCapture parameters (directory, bpfFilter, snaplen,
+                   rotateBytes, rotateSeconds...)
+           returns: [PacketCapture]"""
+        engine = getCaptureEngine()
+        if budget is not None:
+            engine.budget = budget
+        captures = []
+        for node in self.getNodes(nodes):
+            nodeIntfs = intfs if intfs is None else \
+                [intf for intf in intfs if intf in node.nameToIntf]
+            captures += makeCaptures(node, nodeIntfs, **params)
+        started = engine.start(captures)
+        info('*** Capturing packets on %d interfaces\n' % (len(started)))
+        return started
+
+    def stopCaptures(self, nodes=None):
+        """Stop the captures of many nodes (default: all captures)
+           returns: {PacketCapture: stats}"""
+        engine = getCaptureEngine()
+        captures = None
+        if nodes is not None:
+            captures = [capture for node in self.getNodes(nodes)
+                        for capture in engine.nodeCaptures(node)]
+        stats = engine.stop(captures)
+        if stats:
+            info('*** Stopped %d captures (%d packets)\n'
+                 % (len(stats), sum(captureStats['packets']
+                                    for captureStats in stats.values())))
+        return stats
+
+    def getNodes(self, nodes=None):
+        "Returns nodes given as nodes or names (default: all hosts)"
+        if nodes is None:
+            return self.hosts
+        return [self.nameToNode[node] if isinstance(node, basestring)
+                else node for node in nodes]
+
+    # Resource monitoring #
+
+    def startSampler(self, interval=1.0, nodes=None, **kwargs):
+        """Start sampling per-node CPU and memory use in the background
+           interval: seconds between samples
+           nodes: nodes to sample (defaults to all hosts)
+           kwargs: additional ResourceSampler parameters
+           returns: ResourceSampler object"""
+        self.stopSampler()
+        if nodes is None:
+            nodes = self.hosts
+        self.sampler = ResourceSampler(nodes, interval=interval, **kwargs)
+        self.sampler.start()
+        return self.sampler
+
+    def stopSampler(self):
+        "Stop the background resource sampler (samples are kept)"
+        if self.sampler is not None:
+            self.sampler.stop()
 
     def stop(self):
         "Stop the controller(s), switches and hosts"
 
+        # Stop sampling and capturing before nodes begin to disappear
+        self.stopSampler()
+        self.stopCaptures()
+
         # First, stop all services in the network
         info('*** Stopping host services\n')
-        for host in self.hosts:
-            returnCodes = host.autoStopServices()
-            if returnCodes:
-                # print detailed information on the stopped services
-                statusStr = "%s: " % (host)
-                for service, returnCode in returnCodes.iteritems():
-                    if returnCode['ret'] == 0:
-                        result = 'OK'
-                    else:
-                        result = 'FAIL'
-                    statusStr += "%s (%s) " % (service, result)
-                info(statusStr + '\n')
+        if self.shards:
+            results = callShards(self.shards, 'services', 'autoStopServices')
+            for host in self.hosts:
+                self.reportServices(host, results.get(host.name))
+        else:
+            for host in self.hosts:
+                self.reportServices(host, host.autoStopServices())
 
         # Then, let Mininet take over and stop everything
+        # (workers still run link teardown commands in their nodes)
         Mininet.stop(self)
+        self.stopShards()
+
+        # Replace the pooled shells used by this run for the next one
+        if self.shellPool is not None:
+            self.shellPool.fill()
+
+        # Write out the rest of the command trace
+        if self.trace is not None:
+            stopTracing()
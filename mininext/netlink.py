@@ -0,0 +1,445 @@
+"""
+In-process netlink configuration engine for MiniNExT.
+
+Configures addresses, routes and links inside node network namespaces
+without spawning ip / ifconfig. A netlink socket is bound to the network
+namespace that is current when it is created, so each node's socket is
+created once from a worker thread that has joined the node's namespace
+(via the node's shell PID) and then reused from any thread.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import struct
+import threading
+
+# Namespace handling #
+
+CLONE_NEWNET = 0x40000000
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+
+def setns(fd, nstype=0):
+    "Move the calling thread into the namespace referred to by fd"
+    if _libc.setns(fd, nstype) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def callInNetNamespace(pid, function, *args):
+    """Call function(*args) from a worker thread inside the network
+       namespace of pid; returns its result or re-raises its exception"""
+    result = {}
+
+    def worker():
+        "Join the namespace, call function, then return to our namespace"
+        hostNS = os.open('/proc/self/ns/net', os.O_RDONLY)
+        nodeNS = None
+        try:
+            nodeNS = os.open('/proc/%d/ns/net' % pid, os.O_RDONLY)
+            setns(nodeNS, CLONE_NEWNET)
+            try:
+                result['value'] = function(*args)
+            finally:
+                setns(hostNS, CLONE_NEWNET)
+        except Exception as e:  # handed back to the calling thread
+            result['error'] = e
+        finally:
+            os.close(hostNS)
+            if nodeNS is not None:
+                os.close(nodeNS)
+
+    thread = threading.Thread(target=worker, name='mininext-netns-%d' % pid)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+
+# Netlink protocol constants #
+
+NETLINK_ROUTE = 0
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+NLM_F_REQUEST = 0x1
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLM_F_REPLACE = 0x100
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+
+RTM_NEWLINK = 16
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+
+IFLA_IFNAME = 3
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+
+IFF_UP = 0x1
+RT_TABLE_MAIN = 254
+RTPROT_BOOT = 3
+RT_SCOPE_UNIVERSE = 0
+RT_SCOPE_LINK = 253
+RT_SCOPE_HOST = 254
+RTN_UNICAST = 1
+
+NLMSGHDR = struct.Struct('=IHHII')
+NLMSGERR = struct.Struct('=i')
+IFINFOMSG = struct.Struct('=BxHiII')
+IFADDRMSG = struct.Struct('=BBBBI')
+RTMSG = struct.Struct('=BBBBBBBBI')
+RTATTR = struct.Struct('=HH')
+
+RECV_SIZE = 1 << 16
+RCVBUF_SIZE = 1 << 20  # room for the acks of a chunk of requests
+CHUNK_SIZE = 128  # requests sent per write before waiting for their acks
+SOCKET_TIMEOUT = 10.0  # seconds to wait for the kernel's replies
+
+
+def align(length):
+    "Netlink messages and attributes are 4 byte aligned"
+    return (length + 3) & ~3
+
+
+def packAttr(attrType, data):
+    "Returns a packed (and padded) netlink attribute"
+    length = RTATTR.size + len(data)
+    return RTATTR.pack(length, attrType) + data + \
+        b'\0' * (align(length) - length)
+
+
+def unpackAttrs(data):
+    "Returns {attrType: data} for a block of netlink attributes"
+    attrs = {}
+    offset = 0
+    while offset + RTATTR.size <= len(data):
+        length, attrType = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        attrs[attrType] = data[offset + RTATTR.size:offset + length]
+        offset += align(length)
+    return attrs
+
+
+def packIPv4(ip):
+    "Returns the packed form of a dotted quad IPv4 address"
+    return socket.inet_aton(ip)
+
+
+def netlinkAvailable():
+    "Returns if this process can use the netlink engine"
+    return os.geteuid() == 0 and hasattr(_libc, 'setns') and \
+        hasattr(socket, 'AF_NETLINK') and os.path.exists('/proc/self/ns/net')
+
+
+class NetlinkError(Exception):
+
+    "Raised when the kernel rejects a netlink request"
+
+    def __init__(self, err, message):
+        Exception.__init__(self, message)
+        self.errno = err
+
+# Engine #
+
+
+class NetlinkEngine(object):
+
+    """Issues batched rtnetlink requests inside node network namespaces.
+       Sockets are opened once per node and cached until release()"""
+
+    def __init__(self):
+        self.sockets = {}  # node -> netlink socket in node's namespace
+        self.locks = {}  # node -> lock serializing use of node's socket
+        self.lock = threading.Lock()
+        self.seq = 0
+
+    # Socket management #
+
+    @staticmethod
+    def openSocket():
+        "Returns a netlink socket in the current thread's namespace"
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                             NETLINK_ROUTE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF_SIZE)
+        sock.settimeout(SOCKET_TIMEOUT)
+        sock.bind((0, 0))
+        return sock
+
+    def socketFor(self, node):
+        "Returns (socket, lock) bound to the node's network namespace"
+        with self.lock:
+            if node not in self.sockets:
+                if node.inNamespace:
+                    sock = callInNetNamespace(node.pid, self.openSocket)
+                else:
+                    sock = self.openSocket()
+                self.sockets[node] = sock
+                self.locks[node] = threading.Lock()
+            return self.sockets[node], self.locks[node]
+
+    def release(self, node):
+        "Closes the node's netlink socket"
+        with self.lock:
+            sock = self.sockets.pop(node, None)
+            self.locks.pop(node, None)
+        if sock is not None:
+            sock.close()
+
+    def nextSeq(self):
+        "Returns the next netlink sequence number"
+        with self.lock:
+            self.seq = (self.seq + 1) & 0xffffffff
+            return self.seq
+
+    # Request handling #
+
+    def request(self, node, messages):
+        """Sends a batch of requests in chunks of CHUNK_SIZE writes, waiting
+           for the acks of each chunk (so they cannot overflow the socket)
+           messages: list of (msgType, flags, payload)
+           raises NetlinkError for the first request the kernel rejected,
+           socket.error if the socket fails or times out"""
+        if not messages:
+            return
+        sock, lock = self.socketFor(node)
+        firstError = None
+        with lock:
+            try:
+                for start in range(0, len(messages), CHUNK_SIZE):
+                    error = self.requestChunk(
+                        sock, node, messages[start:start + CHUNK_SIZE])
+                    if firstError is None:
+                        firstError = error
+            except socket.error:
+                # replies may still be queued: start over with a new socket
+                self.release(node)
+                raise
+        if firstError is not None:
+            raise firstError
+
+    def requestChunk(self, sock, node, messages):
+        """Sends requests in one write and waits for every ack (the caller
+           holds the socket's lock)
+           returns: NetlinkError for the first rejected request, or None"""
+        pending = {}
+        batch = []
+        for msgType, flags, payload in messages:
+            seq = self.nextSeq()
+            pending[seq] = msgType
+            batch.append(NLMSGHDR.pack(NLMSGHDR.size + len(payload),
+                                       msgType,
+                                       flags | NLM_F_REQUEST | NLM_F_ACK,
+                                       seq, 0) + payload)
+        firstError = None
+        sock.sendall(b''.join(batch))
+        while pending:
+            for msgType, seq, data in self.receive(sock):
+                if msgType != NLMSG_ERROR or seq not in pending:
+                    continue
+                err = -NLMSGERR.unpack_from(data)[0]
+                requestType = pending.pop(seq)
+                if err and firstError is None:
+                    firstError = NetlinkError(
+                        err, "netlink request %d failed on node %s: %s"
+                        % (requestType, node, os.strerror(err)))
+        return firstError
+
+    def dump(self, node, msgType, payload):
+        "Returns [(msgType, data)] for a dump request"
+        sock, lock = self.socketFor(node)
+        seq = self.nextSeq()
+        results = []
+        with lock:
+            try:
+                sock.sendall(NLMSGHDR.pack(NLMSGHDR.size + len(payload),
+                                           msgType,
+                                           NLM_F_REQUEST | NLM_F_DUMP, seq,
+                                           0) + payload)
+                while True:
+                    for replyType, replySeq, data in self.receive(sock):
+                        if replySeq != seq:
+                            continue
+                        if replyType == NLMSG_DONE:
+                            return results
+                        if replyType == NLMSG_ERROR:
+                            err = -NLMSGERR.unpack_from(data)[0]
+                            raise NetlinkError(
+                                err, "netlink dump failed on node %s: %s"
+                                % (node, os.strerror(err)))
+                        results.append((replyType, data))
+            except socket.error:
+                # replies may still be queued: start over with a new socket
+                self.release(node)
+                raise
+
+    @staticmethod
+    def receive(sock):
+        "Returns [(msgType, seq, data)] for the messages in one read"
+        buf = sock.recv(RECV_SIZE)
+        messages = []
+        offset = 0
+        while offset + NLMSGHDR.size <= len(buf):
+            length, msgType, _, seq, _ = NLMSGHDR.unpack_from(buf, offset)
+            if length < NLMSGHDR.size:
+                break
+            messages.append((msgType, seq,
+                             buf[offset + NLMSGHDR.size:offset + length]))
+            offset += align(length)
+        return messages
+
+    # Links #
+
+    def getLinks(self, node):
+        "Returns {interface name: index} for the node's namespace"
+        links = {}
+        for _, data in self.dump(node, RTM_GETLINK,
+                                 IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0,
+                                                0)):
+            index = IFINFOMSG.unpack_from(data)[2]
+            attrs = unpackAttrs(data[IFINFOMSG.size:])
+            if IFLA_IFNAME in attrs:
+                name = attrs[IFLA_IFNAME].rstrip(b'\0').decode()
+                links[name] = index
+        return links
+
+    def linkIndex(self, node, ifname, links=None):
+        "Returns the index of an interface in the node's namespace"
+        if links is None:
+            links = self.getLinks(node)
+        # aliases (lo:1, eth0:2) are labels on the underlying interface
+        base = ifname.split(':')[0]
+        if base not in links:
+            raise NetlinkError(errno.ENODEV, "No interface %s on node %s"
+                               % (ifname, node))
+        return links[base]
+
+    def setLinksUp(self, node, ifnames, up=True):
+        "Sets the administrative state of a list of interfaces"
+        links = self.getLinks(node)
+        self.request(node, [
+            (RTM_NEWLINK, 0,
+             IFINFOMSG.pack(socket.AF_UNSPEC, 0,
+                            self.linkIndex(node, ifname, links),
+                            IFF_UP if up else 0, IFF_UP))
+            for ifname in ifnames])
+
+    # Addresses #
+
+    @staticmethod
+    def addrMessage(index, ip, prefixLen, label=None):
+        "Returns an ifaddrmsg payload for an IPv4 address"
+        scope = RT_SCOPE_HOST if ip.startswith('127.') else RT_SCOPE_UNIVERSE
+        payload = IFADDRMSG.pack(socket.AF_INET, prefixLen, 0, scope, index)
+        payload += packAttr(IFA_LOCAL, packIPv4(ip))
+        payload += packAttr(IFA_ADDRESS, packIPv4(ip))
+        if label is not None:
+            payload += packAttr(IFA_LABEL, label.encode() + b'\0')
+        return payload
+
+    def addAddresses(self, node, addresses):
+        """Adds IPv4 addresses in a single batch
+           addresses: list of (ifname, ip, prefixLen), where ifname may be
+                      an alias label such as lo:1"""
+        links = self.getLinks(node)
+        self.request(node, [
+            (RTM_NEWADDR, NLM_F_CREATE | NLM_F_REPLACE,
+             self.addrMessage(self.linkIndex(node, ifname, links), ip,
+                              prefixLen, ifname))
+            for ifname, ip, prefixLen in addresses])
+
+    def getAddresses(self, node, index=None):
+        "Returns [(index, ip, prefixLen, label)] of IPv4 addresses"
+        addresses = []
+        for _, data in self.dump(node, RTM_GETADDR,
+                                 IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0)):
+            _, prefixLen, _, _, addrIndex = IFADDRMSG.unpack_from(data)
+            if index is not None and addrIndex != index:
+                continue
+            attrs = unpackAttrs(data[IFADDRMSG.size:])
+            ip = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+            if ip is None:
+                continue
+            label = attrs.get(IFA_LABEL, b'').rstrip(b'\0').decode()
+            addresses.append((addrIndex, socket.inet_ntoa(ip), prefixLen,
+                              label))
+        return addresses
+
+    def setAddress(self, node, ifname, ip, prefixLen):
+        """Replaces an interface's address and brings it up (as ifconfig
+           <intf> <ip>/<prefixLen> up would)"""
+        links = self.getLinks(node)
+        index = self.linkIndex(node, ifname, links)
+        messages = [(RTM_DELADDR, 0, self.addrMessage(index, oldIP, oldLen))
+                    for _, oldIP, oldLen, label
+                    in self.getAddresses(node, index)
+                    if label == ifname and (oldIP, oldLen) != (ip, prefixLen)]
+        messages.append((RTM_NEWADDR, NLM_F_CREATE | NLM_F_REPLACE,
+                         self.addrMessage(index, ip, prefixLen, ifname)))
+        messages.append((RTM_NEWLINK, 0,
+                         IFINFOMSG.pack(socket.AF_UNSPEC, 0, index, IFF_UP,
+                                        IFF_UP)))
+        self.request(node, messages)
+
+    # Routes #
+
+    def addRoutes(self, node, routes, replace=True):
+        """Adds IPv4 routes to the main table in a single batch
+           routes: list of (dst, prefixLen, gateway, ifname); gateway or
+                   ifname may be None"""
+        links = None
+        messages = []
+        flags = NLM_F_CREATE | (NLM_F_REPLACE if replace else NLM_F_EXCL)
+        for dst, prefixLen, gateway, ifname in routes:
+            scope = RT_SCOPE_UNIVERSE if gateway else RT_SCOPE_LINK
+            payload = RTMSG.pack(socket.AF_INET, prefixLen, 0, 0,
+                                 RT_TABLE_MAIN, RTPROT_BOOT, scope,
+                                 RTN_UNICAST, 0)
+            if prefixLen:
+                payload += packAttr(RTA_DST, packIPv4(dst))
+            if gateway:
+                payload += packAttr(RTA_GATEWAY, packIPv4(gateway))
+            if ifname:
+                if links is None:
+                    links = self.getLinks(node)
+                payload += packAttr(RTA_OIF, struct.pack(
+                    '=i', self.linkIndex(node, ifname, links)))
+            messages.append((RTM_NEWROUTE, flags, payload))
+        self.request(node, messages)
+
+    def deleteRoutes(self, node, routes):
+        """Deletes IPv4 routes from the main table in a single batch
+           routes: list of (dst, prefixLen)"""
+        self.request(node, [
+            (RTM_DELROUTE, 0,
+             RTMSG.pack(socket.AF_INET, prefixLen, 0, 0, RT_TABLE_MAIN, 0,
+                        RT_SCOPE_UNIVERSE, RTN_UNICAST, 0) +
+             (packAttr(RTA_DST, packIPv4(dst)) if prefixLen else b''))
+            for dst, prefixLen in routes])
+
+
+_engine = None
+
+
+def getNetlinkEngine():
+    "Returns the shared NetlinkEngine, or None if netlink is unavailable"
+    global _engine
+    if _engine is None and netlinkAvailable():
+        _engine = NetlinkEngine()
+    return _engine
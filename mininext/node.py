@@ -2,8 +2,10 @@
 Extended node object for MiniNExT.
 """
 
+import os
 import signal
 import select
+import socket
 import shutil
 import tempfile
 from subprocess import Popen, PIPE, STDOUT
@@ -11,10 +13,20 @@ from subprocess import Popen, PIPE, STDOUT
 from mininet.node import Node as BaseNode
 from mininet.log import error, debug
 
+from mininext.capture import getCaptureEngine, makeCaptures
 from mininext.link import LoopbackIntf
+from mininext.metrics import countZombies, getNamespaceID, getNamespacePIDs
 from mininext.util import (checkPath, getObjectPerms, createDirIfNeeded,
                            setDirPerms, doDirPermsEqual)
 from mininext.mount import MountProperties, PathProperties
+from mininext.placement import formatCPUList
+from mininext.netlink import (getNetlinkEngine, NetlinkError,
+                              callInNetNamespace, netlinkAvailable)
+from mininext.sysctl import resolveSysctls, validateSysctls, writeSysctls
+from mininext.trace import TracedPopen, getTracer, monotonic
+
+CPUSET_ROOT = '/sys/fs/cgroup/cpuset'
+PID_DIR = '/var/run/mn'  # PID files for nodes without a mininet:<name> shell
 
 
 class Node(BaseNode):
@@ -22,17 +34,36 @@ class Node(BaseNode):
     """A Mininet node with various extensions and enhancements."""
 
     def __init__(self, name, inMountNamespace=False, inPIDNamespace=False,
-                 inUTSNamespace=False, **params):
+                 inUTSNamespace=False, cpuset=None, cpusetMems=None,
+                 useNetlink=True, lazyShell=False, useInit=False,
+                 mountPropagation='private', shellPool=None,
+                 statelessCmd=False, **params):
         """name: name of node
            inNamespace: in network namespace?
            inMountNamespace: has private mountspace?
            inPIDNamespace: has private PID namespace?
+           cpuset: list of CPUs the node's processes are restricted to
+           cpusetMems: list of NUMA memory nodes for the cpuset
+           useNetlink: configure addresses via in-process netlink if possible
+           lazyShell: hold the namespaces with a minimal process and only
+                      start a shell when one is needed (see startShell())
+           statelessCmd: with lazyShell, run each cmd() in its own bash -c
+                         instead of starting the shell; shell state (cd,
+                         variables, functions, lastPid) is then not kept
+                         between cmd() calls
+           useInit: run mxexec's minimal init as PID 1 of the node's PID
+                    namespace, reaping orphaned processes
+           mountPropagation: 'private' or 'slave' (receive host mounts)
+                             propagation for the mount namespace
+           shellPool: ShellPool to claim a pre-started shell from
            params: Node parameters (see config() for details)"""
 
         # PID and Mount Namespace handling
         self.inPIDNamespace = inPIDNamespace
         self.inUTSNamespace = inUTSNamespace
         self.inMountNamespace = inMountNamespace
+        self.useInit = useInit
+        self.mountPropagation = mountPropagation
 
         # Private config monitoring
         self.hasPrivateLogs = False
@@ -41,13 +72,36 @@ class Node(BaseNode):
         # Sanity check on namespace config
         if self.inPIDNamespace is True and self.inMountNamespace is False:
             raise Exception('PID namespaces require mount namespace for /proc')
+        if self.useInit is True and self.inPIDNamespace is False:
+            raise Exception('useInit requires a PID namespace')
+        if self.mountPropagation not in ('private', 'slave'):
+            raise Exception('mountPropagation must be private or slave')
 
         # Stash extended configuration information
         self.services = {}  # dict of services and parameters for this node
         self.privateMounts = {}  # dict of private mounts for this node
+        self.overlayDirs = []  # host dirs holding the node's overlay tmpfs
 
         # Network information
         self.loIntfs = {}
+        self.useNetlink = useNetlink
+        self.sysctls = {}  # sysctl values applied in the node's namespace
+
+        # CPU placement (cpuset cgroup named after the node)
+        self.cpuset = cpuset
+        self.cpusetMems = cpusetMems
+        self.cgroup = None
+
+        # Shell-less operation (namespaces held by a holder process)
+        self.lazyShell = lazyShell
+        self.statelessCmd = statelessCmd
+        self.holder = None
+
+        # Pre-started shells (see mininext.pool)
+        self.shellPool = shellPool
+
+        # Worker process owning the node's shell (see mininext.shard)
+        self.shard = None
 
         # Request initialization of the BaseNode
         BaseNode.__init__(self, name, **params)
@@ -57,30 +111,99 @@ class Node(BaseNode):
     # Override on startShell() to support PID and mount namespaces
     def startShell(self):
         """Overrides the default shell start process to handle
-           the addition of PID, UTS, and mount namespaces."""
+           the addition of PID, UTS, and mount namespaces.
+           With lazyShell, the first call only starts the holder process;
+           the shell is started inside its namespaces by sendCmd().
+           With a shellPool, a pre-started shell is used if available"""
         if self.shell:
             error("%s: shell is already running")
             return
+        if self.lazyShell and self.holder is None:
+            self.startHolder()
+            return
+        if self.holder is not None:
+            # join the namespaces held by the holder, which keeps self.pid
+            self.shell = self.popen(['bash', '-ms', 'mininet:' + self.name],
+                                    stdin=PIPE, stdout=PIPE, stderr=STDOUT,
+                                    close_fds=True)
+            self.setupShellIO()
+            return
+        if self.shellPool is not None and self.cpuset is None:
+            # adopt a pre-started shell with the same namespace settings
+            pooled = self.shellPool.claim(self.namespaceKey())
+            if pooled is not None:
+                self.shell = pooled.popen
+                self.setupShellIO()
+                self.pid = pooled.pid
+                self.writePIDFile()
+                return
+        # bash -m: enable job control
+        # -s: pass $* to shell, and make process easy to find in ps
+        cmd = self.namespaceCmd() + ['bash', '-ms', 'mininet:' + self.name]
+        self.shell = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=STDOUT,
+                           close_fds=True)
+        self.setupShellIO()
+        self.pid = self.shell.pid
+
+        # If this node has a private PID space, grab the PID to attach to
+        # (the PID of the init when useInit is set, which shares the
+        # shell's namespaces). Otherwise, we use the same PID as the shell's
+        if self.inPIDNamespace:
+            # monitor() will grab shell's true PID and put in self.lastPid
+            self.monitor()
+            if self.lastPid is None:
+                raise Exception('Unable to determine shell\'s PID')
+            self.pid = self.lastPid
+            self.lastPid = None
+
+    def namespaceKey(self):
+        "Returns the namespace settings of the node (see namespaceOpts())"
+        return (self.inNamespace, self.inMountNamespace, self.inPIDNamespace,
+                self.inUTSNamespace, self.useInit, self.mountPropagation)
+
+    @staticmethod
+    def namespaceOpts(inNamespace, inMountNamespace, inPIDNamespace,
+                      inUTSNamespace, useInit, mountPropagation):
+        "Returns the mxexec options that create a node's namespaces"
         # mnexec: (c)lose descriptors, (d)etach from tty,
         # (p)rint pid, and run in (n)etwork namespace,
-        # (m)ount namespace, p(i)d namespace, mount proc(f)s
+        # (m)ount namespace (with (S)lave propagation),
+        # p(i)d namespace, mount proc(f)s, minimal ini(t) as PID 1
         opts = '-cdp'
-        if self.inNamespace:
+        if inNamespace:
             opts += 'n'
-        if self.inMountNamespace:
+        if inMountNamespace:
             opts += 'm'
-        if self.inPIDNamespace:
+            if mountPropagation == 'slave':
+                opts += 'S'
+        if inPIDNamespace:
             opts += 'if'
-        if self.inUTSNamespace:
+            if useInit:
+                opts += 't'
+        if inUTSNamespace:
             opts += 'u'
-        # bash -m: enable job control
-        # -s: pass $* to shell, and make process easy to find in ps
-        cmd = ['mxexec', opts, 'bash', '-ms', 'mininet:' + self.name]
-        self.shell = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=STDOUT,
-                           close_fds=True)
+        return opts
+
+    def namespaceFlags(self):
+        "Returns the names of the node's private namespaces"
+        flags = zip(('net', 'mnt', 'pid', 'uts'),
+                    (self.inNamespace, self.inMountNamespace,
+                     self.inPIDNamespace, self.inUTSNamespace))
+        return [name for name, private in flags if private]
+
+    def namespaceCmd(self):
+        "Returns the mxexec command that creates the node's namespaces"
+        cmd = ['mxexec', self.namespaceOpts(*self.namespaceKey())]
+        # (g)roup: run in the node's cpuset cgroup
+        if self.cpuset is not None:
+            self.setupCPUSet()
+            cmd += ['-g', self.cgroup]
+        return cmd
+
+    def setupShellIO(self):
+        "Set up the pipes and poll object used to talk to the shell"
         self.stdin = self.shell.stdin
         self.stdout = self.shell.stdout
-        self.pid = self.shell.pid
         self.pollOut = select.poll()
         self.pollOut.register(self.stdout)
         # Maintain mapping between file descriptors and nodes
@@ -94,15 +217,115 @@ class Node(BaseNode):
         self.readbuf = ''
         self.waiting = False
 
-        # If this node has a private PID space, grab the PID to attach to
-        # Otherwise, we use the same PID as the shell's PID
-        if self.inPIDNamespace:
-            # monitor() will grab shell's true PID and put in self.lastPid
-            self.monitor()
-            if self.lastPid is None:
-                raise Exception('Unable to determine shell\'s PID')
-            self.pid = self.lastPid
-            self.lastPid = None
+    # Shell-less operation #
+
+    def startHolder(self):
+        """Start the process that holds the node's namespaces: cat, blocked
+           reading a pipe, so it exits with MiniNExT"""
+        self.holder = Popen(self.namespaceCmd() + ['cat'], stdin=PIPE,
+                            stdout=PIPE, close_fds=True)
+        # mxexec prints the (host) PID of the process holding the namespaces
+        line = self.holder.stdout.readline()
+        self.holder.stdout.close()
+        if not line.startswith('\001'):
+            raise Exception('Unable to determine holder PID of %s'
+                            % (self.name))
+        self.pid = int(line[1:])
+        self.writePIDFile()
+
+    def pidFile(self):
+        "Returns the path of the node's PID file (used by util/mx)"
+        return os.path.join(PID_DIR, '%s.pid' % (self.name))
+
+    def writePIDFile(self):
+        """Record the node's PID for util/mx, which otherwise looks for a
+           shell named mininet:<name> (pooled shells and holders are not)"""
+        createDirIfNeeded(PID_DIR, recursive=True)
+        with open(self.pidFile(), 'w') as pidFile:
+            pidFile.write('%d\n' % (self.pid))
+
+    def stopHolder(self):
+        "Kill the holder process and the lazily started shell (if any)"
+        if self.shell is not None and self.shell.poll() is None:
+            try:
+                # mxexec -d made the shell a process group leader
+                os.killpg(self.shell.pid, signal.SIGKILL)
+            except OSError:
+                self.shell.kill()
+        # killing the holder also ends everything in its PID namespace
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.holder.stdin.close()
+        self.holder.wait()
+        if self.shell is not None:
+            self.shell.wait()
+            self.shell = None
+        self.holder = None
+
+    # Override on sendCmd() to start the shell of shell-less nodes
+    def sendCmd(self, *args, **kwargs):
+        """Send a command to the node's shell, starting the shell first
+           for shell-less nodes"""
+        if self.shard is not None:
+            return self.shard.sendCmd(self, *args, **kwargs)
+        if self.shell is None and self.holder is not None:
+            self.startShell()
+        return BaseNode.sendCmd(self, *args, **kwargs)
+
+    # Override on cmd() to start the shell of shell-less nodes
+    def cmd(self, *args, **kwargs):
+        """Send a command, wait for output, and return it.
+           Shell-less nodes start their shell on the first command; with
+           statelessCmd they instead run each command with its own bash -c,
+           except background (&) commands, which start the node's shell"""
+        if self.shard is not None:
+            return self.shard.cmd(self, *args, **kwargs)
+        if self.shell is None and self.holder is not None and \
+                not self.statelessCmd:
+            self.startShell()
+        if self.shell is not None or self.holder is None:
+            return self.shellCmd(*args, **kwargs)
+        if len(args) == 1 and isinstance(args[0], list):
+            args = args[0]
+        command = ' '.join(str(arg) for arg in args)
+        if command.rstrip().endswith('&'):
+            return self.shellCmd(command, **kwargs)
+        debug('*** %s : %s\n' % (self.name, command))
+        popen = self.popen(['bash', '-c', command], stdin=PIPE, stdout=PIPE,
+                           stderr=STDOUT)
+        output, _ = popen.communicate()
+        return output
+
+    # Overrides on monitor() and waitOutput() for nodes owned by a shard
+    def monitor(self, timeoutms=None, findPid=True):
+        """Monitor and return the output of a command (see sendCmd())
+           timeoutms: timeout in ms or None to wait indefinitely
+           findPid: look for PID from mxexec -p"""
+        if self.shard is not None:
+            return self.shard.monitor(self, timeoutms)
+        return BaseNode.monitor(self, timeoutms, findPid)
+
+    def waitOutput(self, verbose=False, findPid=True):
+        """Wait for a command to complete, returns its output
+           verbose: print output interactively"""
+        if self.shard is not None:
+            return self.shard.waitOutput(self)
+        return BaseNode.waitOutput(self, verbose, findPid)
+
+    def shellCmd(self, *args, **kwargs):
+        "Run a command in the node's shell (BaseNode.cmd()), tracing it"
+        tracer = getTracer()
+        if tracer is None:
+            return BaseNode.cmd(self, *args, **kwargs)
+        start = monotonic()
+        output = BaseNode.cmd(self, *args, **kwargs)
+        argv = args[0] if len(args) == 1 and isinstance(args[0], list) \
+            else args
+        tracer.record(self, 'cmd', [str(arg) for arg in argv], start,
+                      monotonic(), None, len(output))
+        return output
 
     # Override on popen() to support mount and PID namespaces
     def popen(self, *args, **kwargs):
@@ -124,6 +347,9 @@ class Node(BaseNode):
         if self.inUTSNamespace:
             opts.append('-j')
             opts.append(str(self.pid))
+        if self.cgroup is not None:
+            opts.append('-g')
+            opts.append(self.cgroup)
         defaults = {'stdout': PIPE, 'stderr': PIPE,
                     'mncmd': opts}
         defaults.update(kwargs)
@@ -142,10 +368,15 @@ class Node(BaseNode):
         # Form the command to hand off
         mncmd = defaults['mncmd']
         del defaults['mncmd']
+        tracer = getTracer()
+        argv = cmd
         cmd = mncmd + cmd
         # Shell requires a string, not a list!
         if defaults.get('shell', False):
             cmd = ' '.join(cmd)
+        if tracer is not None:
+            return TracedPopen(cmd, tracer=tracer, node=self, argv=argv,
+                               **defaults)
         return Popen(cmd, **defaults)
 
     # Override on sendInt() to handle PID namespaces
@@ -160,6 +391,21 @@ class Node(BaseNode):
         else:
             BaseNode.sendInt(self)
 
+    # Override on terminate() to release the node's cpuset
+    def terminate(self):
+        "Send kill signal to Node and clean up after it."
+        if self.holder is not None:
+            self.stopHolder()
+        BaseNode.terminate(self)
+        if os.path.exists(self.pidFile()):
+            os.remove(self.pidFile())
+        self.removeCPUSet()
+        self.removeOverlayDirs()
+        self.stopCapture()
+        engine = getNetlinkEngine()
+        if engine is not None:
+            engine.release(self)
+
     # Override on setParam() to handle passing dicts with non-string keywords
     def setParam(self, results, method, **param):
         """Internal method: configure a *single* parameter
@@ -195,7 +441,7 @@ class Node(BaseNode):
     # Override on config() to support extended parameters
     def config(self, privateLogDir=None, privateRunDir=None,
                privateMounts=None, services=None, hostname=None,
-               loIntfs=None, **_params):
+               loIntfs=None, sysctlProfile=None, sysctls=None, **_params):
         """Configure Node according to (optional) parameters:
            mac: MAC address for default interface
            ip: IP address for default interface
@@ -204,9 +450,14 @@ class Node(BaseNode):
            privateRunDir = boolean or path to dir to bind over /run
            privateMounts = mount / path properties objects
            loopbackIntfs = list of loopback interfaces and parameters
-           services = service objects for service manager"""
+           services = service objects for service manager
+           sysctlProfile = name or list of names of sysctl profiles
+           sysctls = dict of sysctl settings (override profile values)"""
 
         r = BaseNode.config(self, **_params)
+        # Apply kernel settings before anything starts in the namespace
+        if sysctlProfile is not None or sysctls is not None:
+            r['sysctls'] = self.setupSysctls(sysctlProfile, sysctls)
         # Process private mounts and services in this order:
         # (1) - privateLogDir (/var/log), privateRunDir (/run) if requested
         # (2) - user private mounts
@@ -223,6 +474,73 @@ class Node(BaseNode):
     # Additional extensions #
 
     # Network Handlers #
+    def netlink(self):
+        "Returns the netlink engine if this node may use it, else None"
+        if self.useNetlink is False or not self.inNamespace:
+            return None
+        return getNetlinkEngine()
+
+    def setupSysctls(self, sysctlProfile=None, sysctls=None):
+        """Writes sysctl profile(s) and overrides into the node's namespace
+           sysctlProfile: name or list of names of profiles (see PROFILES)
+           sysctls: dict of settings that override profile values
+           returns: dict of applied settings, as read back from the node"""
+        if not self.inNamespace:
+            raise Exception("Refusing to apply sysctls to node %s\n"
+                            "Node is not in a private network namespace\n"
+                            % (self))
+        settings = resolveSysctls(sysctlProfile, sysctls)
+        validateSysctls(settings)
+
+        # Write directly to the node's /proc/sys, else use a single sysctl
+        if netlinkAvailable():
+            applied, errors = callInNetNamespace(self.pid, writeSysctls,
+                                                 settings)
+        else:
+            applied, errors = self.sysctlCmd(settings)
+        if errors:
+            raise Exception("Unable to apply sysctls to node %s\n%s\n"
+                            % (self, '\n'.join('%s: %s' % (key, errors[key])
+                                               for key in sorted(errors))))
+        self.sysctls.update(applied)
+        debug('%s: applied sysctls %s\n' % (self, applied))
+        return applied
+
+    def sysctlCmd(self, settings):
+        """Applies settings with a single 'sysctl -w' run inside the node
+           returns: ({key: value}, {key: error})"""
+        args = ['sysctl', '-w'] + ['%s=%s' % (key, settings[key])
+                                   for key in sorted(settings)]
+        out, err, _ = self.pexec(args)
+        applied = {}
+        for line in out.splitlines():
+            key, _, value = line.partition(' = ')
+            applied[key.strip()] = value.strip()
+        errors = dict((key, err.strip() or 'not applied')
+                      for key in settings if key not in applied)
+        return applied, errors
+
+    # Override on setIP() to avoid spawning ifconfig when possible
+    def setIP(self, ip, prefixLen=8, intf=None):
+        """Set the IP address for an interface.
+           intf: intf or intf name
+           ip: IP address as a string
+           prefixLen: prefix length, e.g. 8 for /8 or 16M addrs"""
+        engine = self.netlink()
+        if engine is not None:
+            intf = self.intf(intf)
+            addr = ip
+            if '/' in ip:
+                addr, prefixLen = ip.split('/')
+            try:
+                engine.setAddress(self, intf.name, addr, int(prefixLen))
+                intf.ip, intf.prefixLen = addr, int(prefixLen)
+                return ''
+            except (NetlinkError, EnvironmentError, socket.error) as e:
+                debug('netlink setIP failed on %s (%s), using ifconfig\n'
+                      % (self, e))
+        return BaseNode.setIP(self, ip, prefixLen, intf)
+
     def setupHostname(self, hostname):
         "Handles the setup of a hostname for the node"
         # Checks if the node has UTS namespace AND mount namespace
@@ -258,10 +576,45 @@ class Node(BaseNode):
         self.cmd("hostname %s" % (self.name))
 
     def setupLoopbacks(self, *loIntfs):
-        "Handles the setup of a list of loopback configs"
+        """Handles the setup of a list of loopback configs
+           Loopbacks that only set an address are applied in a single batch"""
+        batch = []
         for loIntf in loIntfs:
             # create loopback interface object which will then update node
-            LoopbackIntf(node=self, **loIntf)
+            if set(loIntf) - set(['ip', 'loNum']):
+                # other options require Intf.config(), configure now
+                LoopbackIntf(node=self, **loIntf)
+                continue
+            intf = LoopbackIntf(node=self, configure=False, **loIntf)
+            if intf.ip is not None:
+                batch.append(intf)
+        self.configLoopbacks(batch)
+
+    def configLoopbacks(self, loIntfs):
+        """Assigns the recorded addresses of loopback interfaces with a
+           single netlink batch (or 'ip -batch' call if netlink is not
+           available) instead of one ifconfig per interface
+           loIntfs: list of LoopbackIntf objects"""
+        if not loIntfs:
+            return
+        engine = self.netlink()
+        if engine is not None:
+            try:
+                engine.addAddresses(self, [(intf.name, intf.ip,
+                                            intf.prefixLen)
+                                           for intf in loIntfs])
+                return
+            except (NetlinkError, EnvironmentError, socket.error) as e:
+                debug('netlink loopback setup failed on %s (%s), '
+                      'using ip -batch\n' % (self, e))
+        batch = ''.join('address add %s/%d dev lo label %s\n'
+                        % (intf.ip, intf.prefixLen, intf.name)
+                        for intf in loIntfs)
+        popen = self.popen(['ip', '-batch', '-'], stdin=PIPE)
+        _, err = popen.communicate(batch)
+        if popen.wait() != 0:
+            raise Exception("Unable to configure loopbacks for node %s\n"
+                            "Error = %s" % (self, err))
 
     def addNodeLoopbackIntf(self, loIntf, loNum):
         """Adds a loopback interface (called on instantiation an interface).
@@ -277,6 +630,52 @@ class Node(BaseNode):
             return max(self.loIntfs.values()) + 1
         return 0
 
+    # CPU placement handlers #
+    def setupCPUSet(self):
+        "Creates a cpuset cgroup for the node's CPUs (self.cpuset)"
+        cgroupPath = os.path.join(CPUSET_ROOT, self.name)
+        createDirIfNeeded(cgroupPath)
+
+        # mems must be set before tasks may join, inherit from parent if unset
+        mems = self.cpusetMems
+        if mems is None:
+            with open(os.path.join(CPUSET_ROOT, 'cpuset.mems')) as memsFile:
+                mems = memsFile.read().strip()
+        else:
+            mems = formatCPUList(mems)
+        for valueFile, value in (('cpuset.cpus', formatCPUList(self.cpuset)),
+                                 ('cpuset.mems', mems)):
+            try:
+                with open(os.path.join(cgroupPath, valueFile), 'w') as cgFile:
+                    cgFile.write(value)
+            except IOError as e:
+                raise Exception("Unable to set %s = %s for node %s\n"
+                                "Error = %s" % (valueFile, value, self, e))
+        self.cgroup = self.name
+
+    def removeCPUSet(self):
+        "Removes the node's cpuset cgroup (best effort, may still be busy)"
+        if self.cgroup is None:
+            return
+        try:
+            os.rmdir(os.path.join(CPUSET_ROOT, self.cgroup))
+        except OSError as e:
+            debug('unable to remove cpuset for %s: %s\n' % (self, e))
+        self.cgroup = None
+
+    # Process monitoring #
+
+    def processes(self):
+        "Returns the host PIDs of the processes in the node's PID namespace"
+        if not self.inPIDNamespace:
+            return [self.pid]
+        nsID = getNamespaceID(self.pid, 'pid')
+        return getNamespacePIDs(['pid'])['pid'].get(nsID, [])
+
+    def zombieCount(self):
+        "Returns the number of zombie processes in the node"
+        return countZombies(self.processes())
+
     # Service handlers #
     def setupServices(self, services=None):
         "Sets up services in the passed list for this node"
@@ -296,6 +695,9 @@ class Node(BaseNode):
 
     def autoStartServices(self):
         "Starts services w/ autoStart=True that are configured for this node"
+        if self.shard is not None:
+            return self.shard.call('services', 'autoStartServices',
+                                   [self.name])[self.name]
         returnCodes = {}
         for service in self.services.keys():
             serviceReturnCode = service.autoStart(self)
@@ -308,6 +710,9 @@ class Node(BaseNode):
 
     def autoStopServices(self):
         "Stops services w/ autoStop=True that are configured for this node"
+        if self.shard is not None:
+            return self.shard.call('services', 'autoStopServices',
+                                   [self.name])[self.name]
         returnCodes = {}
         for service in self.services.keys():
             serviceReturnCode = service.autoStop(self)
@@ -318,6 +723,31 @@ class Node(BaseNode):
             return returnCodes
         return None
 
+    def serviceCall(self, name, method, *args, **kwargs):
+        """Call service.method(node, *args, **kwargs) for the node's service
+           called name (in the worker owning the node, if sharded)"""
+        if self.shard is not None:
+            return self.shard.call('serviceCall', self.name, name, method,
+                                   args, kwargs)
+        for service in self.services:
+            if service.name == name:
+                return getattr(service, method)(self, *args, **kwargs)
+        raise Exception("Node %s has no service %s\n" % (self, name))
+
+    # Packet capture (see mininext.capture) #
+
+    def startCapture(self, intfs=None, **params):
+        """Capture packets of the node's interfaces into pcap files
+           intfs: interface names (default: all but loopbacks)
+           params: PacketCapture parameters (directory, bpfFilter, ...)
+           returns: [PacketCapture]"""
+        return getCaptureEngine().start(makeCaptures(self, intfs, **params))
+
+    def stopCapture(self):
+        "Stop the node's captures, returns {PacketCapture: stats}"
+        engine = getCaptureEngine()
+        return engine.stop(engine.nodeCaptures(self))
+
     # Mount / private directory management #
     # bindObject() for a simple mount -B operation with no checking, etc.
     # setupMountPoint() for complex operations (perms, tmps, creation, etc.)
@@ -376,6 +806,11 @@ class Node(BaseNode):
     def setupMountPoint(self, mountPoint):
         """Handle mountPoint source and target as PathProperties or strings
            Assume source/target strings first, then handle PathProperties"""
+        if mountPoint.mode == 'overlay':
+            return self.overlayObject(mountPoint)
+        if mountPoint.mode != 'bind':
+            raise Exception("Unknown mount mode %s for %s\n"
+                            % (mountPoint.mode, mountPoint.target))
         sourcePath = mountPoint.source
         if isinstance(mountPoint.source, PathProperties):
             self.setupPath(mountPoint.source)
@@ -423,20 +858,85 @@ class Node(BaseNode):
                             "Node %s is not in a private mount namespace\n"
                             % (source, target, self.name))
 
-        # Perform the bind...
+        # Perform the bind (without propagating it to peer namespaces)...
         checkPath(source)
         checkPath(target)
-        _, err, ret = self.pexec('mount -n -B %s %s' % (source, target))
+        _, err, ret = self.pexec('mount -n -B --make-%s %s %s'
+                                 % (self.mountPropagation, source, target))
         if ret != 0:
             raise Exception("Unable to bind source object %s to target %s\n"
                             "Error = %s"
                             % (source, target, err))
         self.privateMounts[target] = source
 
+    def overlayObject(self, mountPoint):
+        """Mount an overlayfs of a MountProperties object's layers (source
+           over base) on its target. The writable upper layer lives on a
+           tmpfs only mounted in the node's namespace, so writes and
+           permission changes (mountPoint.perms) never reach the layers"""
+        if self.inMountNamespace is False:
+            raise Exception("Refusing to mount overlay on %s\n"
+                            "Node %s is not in a private mount namespace\n"
+                            % (mountPoint.target, self.name))
+
+        if isinstance(mountPoint.source, PathProperties):
+            self.setupPath(mountPoint.source)
+        target = mountPoint.target
+        if isinstance(target, PathProperties):
+            self.setupPath(target)
+            target = target.path
+        layers = mountPoint.layers()
+        if not layers:
+            raise Exception("Overlay on %s has no layers\n" % (target))
+        for path in layers + [target]:
+            checkPath(path)
+
+        # tmpfs for the upper and work dirs, mounted on an empty host dir
+        scratch = tempfile.mkdtemp(prefix=('mx-overlay-%s-' % (self)))
+        self.overlayDirs.append(scratch)
+        tmpfsOpts = 'mode=0755'
+        if mountPoint.tmpfsSize is not None:
+            tmpfsOpts += ',size=%s' % (mountPoint.tmpfsSize)
+        script = ('mount -n -t tmpfs -o %s tmpfs %s && '
+                  'mkdir %s/upper %s/work && '
+                  'mount -n -t overlay overlay -o '
+                  'lowerdir=%s,upperdir=%s/upper,workdir=%s/work %s'
+                  % (tmpfsOpts, scratch, scratch, scratch, ':'.join(layers),
+                     scratch, scratch, target))
+        _, err, ret = self.pexec(['sh', '-c', script])
+        if ret != 0:
+            raise Exception("Unable to mount overlay of %s on %s\n"
+                            "Error = %s"
+                            % (':'.join(layers), target, err))
+
+        # apply permissions through the node's view of the overlay
+        if mountPoint.perms is not None:
+            setDirPerms('/proc/%d/root%s' % (self.pid, target),
+                        mountPoint.perms)
+        self.privateMounts[target] = ':'.join(layers)
+
+    def removeOverlayDirs(self):
+        "Remove the (empty) host dirs the node's overlay tmpfs was mounted on"
+        for scratch in self.overlayDirs:
+            try:
+                os.rmdir(scratch)
+            except OSError as e:
+                debug('unable to remove %s: %s\n' % (scratch, e))
+        self.overlayDirs = []
+
     def hasPrivateMount(self, target):
         "Returns if the node has a private mount for a specific target"
         return target in self.privateMounts
 
+    def mountTableSize(self):
+        """Returns the number of entries in the node's mount table
+           (None if it cannot be read)"""
+        try:
+            with open('/proc/%d/mountinfo' % (self.pid)) as mountFile:
+                return sum(1 for _ in mountFile)
+        except IOError:
+            return None
+
 
 class Host(Node):
 
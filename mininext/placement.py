@@ -0,0 +1,169 @@
+"""
+CPU placement policies for MiniNExT nodes.
+"""
+
+import glob
+import os
+import re
+
+# CPU / NUMA topology discovery #
+
+
+def parseCPUList(cpuList):
+    "Parse a kernel CPU list string (e.g. '0-3,8,10-11') into a list of ints"
+    cpus = []
+    for part in cpuList.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def formatCPUList(cpus):
+    "Format a list of ints as a kernel CPU list string (e.g. '0-3,8')"
+    ranges = []
+    for cpu in sorted(set(cpus)):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(first) if first == last else '%d-%d' % (first, last)
+                    for first, last in ranges)
+
+
+def getOnlineCPUs():
+    "Returns the list of online CPUs"
+    try:
+        with open('/sys/devices/system/cpu/online') as cpuFile:
+            return parseCPUList(cpuFile.read())
+    except IOError:
+        return list(range(os.sysconf('SC_NPROCESSORS_ONLN')))
+
+
+def getNUMANodes():
+    "Returns {numaNode: [cpus]}, a single node if NUMA info is unavailable"
+    numaNodes = {}
+    for path in glob.glob('/sys/devices/system/node/node[0-9]*'):
+        numaNode = int(re.search(r'(\d+)$', path).group(1))
+        with open(os.path.join(path, 'cpulist')) as cpuFile:
+            cpus = parseCPUList(cpuFile.read())
+        if cpus:
+            numaNodes[numaNode] = cpus
+    if not numaNodes:
+        numaNodes[0] = getOnlineCPUs()
+    return numaNodes
+
+# Placement policies #
+
+
+class Placement(object):
+
+    """Assigns a set of CPUs (cpuset) to each node as it is added: the
+       least loaded CPUs, unless derived classes override selectCPUs()"""
+
+    def __init__(self, cpus=None, cpusPerNode=1, weightParam='cpuWeight'):
+        """cpus: CPUs available for placement (defaults to all online CPUs)
+           cpusPerNode: number of CPUs assigned to each node
+           weightParam: node parameter holding the node's relative load"""
+        self.cpus = sorted(cpus) if cpus is not None else getOnlineCPUs()
+        if not self.cpus:
+            raise Exception("No CPUs available for placement\n")
+        self.cpusPerNode = min(cpusPerNode, len(self.cpus))
+        self.weightParam = weightParam
+        self.load = dict((cpu, 0.0) for cpu in self.cpus)
+        self.assignments = {}  # node name -> (cpus, mems)
+
+    def place(self, name, params):
+        """Select and record the cpuset for a node
+           name: node name
+           params: node parameters
+           returns: (cpus, mems), mems is None to inherit the parent's mems"""
+        weight = float(params.get(self.weightParam, 1.0))
+        cpus, mems = self.selectCPUs(name, weight)
+        for cpu in cpus:
+            self.load[cpu] += weight / len(cpus)
+        self.assignments[name] = (cpus, mems)
+        return cpus, mems
+
+    def selectCPUs(self, name, weight):
+        "Returns (cpus, mems) for a node: the least loaded CPUs"
+        return self.leastLoaded(self.cpus), None
+
+    def leastLoaded(self, cpus):
+        "Returns the cpusPerNode least loaded CPUs among cpus"
+        return sorted(cpus, key=lambda cpu: (self.load[cpu], cpu))[
+            :self.cpusPerNode]
+
+    def __str__(self):
+        return '%s (%d cpus)' % (self.__class__.__name__, len(self.cpus))
+
+
+class RoundRobinPlacement(Placement):
+
+    "Assigns CPUs to nodes in turn, regardless of load"
+
+    def __init__(self, *args, **kwargs):
+        Placement.__init__(self, *args, **kwargs)
+        self.nextIndex = 0
+
+    def selectCPUs(self, name, weight):
+        "Returns the next cpusPerNode CPUs in order"
+        cpus = [self.cpus[(self.nextIndex + i) % len(self.cpus)]
+                for i in range(self.cpusPerNode)]
+        self.nextIndex = (self.nextIndex + self.cpusPerNode) % len(self.cpus)
+        return cpus, None
+
+
+class WeightedPlacement(Placement):
+
+    """Assigns each node to the least loaded CPUs, where load is the sum of
+       the weight parameter (default 1) of the nodes already placed there
+       (the default Placement policy)"""
+
+
+class NUMAPlacement(Placement):
+
+    """Load-weighted placement that keeps each node within one NUMA node
+       and restricts its memory allocations to that NUMA node"""
+
+    def __init__(self, *args, **kwargs):
+        Placement.__init__(self, *args, **kwargs)
+        self.numaNodes = {}
+        for numaNode, cpus in getNUMANodes().items():
+            cpus = [cpu for cpu in cpus if cpu in self.load]
+            if cpus:
+                self.numaNodes[numaNode] = cpus
+
+    def numaLoad(self, numaNode):
+        "Returns the average load of the CPUs in a NUMA node"
+        cpus = self.numaNodes[numaNode]
+        return sum(self.load[cpu] for cpu in cpus) / len(cpus)
+
+    def selectCPUs(self, name, weight):
+        "Returns the least loaded CPUs in the least loaded NUMA node"
+        numaNode = min(self.numaNodes,
+                       key=lambda numa: (self.numaLoad(numa), numa))
+        return self.leastLoaded(self.numaNodes[numaNode]), [numaNode]
+
+
+PLACEMENTS = {'roundrobin': RoundRobinPlacement,
+              'weighted': WeightedPlacement,
+              'numa': NUMAPlacement}
+
+
+def makePlacement(placement, **params):
+    """Returns a Placement object
+       placement: None, Placement object, class, or name in PLACEMENTS
+       params: parameters passed when constructing a placement"""
+    if placement is None or isinstance(placement, Placement):
+        return placement
+    if isinstance(placement, basestring):
+        if placement not in PLACEMENTS:
+            raise Exception("Unknown placement policy %s (expected one of %s)"
+                            % (placement, ', '.join(sorted(PLACEMENTS))))
+        placement = PLACEMENTS[placement]
+    return placement(**params)
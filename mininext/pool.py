@@ -0,0 +1,136 @@
+"""
+Pre-started (warm) node shells for MiniNExT.
+"""
+
+import os
+import signal
+import threading
+from subprocess import Popen, PIPE, STDOUT
+
+from mininet.log import error
+
+from mininext.node import Node
+
+
+class PooledShell(object):
+
+    "A node shell, with its namespaces already created, waiting for a node"
+
+    def __init__(self, popen, pid):
+        """popen: Popen object of the shell (mxexec)
+           pid: PID whose namespaces the shell runs in"""
+        self.popen = popen
+        self.pid = pid
+
+    def destroy(self):
+        "Kill the shell, ending its namespaces"
+        for pid in set([self.pid, self.popen.pid]):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+        self.popen.wait()
+
+
+class ShellPool(object):
+
+    """Keeps a number of generic node shells ready, so nodes skip namespace
+       creation (and PID discovery) when they start. Shells are started by
+       a background thread; nodes with the same namespace settings claim
+       them in startShell() and then apply their own hostname, mounts and
+       interfaces as usual. Claimed shells are destroyed with their node,
+       call fill() (done by MiniNExT.stop()) to replace them"""
+
+    def __init__(self, size, inNamespace=True, inMountNamespace=False,
+                 inPIDNamespace=False, inUTSNamespace=False, useInit=False,
+                 mountPropagation='private', fill=True):
+        """size: number of shells to keep ready
+           inNamespace, inMountNamespace, inPIDNamespace, inUTSNamespace,
+           useInit, mountPropagation: namespace settings of the shells
+           (only nodes with the same settings use the pool, see Node)
+           fill: start filling the pool right away"""
+        self.size = size
+        self.key = (inNamespace, inMountNamespace, inPIDNamespace,
+                    inUTSNamespace, useInit, mountPropagation)
+        self.shells = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.closed = False
+        self.claimed = 0
+        if fill:
+            self.fill()
+
+    def spawn(self):
+        "Start a shell in new namespaces, returns a PooledShell"
+        cmd = ['mxexec', Node.namespaceOpts(*self.key),
+               'bash', '-ms', 'mininet:pool']
+        popen = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=STDOUT,
+                      close_fds=True)
+        # mxexec prints the PID that holds the namespaces before the shell
+        line = popen.stdout.readline()
+        if not line.startswith('\001'):
+            popen.kill()
+            popen.wait()
+            raise Exception('Unable to determine pooled shell\'s PID')
+        return PooledShell(popen, int(line[1:]))
+
+    def fill(self):
+        "Start refilling the pool in the background"
+        with self.lock:
+            if self.closed or self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run,
+                                           name='mininext-shell-pool')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        "Start shells until the pool is full (runs in the background)"
+        while True:
+            with self.lock:
+                if self.closed or len(self.shells) >= self.size:
+                    self.thread = None
+                    return
+            try:
+                shell = self.spawn()
+            except Exception as e:  # give up, nodes start their own shells
+                error('*** Unable to start pooled shell: %s\n' % e)
+                with self.lock:
+                    self.thread = None
+                return
+            with self.lock:
+                if not self.closed:
+                    self.shells.append(shell)
+                    continue
+            shell.destroy()
+
+    def claim(self, key):
+        """Returns a ready shell for a node with namespace settings key
+           (see Node.namespaceKey()), or None if none is available"""
+        if key != self.key:
+            return None
+        with self.lock:
+            if not self.shells:
+                return None
+            self.claimed += 1
+            return self.shells.pop()
+
+    def available(self):
+        "Returns the number of ready shells"
+        with self.lock:
+            return len(self.shells)
+
+    def close(self):
+        "Stop filling the pool and destroy the shells that are not claimed"
+        with self.lock:
+            self.closed = True
+            thread = self.thread
+            shells, self.shells = self.shells, []
+        if thread is not None:
+            thread.join()
+        for shell in shells:
+            shell.destroy()
+
+    def __repr__(self):
+        return '<%s %d/%d ready>' % (self.__class__.__name__,
+                                     self.available(), self.size)
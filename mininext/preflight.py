@@ -0,0 +1,227 @@
+"""
+Preflight validation of MiniNExT topologies.
+
+Problems such as a missing user, init script or config directory otherwise
+surface from Node.config() after many nodes already have namespaces and
+mounts. Preflight walks a topology and the services attached to its hosts
+once, before anything is started, and reports every problem it finds.
+Each distinct check (user, group, path, executable, permissions) is run
+only once, however many nodes share it.
+"""
+
+import copy
+import grp
+import os
+import pwd
+
+from mininext.mount import PathProperties
+from mininext.node import Node
+from mininext.sysctl import resolveSysctls, validateSysctls
+from mininext.util import quietDoDirPermsEqual
+
+
+class Preflight(object):
+
+    """Collects problems found in a topology; checks are cached by their
+       arguments. Services add their own checks in Service.preflight()"""
+
+    def __init__(self):
+        self.cache = {}  # (check, args) -> problem message or None
+        self.problems = []  # [(context, message)]
+
+    # Cached checks #
+
+    def cached(self, key, check):
+        "Returns the (cached) result of check(), a problem message or None"
+        if key not in self.cache:
+            self.cache[key] = check()
+        return self.cache[key]
+
+    def report(self, context, message):
+        "Record a problem (once per context)"
+        if (context, message) not in self.problems:
+            self.problems.append((context, message))
+
+    def check(self, context, key, check):
+        "Run a cached check, reporting its problem. Returns if it passed"
+        message = self.cached(key, check)
+        if message is not None:
+            self.report(context, message)
+        return message is None
+
+    def user(self, context, name):
+        "Check that a user exists"
+        def check():
+            "Look up the user"
+            try:
+                pwd.getpwnam(name)
+            except KeyError:
+                return "Expected user %s does not exist" % (name)
+        return self.check(context, ('user', name), check)
+
+    def group(self, context, name):
+        "Check that a group exists"
+        def check():
+            "Look up the group"
+            try:
+                grp.getgrnam(name)
+            except KeyError:
+                return "Expected group %s does not exist" % (name)
+        return self.check(context, ('group', name), check)
+
+    def path(self, context, path, isDir=False):
+        "Check that a path (a directory if isDir) exists"
+        def check():
+            "Stat the path"
+            if not os.path.exists(path):
+                return "Path [%s] is not valid" % (path)
+            if isDir and not os.path.isdir(path):
+                return "Path [%s] is not a directory" % (path)
+        return self.check(context, ('path', path, isDir), check)
+
+    def executable(self, context, name):
+        "Check that an executable (a path, or a name in PATH) exists"
+        def check():
+            "Look for the executable"
+            if os.sep in name:
+                paths = [name]
+            else:
+                paths = [os.path.join(directory, name) for directory
+                         in os.environ.get('PATH', '').split(os.pathsep)]
+            if not any(os.path.isfile(path) and os.access(path, os.X_OK)
+                       for path in paths):
+                return "Cannot find required executable %s" % (name)
+        return self.check(context, ('executable', name), check)
+
+    def initScript(self, context, name):
+        "Check that a service can be found in /etc/init.d/"
+        return self.executable(context, '/etc/init.d/' + name)
+
+    def perms(self, context, path, perms):
+        "Check that a path (and, if enforced, its contents) has perms"
+        if perms.username is not None and not self.user(context,
+                                                        perms.username):
+            return False
+        if perms.groupname is not None and not self.group(context,
+                                                          perms.groupname):
+            return False
+
+        def check():
+            "Compare the permissions"
+            if not quietDoDirPermsEqual(path, copy.copy(perms)):
+                return ("Insufficient or unexpected permissions for %s "
+                        "or a subdirectory / file (expected user = %s, "
+                        "group = %s, (minimum) mode = %s)"
+                        % (path, perms.username, perms.groupname,
+                           oct(perms.mode)))
+        key = ('perms', path, perms.username, perms.uid, perms.groupname,
+               perms.gid, perms.mode, perms.enforceRecursive)
+        return self.check(context, key, check)
+
+    # Structured checks #
+
+    def pathProperties(self, context, properties):
+        "Check that the setup of a PathProperties object will succeed"
+        path, perms = properties.path, properties.perms
+        if path is None:
+            return
+        # users and groups are needed to create or set permissions
+        if perms is not None and (properties.create or properties.setPerms):
+            if perms.username is not None:
+                self.user(context, perms.username)
+            if perms.groupname is not None:
+                self.group(context, perms.groupname)
+        if os.path.exists(path):
+            if properties.create:
+                self.path(context, path, isDir=True)
+            if properties.checkPerms and not properties.setPerms and \
+                    perms is not None:
+                self.perms(context, path, perms)
+        elif not properties.create:
+            self.path(context, path)
+        elif not properties.createRecursive:
+            self.path(context, os.path.dirname(path.rstrip(os.sep)),
+                      isDir=True)
+
+    def mount(self, context, mount):
+        "Check the source and target (and overlay layers) of a mount"
+        for end in (mount.source, mount.target):
+            if isinstance(end, PathProperties):
+                self.pathProperties(context, end)
+            elif end is not None:
+                self.path(context, end)
+        if mount.mode == 'overlay':
+            for layer in mount.layers():
+                self.path(context, layer, isDir=True)
+            if mount.perms is not None:
+                if mount.perms.username is not None:
+                    self.user(context, mount.perms.username)
+                if mount.perms.groupname is not None:
+                    self.group(context, mount.perms.groupname)
+        elif mount.mode != 'bind':
+            self.report(context, "Unknown mount mode %s for %s"
+                        % (mount.mode, mount.target))
+
+    def node(self, name, params):
+        "Check a host's parameters and services (topology nodeInfo)"
+        inPIDNamespace = params.get('inPIDNamespace', False)
+        if inPIDNamespace and not params.get('inMountNamespace', False):
+            self.report(name, "PID namespaces require mount namespace "
+                        "for /proc")
+        if params.get('useInit', False) and not inPIDNamespace:
+            self.report(name, "useInit requires a PID namespace")
+        if params.get('mountPropagation', 'private') not in ('private',
+                                                             'slave'):
+            self.report(name, "mountPropagation must be private or slave")
+        cls = params.get('cls')
+        if isinstance(cls, type) and issubclass(cls, Node):
+            self.executable(name, 'mxexec')
+
+        # private directories and kernel settings
+        for key, target in (('privateLogDir', '/var/log'),
+                            ('privateRunDir', '/run')):
+            value = params.get(key)
+            if value is not None and value is not False:
+                if not params.get('inMountNamespace', False):
+                    self.report(name, "%s requires a private mount "
+                                "namespace" % (key))
+                if not isinstance(value, bool):
+                    self.pathProperties(name, PathProperties(
+                        path=value, create=True, createRecursive=True))
+                self.path(name, target, isDir=True)
+        if params.get('sysctlProfile') is not None or \
+                params.get('sysctls') is not None:
+            try:
+                validateSysctls(resolveSysctls(params.get('sysctlProfile'),
+                                               params.get('sysctls')))
+            except Exception as e:  # reported with the other problems
+                self.report(name, ' '.join(str(e).split()))
+
+        # services
+        for service, serviceParams in (params.get('services') or {}).items():
+            context = '%s/%s' % (name, service)
+            try:
+                service.preflight(self, context, params, serviceParams)
+            except Exception as e:  # reported with the other problems
+                self.report(context, "preflight failed: %s"
+                            % (' '.join(str(e).split())))
+
+    def topo(self, topo):
+        "Check every host of a topology, returns the problems found"
+        for name in topo.hosts():
+            self.node(name, topo.nodeInfo(name))
+        return self.problems
+
+    def __str__(self):
+        return '\n'.join('  %s: %s' % (context, message)
+                         for context, message in self.problems)
+
+
+def preflightTopo(topo):
+    """Check a topology, raising an exception listing every problem found
+       topo: Topo to check"""
+    preflight = Preflight()
+    if preflight.topo(topo):
+        raise Exception("Preflight found %d problem(s):\n%s\n"
+                        % (len(preflight.problems), preflight))
+    return preflight
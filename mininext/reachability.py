@@ -0,0 +1,236 @@
+"""
+Parallel reachability checks for MiniNExT networks.
+"""
+
+import math
+import re
+from multiprocessing.pool import ThreadPool
+from subprocess import PIPE
+
+from mininet.log import debug
+from mininet.util import quietRun
+
+from mininext.link import LoopbackIntf
+
+FPING_RESULT = re.compile(r'^(\S+)\s+:\s+([\d.\s-]+)$')
+PING_SENT = re.compile(r'(\d+) packets transmitted, (\d+) received')
+PING_RTT = re.compile(r'= [\d.]+/([\d.]+)/')
+
+
+def nodeTargets(node, loopbacks=True):
+    """Returns the (node name, interface name, ip) targets of a node
+       node: node whose addresses are returned
+       loopbacks: include the addresses of loopback interfaces (lo:X)"""
+    targets = []
+    for intf in node.intfList():
+        ip = intf.IP()
+        if ip is not None and not ip.startswith('127.'):
+            targets.append((node.name, intf.name, ip))
+    if loopbacks:
+        for name in sorted(node.loIntfs):
+            intf = node.nameToIntf.get(name)
+            if isinstance(intf, LoopbackIntf) and intf.ip is not None:
+                targets.append((node.name, name, intf.ip))
+    return targets
+
+
+class ReachabilityMatrix(object):
+
+    """Loss and average round-trip time (ms) from source nodes to targets,
+       where targets are (node name, interface name, ip) tuples"""
+
+    def __init__(self, count):
+        "count: probes sent to each target"
+        self.count = count
+        self.results = {}  # (source name, target) -> (loss, rtt or None)
+
+    def record(self, source, target, sent, received, rtt):
+        "Record the result of probing target from source"
+        loss = 1.0 - float(received) / sent if sent else 1.0
+        self.results[(source, target)] = (loss, rtt)
+
+    def update(self, other):
+        "Replace results with those of another (partial) matrix"
+        self.results.update(other.results)
+
+    def loss(self, source, target):
+        "Returns the loss (0.0 - 1.0) from source to target"
+        return self.results[(source, target)][0]
+
+    def rtt(self, source, target):
+        "Returns the average RTT (ms) from source to target, None if lost"
+        return self.results[(source, target)][1]
+
+    def failed(self):
+        "Returns the (source, target) pairs that lost any probes"
+        return sorted(pair for pair, (loss, _) in self.results.items()
+                      if loss > 0)
+
+    def lossRate(self):
+        "Returns the overall fraction of lost probes"
+        if not self.results:
+            return 0.0
+        return sum(loss for loss, _ in self.results.values()) / \
+            len(self.results)
+
+    def meanRTT(self):
+        "Returns the mean RTT (ms) over all answered pairs"
+        rtts = [rtt for _, rtt in self.results.values() if rtt is not None]
+        return sum(rtts) / len(rtts) if rtts else None
+
+    def toDict(self):
+        """Returns {source: {'node/intf/ip': {'loss': x, 'rtt': y}}}
+           (suitable for JSON)"""
+        matrix = {}
+        for (source, target), (loss, rtt) in self.results.items():
+            matrix.setdefault(source, {})['/'.join(target)] = \
+                {'loss': loss, 'rtt': rtt}
+        return matrix
+
+    def __len__(self):
+        return len(self.results)
+
+    def __str__(self):
+        failed = self.failed()
+        meanRTT = self.meanRTT()
+        lines = ['Reachability: %d/%d pairs without loss (%.1f%% loss), '
+                 'mean rtt %s'
+                 % (len(self) - len(failed), len(self),
+                    100.0 * self.lossRate(),
+                    '-' if meanRTT is None else '%.3f ms' % (meanRTT))]
+        for source, target in failed:
+            lines.append('  %s -> %s %s (%s): %d%% loss'
+                         % ((source,) + target +
+                            (int(round(100 * self.loss(source, target))),)))
+        return '\n'.join(lines)
+
+
+class ReachabilityChecker(object):
+
+    """Probes many targets from many nodes concurrently: each source node
+       runs a single prober (fping if installed, otherwise a bounded
+       xargs / ping loop) covering all of its targets"""
+
+    def __init__(self, count=1, timeout=1.0, maxThreads=64, parallel=32,
+                 useFping=None):
+        """count: probes sent to each target
+           timeout: seconds to wait for a reply
+           maxThreads: maximum number of nodes probing at once
+           parallel: concurrent pings per node (without fping)
+           useFping: use fping (default: if it is installed)"""
+        self.count = count
+        self.timeout = timeout
+        self.maxThreads = maxThreads
+        self.parallel = parallel
+        if useFping is None:
+            useFping = bool(quietRun('which fping').strip())
+        self.useFping = useFping
+
+    # Probing #
+
+    def probe(self, node, ips):
+        "Returns {ip: (sent, received, average rtt)} for ips probed by node"
+        if not ips:
+            return {}
+        if self.useFping:
+            return self.fping(node, ips)
+        return self.pingLoop(node, ips)
+
+    def fping(self, node, ips):
+        "Probe ips with a single fping run"
+        popen = node.popen(['fping', '-q', '-C', str(self.count),
+                            '-t', str(int(self.timeout * 1000)),
+                            '-i', '1', '-r', '0'] + ips,
+                           stdout=PIPE, stderr=PIPE)
+        _, err = popen.communicate()
+        results = {}
+        for line in err.splitlines():
+            match = FPING_RESULT.match(line.strip())
+            if match is None or match.group(1) not in ips:
+                continue
+            values = match.group(2).split()
+            rtts = [float(value) for value in values if value != '-']
+            results[match.group(1)] = (
+                len(values), len(rtts),
+                sum(rtts) / len(rtts) if rtts else None)
+        return results
+
+    def pingLoop(self, node, ips):
+        "Probe ips with ping, at most self.parallel at a time"
+        script = ('xargs -n 1 -P %d sh -c \'echo "$0 $(ping -n -q -c %d '
+                  '-W %d $0 | tr "\\n" " ")"\''
+                  % (self.parallel, self.count,
+                     max(1, int(math.ceil(self.timeout)))))
+        popen = node.popen(['sh', '-c', script], stdin=PIPE, stdout=PIPE,
+                           stderr=PIPE)
+        out, _ = popen.communicate('\n'.join(ips) + '\n')
+        results = {}
+        for line in out.splitlines():
+            ip = line.split(' ', 1)[0]
+            sent = PING_SENT.search(line)
+            if ip not in ips or sent is None:
+                continue
+            rtt = PING_RTT.search(line)
+            results[ip] = (int(sent.group(1)), int(sent.group(2)),
+                           float(rtt.group(1)) if rtt else None)
+        return results
+
+    # Checks #
+
+    def check(self, nodes, loopbacks=True, pairs=None):
+        """Probe targets from every node concurrently
+           nodes: source nodes (their addresses are the targets)
+           loopbacks: include loopback addresses as targets
+           pairs: only probe these (source name, target) pairs
+           returns: ReachabilityMatrix"""
+        nodes = list(nodes)
+        work = {}  # source node -> targets
+        if pairs is not None:
+            byName = dict((node.name, node) for node in nodes)
+            for source, target in pairs:
+                work.setdefault(byName[source], []).append(target)
+        else:
+            targets = [target for node in nodes
+                       for target in nodeTargets(node, loopbacks)]
+            for node in nodes:
+                # skip the node's own addresses (including anycast copies)
+                own = set(ip for _, _, ip in nodeTargets(node, True))
+                work[node] = [target for target in targets
+                              if target[2] not in own]
+
+        def probeNode(item):
+            "Probe all of a node's targets, returning errors as values"
+            node, nodeTargetList = item
+            ips = sorted(set(ip for _, _, ip in nodeTargetList))
+            try:
+                return node, self.probe(node, ips)
+            except Exception as e:  # a failed prober loses its targets
+                debug('*** reachability probe from %s failed: %s\n'
+                      % (node, e))
+                return node, {}
+
+        matrix = ReachabilityMatrix(self.count)
+        if not work:
+            return matrix
+        pool = ThreadPool(min(self.maxThreads, len(work)))
+        try:
+            probed = dict(pool.map(probeNode, list(work.items())))
+        finally:
+            pool.close()
+            pool.join()
+        for node, nodeTargetList in work.items():
+            for target in nodeTargetList:
+                sent, received, rtt = probed[node].get(
+                    target[2], (self.count, 0, None))
+                matrix.record(node.name, target, sent, received, rtt)
+        return matrix
+
+    def recheck(self, matrix, nodes):
+        """Probe only the pairs of a previous check that lost probes
+           matrix: previous ReachabilityMatrix (updated in place)
+           nodes: source nodes
+           returns: matrix"""
+        failed = matrix.failed()
+        if failed:
+            matrix.update(self.check(nodes, pairs=failed))
+        return matrix
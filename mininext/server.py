@@ -0,0 +1,422 @@
+"""
+Long-running MiniNExT emulation server with a local RPC interface.
+
+The server hosts a started MiniNExT network and answers requests on a unix
+socket, so that many short-lived clients (e.g. test processes) can share a
+single warm emulation. The protocol is one JSON object per line:
+
+    request:  {"id": 1, "method": "cmd", "params": {"node": "a1",
+                                                    "command": "ip route"}}
+    response: {"id": 1, "result": "..."} or {"id": 1, "error": "..."}
+
+Each connection is served by its own thread, so requests from different
+clients run concurrently (commands sent to one node's shell are serialized).
+"""
+
+import argparse
+import importlib
+import json
+import os
+import signal
+import socket
+import threading
+from contextlib import contextmanager
+
+try:
+    import SocketServer as socketserver
+except ImportError:  # Python 3
+    import socketserver
+
+from mininet.log import info, error, setLogLevel
+
+DEFAULT_SOCKET = '/var/run/mininext.sock'
+
+
+class RPCError(Exception):
+
+    "Raised by EmulationClient when the server returns an error"
+
+    pass
+
+
+# Server #
+
+
+class RPCHandler(socketserver.StreamRequestHandler):
+
+    "Serves the requests of one client connection"
+
+    def handle(self):
+        "Answer requests until the client disconnects"
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            response = self.server.emulation.dispatch(line)
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+
+class RPCServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    "Threaded unix socket server (one thread per connection)"
+
+    daemon_threads = True
+
+
+class EmulationServer(object):
+
+    """Hosts a running MiniNExT network and serves RPC requests for it.
+       Methods: nodes, cmd, pexec, services, serviceStart, serviceStop,
+       serviceReload, addLink, deleteLink, setLinkStatus, setLinkProfiles,
+       metrics, mounts, reachability and shutdown (see the methods of the
+       same name)"""
+
+    def __init__(self, net, path=DEFAULT_SOCKET, mode=0o660):
+        """net: started MiniNExT network
+           path: path of the unix socket
+           mode: permissions of the unix socket"""
+        self.net = net
+        self.path = path
+        self.mode = mode
+        self.server = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.nodeLocks = {}
+        self.lock = threading.Lock()
+        self.methods = dict((name, getattr(self, name)) for name in (
+            'nodes', 'cmd', 'pexec', 'services', 'serviceStart',
+            'serviceStop', 'serviceReload', 'addLink', 'deleteLink',
+            'setLinkStatus', 'setLinkProfiles', 'metrics', 'mounts',
+            'reachability', 'shutdown'))
+
+    # Server control #
+
+    def start(self):
+        "Start serving requests in a background thread"
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = RPCServer(self.path, RPCHandler)
+        self.server.emulation = self
+        os.chmod(self.path, self.mode)
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name='mininext-rpc')
+        self.thread.daemon = True
+        self.thread.start()
+        info('*** Serving MiniNExT RPC requests on %s\n' % (self.path))
+
+    def stop(self):
+        "Stop serving requests and remove the socket"
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.server, self.thread = None, None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def serve(self):
+        "Serve until a shutdown request, SIGINT or SIGTERM"
+        def handleSignal(_signum, _frame):
+            "Stop serving on a signal"
+            self.stopped.set()
+        signal.signal(signal.SIGTERM, handleSignal)
+        signal.signal(signal.SIGINT, handleSignal)
+        self.start()
+        try:
+            # a timeout keeps the main thread responsive to signals
+            while not self.stopped.is_set():
+                self.stopped.wait(1.0)
+        finally:
+            self.stop()
+
+    def dispatch(self, line):
+        "Run one JSON request, returns the response (a dict)"
+        requestID = None
+        try:
+            request = json.loads(line)
+            requestID = request.get('id')
+            method = self.methods.get(request.get('method'))
+            if method is None:
+                raise Exception("Unknown method %s" % (request.get('method')))
+            result = method(**request.get('params', {}))
+            return {'id': requestID, 'result': result}
+        except Exception as e:  # returned to the client
+            return {'id': requestID, 'error': '%s: %s'
+                    % (e.__class__.__name__, str(e).strip())}
+
+    # Helpers #
+
+    def getNode(self, name):
+        "Returns the node called name"
+        if name not in self.net.nameToNode:
+            raise Exception("Unknown node %s" % (name))
+        return self.net.nameToNode[name]
+
+    def getService(self, node, name):
+        "Returns the node's service called name"
+        for service in node.services:
+            if service.name == name:
+                return service
+        raise Exception("Node %s has no service %s" % (node, name))
+
+    def nodeLock(self, node):
+        "Returns the lock that serializes use of the node's shell"
+        with self.lock:
+            return self.nodeLocks.setdefault(node.name, threading.Lock())
+
+    @contextmanager
+    def nodesLocked(self, *nodes):
+        """Hold the shell locks of nodes (taken in name order, and before
+           self.lock, so that requests cannot deadlock)"""
+        locks = [self.nodeLock(node) for node in
+                 sorted(set(nodes), key=lambda node: node.name)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    # Methods #
+
+    def nodes(self):
+        "Returns {'hosts': [names], 'switches': [names]}"
+        return {'hosts': [host.name for host in self.net.hosts],
+                'switches': [switch.name for switch in self.net.switches]}
+
+    def cmd(self, node, command):
+        "Run a command in the node's shell, returns its output"
+        node = self.getNode(node)
+        with self.nodesLocked(node):
+            return node.cmd(command)
+
+    def pexec(self, node, command):
+        """Run a command (string or list) in the node without its shell,
+           returns {'out', 'err', 'ret'}"""
+        # JSON strings are unicode in Python 2, popen() expects str
+        if isinstance(command, list):
+            command = [str(arg) for arg in command]
+        else:
+            command = str(command)
+        out, err, ret = self.getNode(node).pexec(command)
+        return {'out': out, 'err': err, 'ret': ret}
+
+    def services(self, node):
+        "Returns the names of the node's services"
+        return sorted(service.name for service in self.getNode(node).services)
+
+    def serviceStart(self, node, service):
+        "Start a node's service, returns {'err', 'ret'}"
+        node = self.getNode(node)
+        self.getService(node, service)
+        with self.nodesLocked(node):
+            return node.serviceCall(service, 'start')
+
+    def serviceStop(self, node, service):
+        "Stop a node's service, returns {'err', 'ret'}"
+        node = self.getNode(node)
+        self.getService(node, service)
+        with self.nodesLocked(node):
+            return node.serviceCall(service, 'stop')
+
+    def serviceReload(self, node, service, config, daemons=None, save=False):
+        """Apply a new configuration to a running service (services with
+           hot reload, e.g. Quagga), returns the reload report"""
+        node = self.getNode(node)
+        service = self.getService(node, service)
+        if not hasattr(service, 'reload'):
+            raise Exception("Service %s does not support reload"
+                            % (service))
+        with self.nodesLocked(node):
+            return node.serviceCall(service.name, 'reload', config,
+                                    daemons=daemons, save=save)
+
+    def addLink(self, node1, node2, params1=None, params2=None, **params):
+        """Add a link between two running nodes
+           params1, params2: interface parameters (e.g. {'ip': ...})
+           returns: [interface name on node1, interface name on node2]"""
+        node1, node2 = self.getNode(node1), self.getNode(node2)
+        with self.nodesLocked(node1, node2):
+            with self.lock:
+                link = self.net.addLink(node1, node2, params1=params1 or {},
+                                        params2=params2 or {}, **params)
+            for intf in (link.intf1, link.intf2):
+                if hasattr(intf.node, 'attach'):
+                    intf.node.attach(intf)
+                else:
+                    intf.ifconfig('up')
+        return [link.intf1.name, link.intf2.name]
+
+    def deleteLink(self, node1, node2):
+        "Delete the links between two nodes, returns how many were deleted"
+        nodes = set([self.getNode(node1), self.getNode(node2)])
+        with self.nodesLocked(*nodes), self.lock:
+            links = [link for link in self.net.links
+                     if set([link.intf1.node, link.intf2.node]) == nodes]
+            if not links:
+                raise Exception("No link between %s and %s" % (node1, node2))
+            for link in links:
+                intfs = (link.intf1, link.intf2)
+                for intf in intfs:
+                    if hasattr(intf.node, 'detach'):
+                        intf.node.detach(intf)
+                link.delete()
+                for intf in intfs:
+                    # forget the interface (older Mininet keeps it)
+                    port = intf.node.ports.pop(intf, None)
+                    if port is not None:
+                        intf.node.intfs.pop(port, None)
+                    intf.node.nameToIntf.pop(intf.name, None)
+                self.net.links.remove(link)
+        return len(links)
+
+    def setLinkStatus(self, node1, node2, status):
+        "Bring the links between two nodes 'up' or 'down'"
+        with self.nodesLocked(self.getNode(node1), self.getNode(node2)):
+            self.net.configLinkStatus(node1, node2, status)
+        return status
+
+    def setLinkProfiles(self, links):
+        """Change the profiles of many links at once
+           links: [[node1, node2, profile]], where profile is a profile name,
+                  a dict of LinkProfile parameters or None to remove shaping
+           returns: {'interfaces', 'namespaces', 'time'}"""
+        profiles = {}
+        for node1, node2, profile in links:
+            self.getNode(node1)
+            self.getNode(node2)
+            profiles[(node1, node2)] = profile
+        with self.lock:
+            report = self.net.setLinkProfiles(profiles)
+        return dict((key, report[key])
+                    for key in ('interfaces', 'namespaces', 'time'))
+
+    def metrics(self):
+        """Returns the latest resource sample of each node (requires the
+           network's resource sampler, see MiniNExT.startSampler())"""
+        sampler = self.net.sampler
+        if sampler is None:
+            raise Exception("Resource sampler not running")
+        metrics = {}
+        for name, series in sampler.series.items():
+            latest = series.latest()
+            if latest is None:
+                continue
+            metrics[name] = dict(zip(('timestamp', 'cpuSeconds', 'rssBytes',
+                                      'processes', 'zombies'), latest))
+            metrics[name]['cpuPercent'] = series.cpuPercent(window=5)
+        return metrics
+
+    def mounts(self):
+        "Returns the mount table size of each node (and the host as '')"
+        sizes = self.net.getMountTableSizes()
+        sizes[''] = sizes.pop(None)
+        return sizes
+
+    def reachability(self, hosts=None, loopbacks=True, **params):
+        """Check reachability between hosts (default: all), returns the
+           matrix as a dict (see ReachabilityMatrix.toDict())"""
+        if hosts is not None:
+            hosts = [self.getNode(host) for host in hosts]
+        return self.net.checkReachability(hosts=hosts, loopbacks=loopbacks,
+                                          **params).toDict()
+
+    def shutdown(self):
+        "Stop the server (and, when run by main(), the network)"
+        self.stopped.set()
+        return True
+
+
+# Client #
+
+
+class EmulationClient(object):
+
+    "Client of an EmulationServer, using a single persistent connection"
+
+    def __init__(self, path=DEFAULT_SOCKET, timeout=None):
+        """path: path of the server's unix socket
+           timeout: socket timeout in seconds (None to wait forever)"""
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.rfile = self.sock.makefile('rb')
+        self.lock = threading.Lock()
+        self.nextID = 0
+
+    def call(self, method, **params):
+        "Call a server method, returns its result (raises RPCError)"
+        with self.lock:
+            self.nextID += 1
+            request = {'id': self.nextID, 'method': method, 'params': params}
+            self.sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+            line = self.rfile.readline()
+        if not line:
+            raise RPCError("Connection closed by server")
+        response = json.loads(line)
+        if 'error' in response:
+            raise RPCError(response['error'])
+        return response['result']
+
+    def cmd(self, node, command):
+        "Run a command in a node's shell, returns its output"
+        return self.call('cmd', node=node, command=command)
+
+    def pexec(self, node, command):
+        "Run a command in a node, returns (out, err, ret)"
+        result = self.call('pexec', node=node, command=command)
+        return result['out'], result['err'], result['ret']
+
+    def close(self):
+        "Close the connection"
+        self.rfile.close()
+        self.sock.close()
+
+
+# Daemon #
+
+
+def loadTopo(spec):
+    "Returns the topology built by 'module:Class' (or 'module:function')"
+    moduleName, _, name = spec.partition(':')
+    if not name:
+        raise Exception("Topology must be given as module:Class")
+    return getattr(importlib.import_module(moduleName), name)()
+
+
+def main(argv=None):
+    "Start a network and serve it until shutdown"
+    parser = argparse.ArgumentParser(description='MiniNExT emulation server')
+    parser.add_argument('topo', help='topology, as module:Class')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET,
+                        help='unix socket path')
+    parser.add_argument('--sample', type=float, default=None,
+                        help='resource sampling interval (seconds)')
+    parser.add_argument('--loglevel', default='info')
+    args = parser.parse_args(argv)
+    setLogLevel(args.loglevel)
+
+    # patch isShellBuiltin (see the examples)
+    import mininet.util
+    import mininext.util
+    mininet.util.isShellBuiltin = mininext.util.isShellBuiltin
+
+    from mininext.net import MiniNExT
+    net = MiniNExT(loadTopo(args.topo))
+    net.start()
+    try:
+        if args.sample is not None:
+            net.startSampler(args.sample)
+        EmulationServer(net, args.socket).serve()
+    except Exception as e:  # still stop the network
+        error('*** Emulation server failed: %s\n' % e)
+    finally:
+        net.stop()
+
+
+if __name__ == '__main__':
+    main()
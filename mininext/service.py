@@ -3,6 +3,19 @@ Service Helper for MiniNExT.
 """
 
 import copy
+import ctypes
+import ctypes.util
+import errno
+import heapq
+import os
+import select
+import signal
+import threading
+import time
+from subprocess import STDOUT
+
+from mininet.log import error, warn
+
 from mininext.mount import MountProperties
 from mininext.util import ParamContainer
 
@@ -65,13 +78,34 @@ class Service(ParamContainer):
         "Subclasses can use this to perform detailed setup (as needed)"
         pass
 
+    # Preflight checks (before any node is started) #
+
+    def preflight(self, preflight, context, nodeParams, serviceParams):
+        """Report problems that would stop the service from being set up
+           or started on a node (see mininext.preflight). Subclasses can
+           extend this with their own checks
+           preflight: Preflight object to run (cached) checks with
+           context: name to report problems under (node/service)
+           nodeParams: the node's topology parameters
+           serviceParams: the node's parameters for this service"""
+        params = self.getGlobalParams().copy()
+        params.update(serviceParams or {})
+        self.preflightMounts(preflight, context, params)
+        startCmd = params.get('startCmd')
+        if params.get('autoStart') is True and startCmd:
+            preflight.executable(context, startCmd.split()[0])
+
+    def preflightMounts(self, preflight, context, params):
+        "Check the service mounts for a node's (merged) service parameters"
+        for mountPoint in self.getMountsForParams(params):
+            if mountPoint.hasSource() and mountPoint.target is not None:
+                preflight.mount(context, mountPoint)
+
     def setupNodeMounts(self, node):
         "Get the service mounts for a specific node"
         nodeServiceMounts = self.getMountsForNode(node)
         for mountPoint in nodeServiceMounts:
-            if mountPoint.source is not None and \
-                    mountPoint.source.path is not None and \
-                    mountPoint.target is not None:
+            if mountPoint.hasSource() and mountPoint.target is not None:
                 node.setupMountPoint(mountPoint)
 
     # Start / stop service management #
@@ -140,10 +174,14 @@ class Service(ParamContainer):
 
         # sanity check then grab the node's parameters
         self.errIfNodeNotSubscribed(node)
-        if self.hasNodeParam(node, 'mounts') is True:
+        return self.getMountsForParams(self.getNodeParams(node))
+
+    def getMountsForParams(self, params):
+        "Returns the service mounts for a node's (merged) service parameters"
+        if 'mounts' in params:
             # If a mounts parameter was passed for the node's config,
             # we override all other mounts and just use those in mounts
-            return self.getNodeParam(node, 'mounts')
+            return params['mounts']
 
         # allow overrides via defined configuration strings
         nodeMounts = []
@@ -153,8 +191,7 @@ class Service(ParamContainer):
             mountProperties = copy.deepcopy(mountProperties)
 
             # does the node have a serviceParam equal to this mountName?
-            nodeMountOptions = self.getNodeParam(node, mountName,
-                                                 defaultValue=None)
+            nodeMountOptions = params.get(mountName)
             if nodeMountOptions is None:
                 # The node does not wish to override this default mount
                 continue
@@ -188,3 +225,375 @@ class Service(ParamContainer):
            Thus, an attempt to use two instances of the same service
            in a single node will result in a collision"""
         return hash(self.name)
+
+
+# Process supervision #
+
+PIDFD_OPEN = 434  # pidfd_open(2) syscall number (Linux 5.3+)
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+
+def pidfdOpen(pid):
+    """Returns a pidfd that becomes readable when process pid exits,
+       or None if pidfds are not supported"""
+    fd = _libc.syscall(PIDFD_OPEN, ctypes.c_int(pid), ctypes.c_uint(0))
+    return fd if fd >= 0 else None
+
+
+def childPIDs(pid):
+    "Returns the PIDs of a process's children"
+    try:
+        with open('/proc/%d/task/%d/children' % (pid, pid)) as childFile:
+            return [int(child) for child in childFile.read().split()]
+    except IOError:
+        return []
+
+
+def namespacePID(pid):
+    "Returns a process's PID within its (innermost) PID namespace"
+    try:
+        with open('/proc/%d/status' % (pid)) as statusFile:
+            for line in statusFile:
+                if line.startswith('NSpid:'):
+                    return int(line.split()[-1])
+    except IOError:
+        return None
+    return pid
+
+
+class ManagedProcess(object):
+
+    """A daemon run in the foreground inside a node by a ProcessService,
+       restarted with exponential backoff if it exits unexpectedly"""
+
+    def __init__(self, node, name, args, restart=True, restartDelay=0.5,
+                 restartMaxDelay=30.0, restartStable=10.0, maxRestarts=None,
+                 logPath=None):
+        """node: node to run the process in
+           name: process name (e.g. zebra)
+           args: command to run (list)
+           restart: restart the process if it exits unexpectedly
+           restartDelay: delay before the first restart (doubled on each
+                         consecutive restart)
+           restartMaxDelay: maximum delay between restarts
+           restartStable: seconds of uptime after which the delay is reset
+           maxRestarts: maximum number of restarts (None for unlimited)
+           logPath: file on the host that receives the process's output"""
+        self.node = node
+        self.name = name
+        self.args = list(args)
+        self.restart = restart
+        self.restartDelay = restartDelay
+        self.restartMaxDelay = restartMaxDelay
+        self.restartStable = restartStable
+        self.maxRestarts = maxRestarts
+        self.logPath = logPath
+        self.popen = None
+        self.hostPID = None
+        self.startTime = None
+        self.exitTime = None
+        self.restarts = 0
+        self.delay = restartDelay
+        self.stopping = False
+        self.exited = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        "Launch the process inside the node"
+        devnull = open(os.devnull)
+        output = open(self.logPath or os.devnull, 'a')
+        try:
+            self.exited.clear()
+            self.popen = self.node.popen(self.args, stdin=devnull,
+                                         stdout=output, stderr=STDOUT,
+                                         close_fds=True)
+        finally:
+            devnull.close()
+            output.close()
+        self.hostPID = None
+        self.startTime = time.time()
+        self.exitTime = None
+
+    def running(self):
+        "Returns if the process has been started and has not exited"
+        return self.popen is not None and not self.exited.is_set()
+
+    def getHostPID(self):
+        """Returns the process's PID in the host's PID namespace (when the
+           node has a PID namespace, the process is forked by mxexec)"""
+        if not self.running():
+            return None
+        if self.hostPID is None:
+            if self.node.inPIDNamespace:
+                children = childPIDs(self.popen.pid)
+                self.hostPID = children[0] if children else None
+            else:
+                self.hostPID = self.popen.pid
+        return self.hostPID
+
+    def getNamespacePID(self):
+        "Returns the process's PID within the node's PID namespace"
+        hostPID = self.getHostPID()
+        return namespacePID(hostPID) if hostPID is not None else None
+
+    def signal(self, sig):
+        "Sends a signal to the process, returns if it was delivered"
+        hostPID = self.getHostPID()
+        if hostPID is None:
+            return False
+        try:
+            os.kill(hostPID, sig)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+            return False
+        return True
+
+    def nextDelay(self):
+        "Returns the delay before restarting, None if it is not restarted"
+        if self.stopping or not self.restart:
+            return None
+        if self.maxRestarts is not None and self.restarts >= self.maxRestarts:
+            return None
+        if self.exitTime - self.startTime >= self.restartStable:
+            self.delay = self.restartDelay
+        delay = self.delay
+        self.delay = min(self.delay * 2, self.restartMaxDelay)
+        return delay
+
+    def __repr__(self):
+        return '<%s %s on %s>' % (self.__class__.__name__, self.name,
+                                  self.node)
+
+
+class ProcessSupervisor(object):
+
+    """Waits for managed processes to exit and restarts crashed ones.
+       Exits are signalled by pidfds polled with epoll; on kernels without
+       pidfd support a thread blocks in wait() for each process instead"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.epoll = select.epoll()
+        self.wakeRead, self.wakeWrite = os.pipe()
+        self.epoll.register(self.wakeRead, select.EPOLLIN)
+        self.pidfds = {}  # pidfd -> process
+        self.reaped = []  # processes reaped by fallback wait threads
+        self.pending = []  # heap of (restart time, sequence, process)
+        self.sequence = 0
+        self.thread = threading.Thread(target=self.run,
+                                       name='mx-process-supervisor')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def watch(self, process):
+        "Watch a (just started) process for its exit"
+        pidfd = pidfdOpen(process.popen.pid)
+        if pidfd is None:
+            waiter = threading.Thread(target=self.waitFor, args=(process,))
+            waiter.daemon = True
+            waiter.start()
+            return
+        with self.lock:
+            self.pidfds[pidfd] = process
+        self.epoll.register(pidfd, select.EPOLLIN)
+
+    def waitFor(self, process):
+        "Block until a process exits (used without pidfd support)"
+        process.popen.wait()
+        with self.lock:
+            self.reaped.append(process)
+        os.write(self.wakeWrite, b'.')
+
+    def run(self):
+        "Supervisor loop: handle exits and due restarts"
+        while True:
+            with self.lock:
+                timeout = max(0, self.pending[0][0] - time.time()) \
+                    if self.pending else -1
+            try:
+                events = self.epoll.poll(timeout)
+            except IOError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            exited = []
+            for fd, _ in events:
+                if fd == self.wakeRead:
+                    os.read(self.wakeRead, 4096)
+                    continue
+                self.epoll.unregister(fd)
+                os.close(fd)
+                with self.lock:
+                    process = self.pidfds.pop(fd)
+                process.popen.wait()
+                exited.append(process)
+            with self.lock:
+                exited += self.reaped
+                self.reaped = []
+            for process in exited:
+                self.handleExit(process)
+            self.restartDue()
+
+    def handleExit(self, process):
+        "Record a process's exit and schedule its restart"
+        process.exitTime = time.time()
+        process.exited.set()
+        delay = process.nextDelay()
+        if delay is None:
+            return
+        warn('*** %s: %s exited with status %s, restarting in %.1fs\n'
+             % (process.node, process.name, process.popen.returncode, delay))
+        with self.lock:
+            heapq.heappush(self.pending, (time.time() + delay,
+                                          self.sequence, process))
+            self.sequence += 1
+
+    def restartDue(self):
+        "Restart the processes whose backoff delay has passed"
+        while True:
+            with self.lock:
+                if not self.pending or self.pending[0][0] > time.time():
+                    return
+                _, _, process = heapq.heappop(self.pending)
+            with process.lock:
+                if process.stopping:
+                    continue
+                process.restarts += 1
+                try:
+                    process.start()
+                except (OSError, IOError) as e:
+                    error('*** %s: unable to restart %s: %s\n'
+                          % (process.node, process.name, e))
+                    continue
+            self.watch(process)
+
+
+class ProcessService(Service):
+
+    """Service whose daemons are launched directly inside each node (rather
+       than through an init script). Their PIDs are tracked and daemons
+       that crash are restarted with exponential backoff.
+       Daemons must stay in the foreground; derived classes return the
+       commands to run from getProcesses() or use the processes parameter.
+       Node parameters: processes, restart, restartDelay, restartMaxDelay,
+       restartStable, maxRestarts (see ManagedProcess), processLogDir (host
+       directory for <node>-<name>.log output) and stopTimeout"""
+
+    def __init__(self, name, **kwargs):
+        Service.__init__(self, name, **kwargs)
+        self.processes = {}  # node -> [ManagedProcess]
+        self.supervisor = None
+
+    def getProcesses(self, node):
+        """Returns the [(name, args)] to run in a node, from the processes
+           parameter (a dict of name to command, or a list of commands)"""
+        processes = self.getNodeParam(node, 'processes', defaultValue=None)
+        if processes is None:
+            raise Exception("Cannot start service %s, processes not defined\n"
+                            % (self.name))
+        if isinstance(processes, dict):
+            processes = sorted(processes.items())
+        else:
+            processes = [(None, command) for command in processes]
+        commands = []
+        for name, command in processes:
+            if isinstance(command, basestring):
+                command = command.split()
+            commands.append((name or os.path.basename(command[0]), command))
+        return commands
+
+    def preflight(self, preflight, context, nodeParams, serviceParams):
+        "Check the service mounts and the executables of the processes"
+        params = self.getGlobalParams().copy()
+        params.update(serviceParams or {})
+        self.preflightMounts(preflight, context, params)
+        processes = params.get('processes')
+        if isinstance(processes, dict):
+            processes = processes.values()
+        for command in processes or []:
+            if isinstance(command, basestring):
+                command = command.split()
+            if command:
+                preflight.executable(context, command[0])
+
+    def start(self, node):
+        "Start the service's processes in a specific node"
+        self.errIfNodeNotSubscribed(node)
+        if self.processes.get(node):
+            raise Exception("Service %s is already running on node %s\n"
+                            % (self.name, node))
+        if self.supervisor is None:
+            self.supervisor = ProcessSupervisor()
+
+        def param(key, defaultValue):
+            "Returns one of the node's parameters"
+            return self.getNodeParam(node, key, defaultValue=defaultValue)
+
+        logDir = param('processLogDir', None)
+        started, errors = [], []
+        for name, args in self.getProcesses(node):
+            logPath = os.path.join(logDir, '%s-%s.log' % (node, name)) \
+                if logDir is not None else None
+            process = ManagedProcess(
+                node, name, args, restart=param('restart', True),
+                restartDelay=param('restartDelay', 0.5),
+                restartMaxDelay=param('restartMaxDelay', 30.0),
+                restartStable=param('restartStable', 10.0),
+                maxRestarts=param('maxRestarts', None), logPath=logPath)
+            try:
+                process.start()
+            except (OSError, IOError) as e:
+                errors.append('%s: %s' % (name, e))
+                continue
+            self.supervisor.watch(process)
+            started.append(process)
+        self.processes[node] = started
+
+        err, ret = '\n'.join(errors), 1 if errors else 0
+        if ret != 0 and self.getNodeParam(
+                node,
+                'exceptionOnStartFail') is True:
+            raise Exception("Error starting %s service\n"
+                            "Error = %s" % (self.name, err))
+        return {'err': err, 'ret': ret}
+
+    def stop(self, node):
+        """Stop the service's processes in a specific node (SIGTERM, then
+           SIGKILL for processes still running after stopTimeout)"""
+        self.errIfNodeNotSubscribed(node)
+        timeout = self.getNodeParam(node, 'stopTimeout', defaultValue=5.0)
+        processes = self.processes.pop(node, [])
+        for process in processes:
+            with process.lock:
+                process.stopping = True
+            process.signal(signal.SIGTERM)
+
+        errors = []
+        deadline = time.time() + timeout
+        for process in processes:
+            if process.exited.wait(max(0, deadline - time.time())):
+                continue
+            process.signal(signal.SIGKILL)
+            if not process.exited.wait(timeout):
+                errors.append('%s: still running' % (process.name))
+        return {'err': '\n'.join(errors), 'ret': 1 if errors else 0}
+
+    def getPIDs(self, node):
+        "Returns {name: (host PID, namespace PID)} of a node's processes"
+        return dict((process.name, (process.getHostPID(),
+                                    process.getNamespacePID()))
+                    for process in self.processes.get(node, []))
+
+    def status(self, node):
+        "Returns the state of each of the node's processes"
+        now = time.time()
+        return dict((process.name, {
+            'running': process.running(),
+            'hostPID': process.getHostPID(),
+            'nsPID': process.getNamespacePID(),
+            'restarts': process.restarts,
+            'uptime': now - process.startTime if process.running() else None,
+            'returncode': process.popen.returncode})
+            for process in self.processes.get(node, []))
@@ -0,0 +1,526 @@
+"""
+Lightweight BGP route injector service for load generation.
+
+Each subscribed node runs a minimal BGP speaker (this module, executed with
+python -m) that peers with a single router and streams generated or
+file-sourced prefixes to it at a configurable rate, packing as many prefixes
+as fit into each UPDATE message. The speaker uses a single-threaded select()
+event loop so it runs on the same Python versions as MiniNExT.
+"""
+
+import argparse
+import errno
+import json
+import os
+import select
+import socket
+import struct
+import sys
+import time
+from subprocess import PIPE
+
+from mininext.service import Service
+
+# BGP protocol #
+
+BGP_PORT = 179
+BGP_MARKER = b'\xff' * 16
+BGP_HEADER = struct.Struct('!16sHB')
+BGP_MAX_MESSAGE = 4096
+
+MSG_OPEN = 1
+MSG_UPDATE = 2
+MSG_NOTIFICATION = 3
+MSG_KEEPALIVE = 4
+
+AS_TRANS = 23456
+CAP_MULTIPROTOCOL = 1
+CAP_AS4 = 65
+
+ATTR_ORIGIN = 1
+ATTR_AS_PATH = 2
+ATTR_NEXT_HOP = 3
+ATTR_LOCAL_PREF = 5
+ATTR_AS4_PATH = 17
+ATTR_OPTIONAL = 0x80
+ATTR_TRANSITIVE = 0x40
+AS_SEQUENCE = 2
+
+
+def bgpMessage(msgType, body=b''):
+    "Returns a BGP message with its header"
+    return BGP_HEADER.pack(BGP_MARKER, BGP_HEADER.size + len(body),
+                           msgType) + body
+
+
+def openMessage(localAS, holdTime, routerID):
+    "Returns an OPEN advertising IPv4 unicast and 4-byte AS support"
+    capabilities = struct.pack('!BBHBB', CAP_MULTIPROTOCOL, 4, 1, 0, 1)
+    capabilities += struct.pack('!BBI', CAP_AS4, 4, localAS)
+    params = struct.pack('!BB', 2, len(capabilities)) + capabilities
+    myAS = localAS if localAS <= 0xffff else AS_TRANS
+    return bgpMessage(MSG_OPEN, struct.pack('!BHH4sB', 4, myAS, holdTime,
+                                            socket.inet_aton(routerID),
+                                            len(params)) + params)
+
+
+def pathAttributes(localAS, nexthop, as4, ibgp=False, localPref=100):
+    """Returns the path attributes shared by every injected prefix
+       localAS: AS number of the injector
+       nexthop: next hop announced for every prefix
+       as4: if the peer supports 4-byte AS numbers
+       ibgp: if the peer is in the injector's AS (empty AS_PATH and
+             LOCAL_PREF, as for locally originated routes)
+       localPref: LOCAL_PREF sent to iBGP peers"""
+    if ibgp:
+        asPath = b''
+    elif as4:
+        asPath = struct.pack('!BBI', AS_SEQUENCE, 1, localAS)
+    else:
+        asPath = struct.pack('!BBH', AS_SEQUENCE, 1,
+                             localAS if localAS <= 0xffff else AS_TRANS)
+    attrs = struct.pack('!BBBB', ATTR_TRANSITIVE, ATTR_ORIGIN, 1, 0)
+    attrs += struct.pack('!BBB', ATTR_TRANSITIVE, ATTR_AS_PATH,
+                         len(asPath)) + asPath
+    attrs += struct.pack('!BBB', ATTR_TRANSITIVE, ATTR_NEXT_HOP, 4) + \
+        socket.inet_aton(nexthop)
+    if ibgp:
+        attrs += struct.pack('!BBBI', ATTR_TRANSITIVE, ATTR_LOCAL_PREF, 4,
+                             localPref)
+    elif not as4 and localAS > 0xffff:
+        # the 2-byte peer sees AS_TRANS; AS4_PATH carries the real AS
+        as4Path = struct.pack('!BBI', AS_SEQUENCE, 1, localAS)
+        attrs += struct.pack('!BBB', ATTR_OPTIONAL | ATTR_TRANSITIVE,
+                             ATTR_AS4_PATH, len(as4Path)) + as4Path
+    return attrs
+
+
+def packNLRI(prefix):
+    "Returns the NLRI encoding of an a.b.c.d/len prefix"
+    address, _, length = prefix.partition('/')
+    length = int(length) if length else 32
+    return struct.pack('!B', length) + \
+        socket.inet_aton(address)[:(length + 7) // 8]
+
+
+def updateMessages(nlris, attrs, batchSize):
+    """Yields (UPDATE message, prefix count), packing up to batchSize
+       prefixes (and at most BGP_MAX_MESSAGE bytes) into each message"""
+    fixed = BGP_HEADER.size + 4 + len(attrs)
+    batch, size = [], fixed
+    for nlri in nlris:
+        if batch and (len(batch) >= batchSize or
+                      size + len(nlri) > BGP_MAX_MESSAGE):
+            yield (bgpMessage(MSG_UPDATE, struct.pack('!HH', 0, len(attrs)) +
+                              attrs + b''.join(batch)), len(batch))
+            batch, size = [], fixed
+        batch.append(nlri)
+        size += len(nlri)
+    if batch:
+        yield (bgpMessage(MSG_UPDATE, struct.pack('!HH', 0, len(attrs)) +
+                          attrs + b''.join(batch)), len(batch))
+
+# Prefix sources #
+
+
+def generatePrefixes(start, count):
+    """Yields count consecutive prefixes of the same length as start
+       (e.g. 100.0.0.0/24 -> 100.0.0.0/24, 100.0.1.0/24, ...)"""
+    address, _, length = start.partition('/')
+    length = int(length)
+    address = struct.unpack('!I', socket.inet_aton(address))[0]
+    step = 1 << (32 - length)
+    for i in range(count):
+        yield '%s/%d' % (socket.inet_ntoa(struct.pack(
+            '!I', (address + i * step) & 0xffffffff)), length)
+
+
+def filePrefixes(path):
+    "Yields the prefixes listed in a file (one per line, # comments)"
+    with open(path) as prefixFile:
+        for line in prefixFile:
+            line = line.split('#')[0].strip()
+            if line:
+                yield line
+
+# Speaker #
+
+
+class BGPInjector(object):
+
+    "Minimal BGP speaker that announces a stream of prefixes to one peer"
+
+    def __init__(self, peer, peerAS, localAS, routerID, nexthop, prefixes,
+                 rate=0, batchSize=1000, holdTime=180, statsPath=None,
+                 localPref=100):
+        """peer: IP address of the router to peer with
+           peerAS: AS number of the peer (checked against its OPEN)
+           localAS: AS number of the injector
+           routerID: BGP identifier of the injector
+           nexthop: next hop announced for every prefix
+           prefixes: iterable of a.b.c.d/len prefixes
+           rate: maximum prefixes announced per second (0: unlimited)
+           batchSize: maximum prefixes per UPDATE message
+           holdTime: hold time proposed in the OPEN message
+           statsPath: file the announce statistics are written to (JSON)
+           localPref: LOCAL_PREF announced if the peer is in localAS"""
+        self.peer = peer
+        self.peerAS = peerAS
+        self.localAS = localAS
+        self.routerID = routerID
+        self.nexthop = nexthop
+        self.prefixes = prefixes
+        self.rate = rate
+        self.batchSize = batchSize
+        self.holdTime = holdTime
+        self.statsPath = statsPath
+        self.localPref = localPref
+        self.remoteAS = peerAS
+        self.sock = None
+        self.inbuf = bytearray()
+        self.established = False
+        self.peerAS4 = False
+        self.keepaliveInterval = holdTime / 3.0
+        self.lastKeepalive = 0
+        self.negotiatedHold = 0  # hold time agreed with the peer (0: none)
+        self.lastReceived = 0
+        self.stats = {'state': 'Idle', 'announced': 0, 'updates': 0,
+                      'started': None, 'finished': None, 'rate': 0.0}
+        self.lastStatsWrite = 0
+
+    # Session handling #
+
+    def connect(self):
+        "Connect to the peer, retrying until it accepts"
+        self.setState('Connect')
+        while True:
+            try:
+                self.sock = socket.create_connection((self.peer, BGP_PORT),
+                                                     timeout=5)
+                break
+            except socket.error:
+                self.waitInput(1.0)
+        self.sock.setblocking(False)
+
+    def establish(self):
+        "Exchange OPEN / KEEPALIVE messages with the peer"
+        self.setState('OpenSent')
+        self.send(openMessage(self.localAS, self.holdTime, self.routerID))
+        msgType, body = self.receive()
+        if msgType != MSG_OPEN:
+            raise Exception("Expected OPEN from %s, got type %d"
+                            % (self.peer, msgType))
+        _, peerAS, peerHold, _, _ = struct.unpack_from('!BHH4sB', body)
+        self.peerAS4 = self.parseAS4(body)
+        if self.peerAS4 is not False:
+            peerAS, self.peerAS4 = self.peerAS4, True
+        if self.peerAS is not None and peerAS != self.peerAS:
+            raise Exception("Peer %s is AS %d, expected AS %d"
+                            % (self.peer, peerAS, self.peerAS))
+        self.remoteAS = peerAS
+        self.negotiatedHold = min(peerHold, self.holdTime)
+        if self.negotiatedHold:
+            self.keepaliveInterval = self.negotiatedHold / 3.0
+        self.sendKeepalive()
+        self.setState('OpenConfirm')
+        while True:
+            msgType, body = self.receive()
+            if msgType == MSG_KEEPALIVE:
+                break
+        self.established = True
+        self.setState('Established')
+
+    @staticmethod
+    def parseAS4(body):
+        "Returns the peer's 4-byte AS from its OPEN capabilities, or False"
+        offset = 10
+        end = offset + struct.unpack_from('!B', body, 9)[0]
+        while offset + 2 <= end:
+            paramType, paramLen = struct.unpack_from('!BB', body, offset)
+            if paramType == 2:
+                capOffset = offset + 2
+                while capOffset + 2 <= offset + 2 + paramLen:
+                    capCode, capLen = struct.unpack_from('!BB', body,
+                                                         capOffset)
+                    if capCode == CAP_AS4 and capLen == 4:
+                        return struct.unpack_from('!I', body,
+                                                  capOffset + 2)[0]
+                    capOffset += 2 + capLen
+            offset += 2 + paramLen
+        return False
+
+    # I/O #
+
+    def send(self, data):
+        "Send data, servicing the session while the socket is full"
+        while data:
+            try:
+                sent = self.sock.send(data)
+                data = data[sent:]
+            except socket.error as e:
+                if e.errno not in (errno.EAGAIN, errno.EINPROGRESS):
+                    raise
+                select.select([], [self.sock], [], 1.0)
+
+    def sendKeepalive(self):
+        "Send a KEEPALIVE message"
+        self.send(bgpMessage(MSG_KEEPALIVE))
+        self.lastKeepalive = time.time()
+
+    def receive(self):
+        "Returns the next (msgType, body) from the peer (blocking)"
+        while True:
+            message = self.nextMessage()
+            if message is not None:
+                return message
+            self.poll(1.0)
+
+    def nextMessage(self):
+        "Returns a buffered (msgType, body), or None"
+        if len(self.inbuf) < BGP_HEADER.size:
+            return None
+        _, length, msgType = BGP_HEADER.unpack_from(self.inbuf)
+        if length < BGP_HEADER.size:
+            raise Exception("Peer %s sent a message of invalid length %d"
+                            % (self.peer, length))
+        if len(self.inbuf) < length:
+            return None
+        body = bytes(self.inbuf[BGP_HEADER.size:length])
+        del self.inbuf[:length]
+        self.lastReceived = time.time()
+        if msgType == MSG_NOTIFICATION:
+            raise Exception("Peer %s sent NOTIFICATION (code %d/%d)"
+                            % (self.peer, ord(body[0:1]), ord(body[1:2])))
+        return msgType, body
+
+    def poll(self, timeout):
+        """Service the session: read input (once established, messages
+           are discarded and a NOTIFICATION raises), check the peer's hold
+           time, send keepalives, check stdin"""
+        readable = self.waitInput(timeout, [self.sock])
+        if self.sock in readable:
+            data = self.sock.recv(1 << 16)
+            if not data:
+                raise Exception("Peer %s closed the session" % (self.peer))
+            self.inbuf += data
+        if self.established:
+            while self.nextMessage() is not None:
+                pass  # UPDATEs / KEEPALIVEs from the peer are not used
+        if self.negotiatedHold and \
+                time.time() - self.lastReceived > self.negotiatedHold:
+            raise Exception("Hold timer expired: no message from %s for %d "
+                            "seconds" % (self.peer, self.negotiatedHold))
+        if time.time() - self.lastKeepalive >= self.keepaliveInterval:
+            self.sendKeepalive()
+        self.writeStats()
+
+    @staticmethod
+    def waitInput(timeout, sockets=()):
+        "Wait for input, exiting when stdin closes (the service stopped)"
+        readable, _, _ = select.select([sys.stdin] + list(sockets), [], [],
+                                       timeout)
+        if sys.stdin in readable and not os.read(sys.stdin.fileno(), 1024):
+            raise SystemExit(0)
+        return readable
+
+    # Statistics #
+
+    def setState(self, state):
+        "Record the session state"
+        self.stats['state'] = state
+        self.writeStats(force=True)
+
+    def writeStats(self, force=False):
+        "Write statistics (at most once per second unless forced)"
+        if self.statsPath is None or \
+                (not force and time.time() - self.lastStatsWrite < 1.0):
+            return
+        self.lastStatsWrite = time.time()
+        tmpPath = self.statsPath + '.tmp'
+        with open(tmpPath, 'w') as statsFile:
+            json.dump(self.stats, statsFile)
+        os.rename(tmpPath, self.statsPath)
+
+    # Main loop #
+
+    def announce(self):
+        "Stream all prefixes to the peer, honoring the rate limit"
+        attrs = pathAttributes(self.localAS, self.nexthop, self.peerAS4,
+                               ibgp=self.remoteAS == self.localAS,
+                               localPref=self.localPref)
+        nlris = (packNLRI(prefix) for prefix in self.prefixes)
+        started = self.stats['started'] = time.time()
+        for message, count in updateMessages(nlris, attrs, self.batchSize):
+            if self.rate:
+                # wait until the rate allows this batch
+                delay = started + (self.stats['announced'] + count) / \
+                    float(self.rate) - time.time()
+                while delay > 0:
+                    self.poll(min(delay, 1.0))
+                    delay = started + (self.stats['announced'] + count) / \
+                        float(self.rate) - time.time()
+            self.send(message)
+            self.stats['announced'] += count
+            self.stats['updates'] += 1
+            elapsed = time.time() - started
+            if elapsed > 0:
+                self.stats['rate'] = self.stats['announced'] / elapsed
+            self.poll(0)
+        self.stats['finished'] = time.time()
+        self.setState('Established')
+
+    def run(self):
+        "Connect, announce every prefix, then hold the session open"
+        try:
+            self.connect()
+            self.establish()
+            self.announce()
+            while True:
+                self.poll(1.0)
+        except Exception as e:
+            self.stats['error'] = str(e)
+            self.setState('Idle')
+            raise
+
+
+def main(argv=None):
+    "Entry point for running the injector inside a node"
+    parser = argparse.ArgumentParser(description='MiniNExT BGP injector')
+    parser.add_argument('--peer', required=True)
+    parser.add_argument('--peer-as', type=int, default=None)
+    parser.add_argument('--local-as', type=int, required=True)
+    parser.add_argument('--router-id', required=True)
+    parser.add_argument('--nexthop', required=True)
+    parser.add_argument('--generate', default='100.0.0.0/24',
+                        help='first prefix of generated range')
+    parser.add_argument('--count', type=int, default=0)
+    parser.add_argument('--prefix-file', default=None)
+    parser.add_argument('--rate', type=float, default=0)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--hold-time', type=int, default=180)
+    parser.add_argument('--stats', default=None)
+    parser.add_argument('--local-pref', type=int, default=100)
+    args = parser.parse_args(argv)
+    if args.prefix_file is not None:
+        prefixes = filePrefixes(args.prefix_file)
+    else:
+        prefixes = generatePrefixes(args.generate, args.count)
+    BGPInjector(peer=args.peer, peerAS=args.peer_as, localAS=args.local_as,
+                routerID=args.router_id, nexthop=args.nexthop,
+                prefixes=prefixes, rate=args.rate, batchSize=args.batch_size,
+                holdTime=args.hold_time, statsPath=args.stats,
+                localPref=args.local_pref).run()
+
+# Service #
+
+
+class BGPInjectorService(Service):
+
+    "Manages lightweight BGP route injectors"
+
+    def __init__(self, name="BGPInjector", **params):
+        """Initializes a BGPInjectorService instance with global parameters
+
+        Args:
+            name (str): Service name (derived class may wish to override)
+            params: Arbitrary length list of global properties for this service
+
+        """
+        Service.__init__(self, name=name, **params)
+        self.processes = {}  # node -> Popen object of the running injector
+
+    def verifyNodeMeetsServiceRequirements(self, node):
+        "The injector peers from the node's own network namespace"
+        if not node.inNamespace:
+            raise Exception("BGP injector requires a network namespace "
+                            "(node %s)\n" % (node))
+
+    def getDefaultGlobalParams(self):
+        "Returns the default parameters for this service"
+        defaults = {'autoStart': True,
+                    'autoStop': True,
+                    'peer': None,
+                    'peerAS': None,
+                    'localAS': None,
+                    'routerID': None,
+                    'nexthop': None,
+                    'generate': '100.0.0.0/24',
+                    'count': 10000,
+                    'prefixFile': None,
+                    'rate': 0,
+                    'batchSize': 1000,
+                    'holdTime': 180,
+                    'localPref': 100}
+        return defaults
+
+    def statsPath(self, node):
+        "Returns the path of the node's statistics file (inside the node)"
+        return '/tmp/mx-bgpinjector-%s.json' % (node.name)
+
+    def getInjectorArgs(self, node):
+        "Returns the command line used to run the node's injector"
+        params = self.getNodeParams(node)
+        for required in ('peer', 'localAS'):
+            if params.get(required) is None:
+                raise Exception("BGP injector parameter %s not set (node %s)\n"
+                                % (required, node))
+        args = [sys.executable, '-m', 'mininext.services.bgpinjector',
+                '--peer', params['peer'],
+                '--local-as', str(params['localAS']),
+                '--router-id', params['routerID'] or node.IP(),
+                '--nexthop', params['nexthop'] or node.IP(),
+                '--rate', str(params['rate']),
+                '--batch-size', str(params['batchSize']),
+                '--hold-time', str(params['holdTime']),
+                '--local-pref', str(params['localPref']),
+                '--stats', self.statsPath(node)]
+        if params['peerAS'] is not None:
+            args += ['--peer-as', str(params['peerAS'])]
+        if params['prefixFile'] is not None:
+            args += ['--prefix-file', params['prefixFile']]
+        else:
+            args += ['--generate', params['generate'],
+                     '--count', str(params['count'])]
+        return args
+
+    def start(self, node):
+        "Start the injector for a specific node (runs in the background)"
+        self.errIfNodeNotSubscribed(node)
+        if node in self.processes and self.processes[node].poll() is None:
+            return {'err': 'already running', 'ret': 1}
+        # The injector exits when its stdin is closed (see stop())
+        self.processes[node] = node.popen(self.getInjectorArgs(node),
+                                          stdin=PIPE, stdout=PIPE,
+                                          stderr=PIPE)
+        return {'err': '', 'ret': 0}
+
+    def stop(self, node, timeout=5.0):
+        "Stop the injector for a specific node"
+        self.errIfNodeNotSubscribed(node)
+        process = self.processes.pop(node, None)
+        if process is None:
+            return {'err': 'not running', 'ret': 1}
+        process.stdin.close()
+        deadline = time.time() + timeout
+        while process.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        if process.poll() is None:
+            process.kill()
+        err = process.stderr.read()
+        ret = process.wait()
+        return {'err': err, 'ret': ret}
+
+    def getStats(self, node):
+        """Returns the node's announce statistics: session state, prefixes
+           announced, UPDATEs sent, start / finish times, prefixes/s and
+           the error that ended the session, if any"""
+        path = '/proc/%d/root%s' % (node.pid, self.statsPath(node))
+        try:
+            with open(path) as statsFile:
+                return json.load(statsFile)
+        except (IOError, ValueError):
+            return None
+
+
+if __name__ == '__main__':
+    main()
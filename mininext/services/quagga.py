@@ -2,12 +2,585 @@
 Example service that manages Quagga routers
 """
 
+import errno
+import os
+import re
+import socket
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from multiprocessing.pool import ThreadPool
+
 from mininext.mount import MountProperties, ObjectPermissions, PathProperties
-from mininext.moduledeps import serviceCheck
-from mininext.service import Service
+from mininext.moduledeps import executableCheck, serviceCheck
+from mininext.service import ProcessService, Service
+
+
+# Persistent vty connections #
+
+VTY_TERMINATOR = b'\0\0\0'
+RECONNECT_ERRNOS = (errno.EPIPE, errno.ECONNRESET, errno.ECONNREFUSED,
+                    errno.ENOENT)
+
+
+class VtyError(Exception):
+
+    "Raised when a Quagga daemon's vty cannot be reached"
+
+    def __init__(self, message, err=None):
+        Exception.__init__(self, message)
+        self.errno = err
+
+
+class VtyConnection(object):
+
+    """Persistent connection to the vty (vtysh) unix socket of a daemon.
+       Commands are pipelined: all are written at once, then the replies
+       (each terminated by three NULs and a status byte) are read in order"""
+
+    def __init__(self, path, timeout=10.0):
+        """path: path of the daemon's vty socket (as seen from the host)
+           timeout: socket timeout in seconds"""
+        self.path = path
+        self.timeout = timeout
+        self.sock = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        "Connect to the daemon and enter enable mode"
+        self.close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except socket.error as e:
+            sock.close()
+            raise VtyError("Unable to connect to vty %s: %s" % (self.path, e),
+                           e.errno)
+        self.sock = sock
+        self.transact(['enable'])
+
+    def close(self):
+        "Close the connection (it is reopened by the next execute())"
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def execute(self, commands, callback=None):
+        """Run commands, reconnecting once if the daemon was restarted
+           (unless callback already received output, which cannot be
+           taken back)
+           commands: list of vty commands
+           callback: if set, callback(index, chunk) receives output as it
+                     arrives and the returned outputs are empty
+           returns: list of (status, output), one per command"""
+        delivered = []
+
+        def receive(index, chunk):
+            "Pass output to callback, noting that some was delivered"
+            delivered.append(True)
+            callback(index, chunk)
+
+        with self.lock:
+            for attempt in (0, 1):
+                try:
+                    if self.sock is None:
+                        self.connect()
+                    return self.transact(commands, callback and receive)
+                except (socket.error, VtyError) as e:
+                    self.close()
+                    # a restarted daemon closes / replaces its socket
+                    if attempt or delivered or getattr(e, 'errno', None) \
+                            not in RECONNECT_ERRNOS:
+                        raise VtyError("vty %s failed: %s" % (self.path, e))
+
+    def transact(self, commands, callback=None):
+        "Pipeline commands and read their replies (caller holds lock)"
+        self.sock.sendall(b''.join(command.encode() + b'\0'
+                                   for command in commands))
+        results = []
+        buf = b''
+        chunks = []
+        while len(results) < len(commands):
+            data = self.sock.recv(1 << 16)
+            if not data:
+                raise VtyError("daemon closed vty %s" % (self.path),
+                               errno.ECONNRESET)
+            buf += data
+            while len(results) < len(commands):
+                end = buf.find(VTY_TERMINATOR)
+                if end < 0 or end + 3 >= len(buf):
+                    break
+                chunks.append(buf[:end])
+                output = self.deliver(len(results), chunks, callback)
+                results.append((ord(buf[end + 3:end + 4]), output))
+                buf = buf[end + 4:]
+                chunks = []
+            # set aside output that cannot be part of a terminator
+            safe = buf.find(VTY_TERMINATOR)
+            if safe < 0:
+                safe = max(0, len(buf) - len(VTY_TERMINATOR) + 1)
+            if safe > 0 and len(results) < len(commands):
+                chunks.append(buf[:safe])
+                buf = buf[safe:]
+                if callback is not None:
+                    self.deliver(len(results), chunks, callback)
+                    chunks = []
+        return results
+
+    @staticmethod
+    def deliver(index, chunks, callback):
+        "Hands chunks to callback, or joins them into an output string"
+        if callback is None:
+            return b''.join(chunks).decode('utf-8', 'replace')
+        for chunk in chunks:
+            if chunk:
+                callback(index, chunk)
+        return ''
+
+
+class VtyPool(object):
+
+    "Pool of persistent vty connections, one per (node, daemon)"
+
+    def __init__(self, vtyDir='/run/quagga', timeout=10.0):
+        """vtyDir: directory holding vty sockets inside the nodes
+           timeout: socket timeout in seconds"""
+        self.vtyDir = vtyDir
+        self.timeout = timeout
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def socketPath(self, node, daemon):
+        """Returns the host path of a daemon's vty socket; the path is
+           resolved through the node's root so it uses the node's mounts"""
+        return '/proc/%d/root%s/%s.vty' % (node.pid, self.vtyDir, daemon)
+
+    def get(self, node, daemon):
+        "Returns the (possibly new) connection to a node's daemon"
+        with self.lock:
+            key = (node, daemon)
+            if key not in self.connections:
+                self.connections[key] = VtyConnection(
+                    self.socketPath(node, daemon), self.timeout)
+            return self.connections[key]
+
+    def execute(self, node, daemon, commands, callback=None):
+        "Run commands on a node's daemon (see VtyConnection.execute())"
+        return self.get(node, daemon).execute(commands, callback)
+
+    def close(self, node=None):
+        "Close the connections to a node (or to all nodes)"
+        with self.lock:
+            for key in list(self.connections):
+                if node is None or key[0] == node:
+                    self.connections.pop(key).close()
+
+
+# Routing table (RIB) parsing #
+
+RIB_BEST = 0x1
+RIB_VALID = 0x2
+RIB_INTERNAL = 0x4
+
+# Column layout of 'show ip bgp' (see bgp_route.c: route_vty_out)
+RIB_NEXTHOP_COL = 20
+RIB_METRIC_COL = 36
+RIB_PATH_COL = 61
+
+
+def classfulLength(address):
+    "Returns the classful prefix length Quagga omits when printing"
+    if address == 0:
+        return 0
+    firstOctet = address >> 24
+    if firstOctet < 128:
+        return 8
+    if firstOctet < 192:
+        return 16
+    return 24
+
+
+class RIB(object):
+
+    """Compact, columnar BGP routing table (one row per path).
+       Prefixes and lengths are packed arrays, next hops and AS paths
+       (including the origin code) are interned and stored as indices"""
+
+    def __init__(self):
+        self.prefixes = array('L')
+        self.lengths = array('B')
+        self.nexthops = array('L')
+        self.paths = array('L')
+        self.flags = array('B')
+        self.nexthopTable, self.nexthopIndex = [], {}
+        self.pathTable, self.pathIndex = [], {}
+
+    @staticmethod
+    def intern(value, table, index):
+        "Returns the index of value in table, adding it if needed"
+        position = index.get(value)
+        if position is None:
+            position = index[value] = len(table)
+            table.append(value)
+        return position
+
+    def add(self, address, length, nexthop, path, flags):
+        """Add a path to the table
+           address: prefix as an integer
+           length: prefix length
+           nexthop: next hop string
+           path: AS path and origin code string (e.g. '200 300 i')
+           flags: RIB_BEST / RIB_VALID / RIB_INTERNAL bitmask"""
+        self.prefixes.append(address)
+        self.lengths.append(length)
+        self.nexthops.append(self.intern(nexthop, self.nexthopTable,
+                                         self.nexthopIndex))
+        self.paths.append(self.intern(path, self.pathTable, self.pathIndex))
+        self.flags.append(flags)
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    @staticmethod
+    def prefixString(address, length):
+        "Returns a prefix in a.b.c.d/len form"
+        return '%s/%d' % (socket.inet_ntoa(struct.pack('!L', address)),
+                          length)
+
+    def routes(self):
+        "Yields (prefix, nexthop, path, flags) for every path"
+        for i in range(len(self)):
+            yield (self.prefixString(self.prefixes[i], self.lengths[i]),
+                   self.nexthopTable[self.nexthops[i]],
+                   self.pathTable[self.paths[i]], self.flags[i])
+
+    def bestRoutes(self):
+        "Returns {(address, length): (nexthop, path)} for best paths"
+        best = {}
+        nexthopTable, pathTable = self.nexthopTable, self.pathTable
+        for i in range(len(self)):
+            if self.flags[i] & RIB_BEST:
+                best[(self.prefixes[i], self.lengths[i])] = \
+                    (nexthopTable[self.nexthops[i]], pathTable[self.paths[i]])
+        return best
+
+    def diff(self, other):
+        """Compares the best paths of this (older) table with other
+           returns: RIBDiff object"""
+        before, after = self.bestRoutes(), other.bestRoutes()
+        diff = RIBDiff()
+        for key, route in after.items():
+            if key not in before:
+                diff.added.append((self.prefixString(*key),) + route)
+            elif before[key] != route:
+                diff.changed.append((self.prefixString(*key),) +
+                                    before[key] + route)
+        for key, route in before.items():
+            if key not in after:
+                diff.removed.append((self.prefixString(*key),) + route)
+        return diff
+
+
+class RIBDiff(object):
+
+    """Differences between the best paths of two RIB snapshots.
+       added / removed: [(prefix, nexthop, path)]
+       changed: [(prefix, oldNexthop, oldPath, newNexthop, newPath)]"""
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.changed = []
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def __repr__(self):
+        return '<RIBDiff +%d -%d ~%d>' % (len(self.added), len(self.removed),
+                                          len(self.changed))
+
+
+class RIBParser(object):
+
+    """Incremental parser for 'show ip bgp' output. Output may be fed in
+       arbitrary chunks as it arrives (see QuaggaService.getRIB())"""
+
+    def __init__(self, rib=None):
+        "rib: RIB object to fill (a new RIB by default)"
+        self.rib = rib if rib is not None else RIB()
+        self.partial = ''
+        self.inTable = False
+        self.lastPrefix = None  # (address, length) of previous route line
+        self.wrapped = None  # (status, prefix) of a line that was wrapped
+
+    def feed(self, data):
+        "Parse the next chunk of output (str or bytes)"
+        if isinstance(data, bytes) and not isinstance(data, str):
+            data = data.decode('utf-8', 'replace')
+        lines = (self.partial + data).split('\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self.parseLine(line.rstrip('\r'))
+
+    def close(self):
+        "Parse any remaining output, returns the RIB"
+        if self.partial:
+            self.parseLine(self.partial)
+            self.partial = ''
+        return self.rib
+
+    def parseLine(self, line):
+        "Parse a single line of output"
+        if not self.inTable:
+            self.inTable = line.lstrip().startswith('Network')
+            return
+        if not line.strip():
+            return
+        if self.wrapped is not None:
+            # a long prefix was printed on a line of its own
+            (status, network), self.wrapped = self.wrapped, None
+        elif not line.startswith(('*', ' ', 's', 'S', 'R', 'd', 'h', 'r')):
+            return  # trailer (e.g. 'Total number of prefixes')
+        elif line[3:4] != ' ' and len(line[3:].split()) == 1:
+            self.wrapped = (line[:3], line[3:].strip())
+            return
+        else:
+            status, network = line[:3], line[3:RIB_NEXTHOP_COL].strip()
+        if len(line) < RIB_METRIC_COL:
+            return
+
+        if network:
+            address, _, length = network.partition('/')
+            try:
+                address = struct.unpack('!L', socket.inet_aton(address))[0]
+            except socket.error:
+                return  # not an IPv4 prefix
+            length = int(length) if length else classfulLength(address)
+            self.lastPrefix = (address, length)
+        elif self.lastPrefix is None:
+            return
+
+        flags = 0
+        if '*' in status:
+            flags |= RIB_VALID
+        if '>' in status:
+            flags |= RIB_BEST
+        if status[2] == 'i':
+            flags |= RIB_INTERNAL
+        nexthop = line[RIB_NEXTHOP_COL:RIB_METRIC_COL].strip()
+        path = line[RIB_PATH_COL:].strip()
+        self.rib.add(self.lastPrefix[0], self.lastPrefix[1], nexthop, path,
+                     flags)
+
+
+def parseRIB(output):
+    "Returns a RIB for a complete 'show ip bgp' output string"
+    parser = RIBParser()
+    parser.feed(output)
+    return parser.close()
+
+
+# Daemon options (/etc/quagga/daemons and debian.conf) #
+
+QUAGGA_DAEMONS = ['zebra', 'bgpd', 'ospfd', 'ospf6d', 'ripd', 'ripngd',
+                  'isisd']
+
+
+def getShellVar(text, name, default=None):
+    "Returns the (unquoted) value of a name=value line in a shell file"
+    match = re.search(r'^\s*%s=(.*)$' % re.escape(name), text, re.M)
+    if match is None:
+        return default
+    return match.group(1).strip().strip('"\'')
+
+
+def setShellVar(text, name, value):
+    "Sets (or appends) a name=value line in a shell file"
+    line = '%s=%s' % (name, value)
+    if not re.match(r'^[\w.\-]+$', value):
+        line = '%s="%s"' % (name, value)
+    pattern = re.compile(r'^\s*%s=.*$' % re.escape(name), re.M)
+    if pattern.search(text):
+        return pattern.sub(lambda _: line, text)
+    return text.rstrip('\n') + '\n' + line + '\n'
+
+
+# Configuration diffing (hot reload) #
+
+CONFIG_CONTEXTS = re.compile(r'^(router|interface|line|route-map|key chain|'
+                             r'ip vrf|vrf)\b')
+CONFIG_IGNORE = re.compile(r'^(!|Building configuration|Current configuration'
+                           r'|end$|exit$|version )')
+# Commands holding a single value: a new value replaces the old one, so only
+# the new form is sent (e.g. 'no neighbor X remote-as' deletes the peer)
+CONFIG_SINGLE = re.compile(
+    r'^(hostname|password|enable password|log file|router-id|'
+    r'(bgp|ospf) router-id|description|bandwidth|timers bgp|'
+    r'ip ospf (cost|priority|hello-interval|dead-interval)|'
+    r'neighbor \S+ (remote-as|description|update-source|ebgp-multihop|'
+    r'peer-group|password|weight|maximum-prefix|advertisement-interval|'
+    r'local-as)|'
+    r'ip(v6)? prefix-list \S+ seq \d+|set \S+|'
+    r'match (ip address|ip next-hop|as-path|community|metric))\b')
+CONFIG_FILTER = re.compile(r'^(neighbor \S+ (route-map|prefix-list|'
+                           r'filter-list|distribute-list)) \S+ (in|out)$')
+# Lists whose entries are matched in order: they are rewritten as a whole
+CONFIG_LIST = re.compile(r'^(access-list \S+|ipv6 access-list \S+|'
+                         r'ip(v6)? prefix-list \S+|'
+                         r'ip as-path access-list \S+|'
+                         r'ip community-list ((standard|expanded) )?\S+)')
+CONFIG_SEQ = re.compile(r' seq \d+')
+CONFIG_PEER = re.compile(r'^neighbor (\S+) ')
+CONFIG_REMOTE_AS = re.compile(r'^neighbor (\S+) remote-as ')
+
 
+def parseConfig(text):
+    """Returns {context: [commands]} for a Quagga config, where context is
+       () for top-level commands, (header,) for blocks such as router bgp,
+       and (header, address-family) for address families within a block"""
+    config = {(): []}
+    context = ()
+    for rawLine in text.splitlines():
+        line = rawLine.strip()
+        if not line or CONFIG_IGNORE.match(line):
+            continue
+        if not rawLine[0].isspace():
+            context = (line,) if CONFIG_CONTEXTS.match(line) else ()
+            config.setdefault(context, [])
+            if context:
+                continue
+        elif line.startswith('address-family ') and context:
+            context = (context[0], line)
+            config.setdefault(context, [])
+            continue
+        elif line == 'exit-address-family' and len(context) > 1:
+            context = context[:1]
+            continue
+        config[context].append(line)
+    return config
 
-class QuaggaService(Service):
+
+def negate(command):
+    "Returns the command that removes command"
+    if command.startswith('no '):
+        return command[3:]
+    return 'no ' + command
+
+
+def commandKey(command):
+    """Returns what identifies a command in a config: the command itself,
+       or the setting of a single-value command"""
+    match = CONFIG_FILTER.match(command)
+    if match:
+        return '%s %s' % (match.group(1), match.group(3))
+    match = CONFIG_SINGLE.match(command)
+    if match:
+        return match.group(1)
+    return command
+
+
+def listName(command, sequenced=()):
+    """Returns the ordered list (e.g. 'access-list 10') a command adds an
+       entry to, or None; sequenced: prefix-lists whose entries are
+       numbered, and so are updated entry by entry"""
+    match = CONFIG_LIST.match(command)
+    if match is None or match.group(1) in sequenced:
+        return None
+    return match.group(1)
+
+
+def diffLists(old, new):
+    """Returns the commands rewriting the ordered lists of top-level commands
+       that differ, and the remaining (unordered) commands of old and new"""
+    # prefix-lists given with sequence numbers in the new config
+    sequenced = set(listName(command) for command in new
+                    if CONFIG_SEQ.search(command) and
+                    command.startswith(('ip prefix-list ',
+                                        'ipv6 prefix-list ')))
+    oldLists, newLists = {}, {}
+    for commands, lists in ((old, oldLists), (new, newLists)):
+        for command in commands:
+            name = listName(command, sequenced)
+            if name is not None:
+                lists.setdefault(name, []).append(command)
+
+    changes = []
+    for name in sorted(set(oldLists) | set(newLists)):
+        # running configs number prefix-list entries, even if not given so
+        oldEntries = [CONFIG_SEQ.sub('', command, 1)
+                      for command in oldLists.get(name, [])]
+        newEntries = newLists.get(name, [])
+        if oldEntries == newEntries:
+            continue
+        if oldEntries:
+            changes.append('no ' + name)
+        changes += newEntries
+    unordered = [[command for command in commands
+                  if listName(command, sequenced) is None]
+                 for commands in (old, new)]
+    return changes, unordered[0], unordered[1]
+
+
+def diffConfig(running, desired):
+    """Returns the vty commands (within configure terminal) that turn the
+       running config into the desired config (both as text)"""
+    running, desired = parseConfig(running), parseConfig(desired)
+    leave = {0: [], 1: ['exit'], 2: ['exit-address-family', 'exit']}
+    commands = []
+
+    # Remove blocks that no longer exist (vty lines cannot be removed, and
+    # daemons list every interface but cannot delete existing ones)
+    for context in running:
+        if len(context) == 1 and context not in desired and \
+                not context[0].startswith(('line ', 'interface ')):
+            commands.append(negate(context[0]))
+
+    # Update and add blocks (sorted so blocks precede their families)
+    removedPeers, resetPeers = {}, {}  # block -> peer addresses
+    for context in sorted(set(running) | set(desired), key=len):
+        if context[:1] not in desired:
+            continue  # whole block removed above
+        old, new = running.get(context, []), desired.get(context, [])
+        changes = []
+        if not context:
+            changes, old, new = diffLists(old, new)
+        if len(context) == 1:
+            # peers whose AS changed, or that are removed (along with
+            # their other commands)
+            oldAS = dict((CONFIG_REMOTE_AS.match(command).group(1), command)
+                         for command in old if CONFIG_REMOTE_AS.match(command))
+            newAS = dict((CONFIG_REMOTE_AS.match(command).group(1), command)
+                         for command in new if CONFIG_REMOTE_AS.match(command))
+            removedPeers[context] = set(oldAS) - set(newAS)
+            resetPeers[context] = set(peer for peer in newAS if peer in oldAS
+                                      and newAS[peer] != oldAS[peer])
+        removed = removedPeers.get(context[:1], ())
+        reset = resetPeers.get(context[:1], ())
+
+        oldSet, newSet = set(old), set(new)
+        newKeys = set(commandKey(command) for command in new)
+        for command in old:
+            peer = CONFIG_PEER.match(command)
+            if command in newSet or commandKey(command) in newKeys or \
+                    (peer and peer.group(1) in removed and
+                     not CONFIG_REMOTE_AS.match(command)):
+                continue
+            changes.append(negate(command))
+        changes += [command for command in new if command not in oldSet]
+        # changing a peer's AS resets part of its configuration (e.g.
+        # route-reflector-client, local-as): send its other commands again
+        changes += [command for command in new if command in oldSet and
+                    CONFIG_PEER.match(command) and
+                    CONFIG_PEER.match(command).group(1) in reset]
+        if changes or (context not in running and context in desired):
+            commands += list(context) + changes + leave[len(context)]
+    return commands
+
+
+class QuaggaService(ProcessService):
 
     "Manages Quagga Software Router Service"
 
@@ -20,14 +593,24 @@ class QuaggaService(Service):
 
         """
 
-        # Verify that Quagga is installed"
-        serviceCheck('quagga', moduleName='Quagga (nongnu.org/quagga/)')
-
         # Call service initialization (will set defaultGlobalParams)
-        Service.__init__(self, name=name, **params)
+        ProcessService.__init__(self, name=name, **params)
+
+        # Verify that Quagga is installed
+        if self.getGlobalParam('directExec') is True:
+            binDir = self.getGlobalParam('quaggaBinDir')
+            executableCheck(os.path.join(binDir, 'zebra'),
+                            os.path.join(binDir, 'bgpd'),
+                            moduleName='Quagga (nongnu.org/quagga/)')
+        else:
+            serviceCheck('quagga', moduleName='Quagga (nongnu.org/quagga/)')
 
         self.getDefaultGlobalMounts()
 
+        # Persistent connections used by query()
+        self.vtyPool = VtyPool(vtyDir=self.getGlobalParam('vtyDir'),
+                               timeout=self.getGlobalParam('vtyTimeout'))
+
     def verifyNodeMeetsServiceRequirements(self, node):
         """Verifies that a specified node is configured to support Quagga
 
@@ -53,6 +636,60 @@ class QuaggaService(Service):
             raise Exception("Quagga service requires private /run (node %s)\n"
                             % (node))
 
+    def preflight(self, preflight, context, nodeParams, serviceParams):
+        """Checks, before any node is started, what setting up and starting
+           Quagga on a node requires (see :class:`.Service`)
+
+        Args:
+            preflight: Preflight object to run (cached) checks with
+            context (str): name to report problems under
+            nodeParams (dict): the node's topology parameters
+            serviceParams (dict): the node's parameters for this service
+
+        """
+        params = self.getGlobalParams().copy()
+        params.update(serviceParams or {})
+        if params.get('directExec') is True:
+            ProcessService.preflight(self, preflight, context, nodeParams,
+                                     serviceParams)
+            binDir = params.get('quaggaBinDir')
+            for daemon in self.getDaemonsForParams(params):
+                preflight.executable(context, os.path.join(binDir, daemon))
+        else:
+            Service.preflight(self, preflight, context, nodeParams,
+                              serviceParams)
+            preflight.initScript(context, 'quagga')
+
+        # node requirements (see verifyNodeMeetsServiceRequirements())
+        if not nodeParams.get('inPIDNamespace', False):
+            preflight.report(context, "Quagga service requires PID namespace")
+        for key, name in (('privateLogDir', 'logs'),
+                          ('privateRunDir', '/run')):
+            if nodeParams.get(key) in (None, False):
+                preflight.report(context, "Quagga service requires private %s"
+                                 % (name))
+
+        # log directory owner (see setupNodeForService())
+        preflight.user(context, 'quagga')
+        preflight.group(context, 'quagga')
+
+        # configuration files read on the host
+        configDirs = self.getConfigLayers(params)
+        for configDir in configDirs:
+            preflight.path(context, configDir, isDir=True)
+        configFiles = set()
+        if params.get('zebra', True) is False:
+            configFiles.add('daemons')
+        if params.get('fibInstall', True) is False or \
+                params.get('directExec') is True:
+            configFiles.add('debian.conf')
+        for configFile in sorted(configFiles) if configDirs else []:
+            paths = [os.path.join(configDir, configFile)
+                     for configDir in configDirs]
+            if not any(os.path.exists(path) for path in paths):
+                preflight.report(context, "Quagga config file %s not found "
+                                 "in %s" % (configFile, ', '.join(configDirs)))
+
     def setupNodeForService(self, node):
         """After mounts and other operations taken care of by Service Helper,
            we perform a few last minute tasks here"""
@@ -61,13 +698,330 @@ class QuaggaService(Service):
         _, err, ret = node.pexec("mkdir /var/log/quagga")
         _, err, ret = node.pexec("chown quagga:quagga /var/log/quagga")
 
+        # Override daemon options for control-plane-only nodes
+        self.setupDaemonOptions(node)
+
+    def setupDaemonOptions(self, node):
+        """Overrides the daemons / debian.conf of the node's config for
+           control-plane-only operation: with fibInstall=False, bgpd runs
+           with --no_kernel; with zebra=False, zebra is not started.
+           The overrides are bind mounted, the config source is unchanged"""
+        fibInstall = self.getNodeParam(node, 'fibInstall', defaultValue=True)
+        runZebra = self.getNodeParam(node, 'zebra', defaultValue=True)
+        if fibInstall is not False and runZebra is not False:
+            return
+
+        if runZebra is False:
+            self.bindOverride(node, 'daemons',
+                              lambda text: setShellVar(text, 'zebra', 'no'))
+        if fibInstall is False:
+            def noKernel(text):
+                "Add --no_kernel to bgpd's options"
+                options = getShellVar(text, 'bgpd_options',
+                                      '--daemon -A 127.0.0.1')
+                if '--no_kernel' not in options.split():
+                    options += ' --no_kernel'
+                return setShellVar(text, 'bgpd_options', options)
+            self.bindOverride(node, 'debian.conf', noKernel)
+
+    def bindOverride(self, node, configFile, update):
+        """Bind a modified copy of one of the node's Quagga config files
+           (with an overlay config, the file is modified in the overlay)
+           configFile: file name (e.g. daemons) under the config directory
+           update: function that returns the modified file contents"""
+        if self.getNodeParam(node, 'quaggaConfigBase',
+                             defaultValue=None) is not None:
+            # the node's /etc/quagga is writable and private to the node
+            path = '/proc/%d/root/etc/quagga/%s' % (node.pid, configFile)
+            with open(path) as configFileObj:
+                text = configFileObj.read()
+            with open(path, 'w') as configFileObj:
+                configFileObj.write(update(text))
+            return
+        configDir = self.getNodeParam(node, 'quaggaConfigPath',
+                                      defaultValue=None)
+        if not isinstance(configDir, basestring):
+            raise Exception("Quagga daemon options require quaggaConfigPath "
+                            "(node %s)\n" % (node))
+        with open(os.path.join(configDir, configFile)) as sourceFile:
+            text = sourceFile.read()
+        overrideFile = tempfile.NamedTemporaryFile(
+            mode='w', prefix=('mx-quagga-%s-%s-' % (node, configFile)),
+            delete=False)
+        with overrideFile:
+            overrideFile.write(update(text))
+        os.chmod(overrideFile.name, 0o644)
+        node.bindObject(overrideFile.name,
+                        os.path.join('/etc/quagga', configFile))
+
+    def getDaemons(self, node):
+        "Returns the daemons the node runs (from its config's daemons file)"
+        return self.getDaemonsForParams(self.getNodeParams(node))
+
+    def getDaemonsForParams(self, params):
+        "Returns the daemons run with a node's (merged) service parameters"
+        daemons = ['zebra', 'bgpd']
+        for configDir in self.getConfigLayers(params):
+            try:
+                with open(os.path.join(configDir, 'daemons')) as daemonsFile:
+                    text = daemonsFile.read()
+            except IOError:
+                continue
+            daemons = [daemon for daemon in QUAGGA_DAEMONS
+                       if getShellVar(text, daemon) == 'yes']
+            break
+        if params.get('zebra', True) is False and 'zebra' in daemons:
+            daemons.remove('zebra')
+        return daemons
+
+    def getConfigLayers(self, params):
+        """Returns the host directories a node's /etc/quagga is made of,
+           topmost first: quaggaConfigPath, then quaggaConfigBase"""
+        mount = MountProperties(target='/etc/quagga',
+                                source=params.get('quaggaConfigPath'),
+                                mode='overlay',
+                                base=params.get('quaggaConfigBase'))
+        return [layer for layer in mount.layers()
+                if isinstance(layer, basestring)]
+
+    def isReady(self, node):
+        "Returns if every daemon of the node answers on its vty"
+        for daemon in self.getDaemons(node):
+            try:
+                self.vtyPool.execute(node, daemon, ['show version'])
+            except VtyError:
+                return False
+        return True
+
+    def waitReady(self, node, timeout=30.0, interval=0.2):
+        "Waits until every daemon of the node answers, returns success"
+        deadline = time.time() + timeout
+        while not self.isReady(node):
+            if time.time() >= deadline:
+                return False
+            time.sleep(interval)
+        return True
+
+    def getProcesses(self, node):
+        """Returns the daemon commands used with directExec: each daemon runs
+           in the foreground with the options from the node's debian.conf
+
+        Args:
+            node: Node to run the daemons in
+
+        Returns:
+            list of (daemon, command) pairs, zebra first
+
+        """
+        binDir = self.getNodeParam(node, 'quaggaBinDir')
+        vtyDir = self.getNodeParam(node, 'vtyDir')
+        fibInstall = self.getNodeParam(node, 'fibInstall', defaultValue=True)
+        # read through the node's root to pick up any bind mounted override
+        debianConf = ''
+        try:
+            with open('/proc/%d/root/etc/quagga/debian.conf'
+                      % (node.pid)) as confFile:
+                debianConf = confFile.read()
+        except IOError:
+            pass
+
+        processes = []
+        for daemon in self.getDaemons(node):
+            options = [option for option in getShellVar(
+                debianConf, '%s_options' % (daemon), '-A 127.0.0.1').split()
+                if option not in ('-d', '--daemon')]
+            if daemon == 'bgpd' and fibInstall is False and \
+                    '--no_kernel' not in options:
+                options.append('--no_kernel')
+            processes.append((daemon, [
+                os.path.join(binDir, daemon),
+                '-f', '/etc/quagga/%s.conf' % (daemon),
+                '-i', os.path.join(vtyDir, '%s.pid' % (daemon))] + options))
+        return processes
+
+    def start(self, node):
+        """Start Quagga for a specific node, through the init script or, with
+           directExec, by running and supervising the daemons directly"""
+        if self.getNodeParam(node, 'directExec', defaultValue=False) is True:
+            vtyDir = self.getNodeParam(node, 'vtyDir')
+            node.pexec('mkdir -p %s' % (vtyDir))
+            node.pexec('chown quagga:quagga %s' % (vtyDir))
+            return ProcessService.start(self, node)
+        return Service.start(self, node)
+
+    def stop(self, node):
+        "Stop the service for a specific node (closes its vty connections)"
+        self.vtyPool.close(node)
+        if self.getNodeParam(node, 'directExec', defaultValue=False) is True:
+            return ProcessService.stop(self, node)
+        return Service.stop(self, node)
+
+    # Daemon queries #
+
+    def query(self, node, commands, daemon='bgpd', callback=None):
+        """Run vty commands on one of a node's daemons over a persistent
+           connection (commands are pipelined)
+
+        Args:
+            node: Node running the daemon
+            commands: a command string, or a list of commands
+            daemon (str): daemon to query (e.g. zebra, bgpd)
+            callback: optional callback(index, chunk) for streaming output
+
+        Returns:
+            The command's output for a single command, otherwise a list of
+            outputs; raises an exception if a command returns an error
+
+        """
+        self.errIfNodeNotSubscribed(node)
+        single = isinstance(commands, basestring)
+        if single:
+            commands = [commands]
+        results = self.vtyPool.execute(node, daemon, commands, callback)
+        for command, (status, output) in zip(commands, results):
+            if status != 0:
+                raise Exception("Command '%s' failed on %s (node %s)\n%s"
+                                % (command, daemon, node, output))
+        outputs = [output for _, output in results]
+        return outputs[0] if single else outputs
+
+    def queryAll(self, nodes, commands, daemon='bgpd', maxThreads=32):
+        """Run the same vty commands on many nodes concurrently
+
+        Args:
+            nodes: list of nodes
+            commands: a command string, or a list of commands
+            daemon (str): daemon to query
+            maxThreads (int): maximum number of concurrent queries
+
+        Returns:
+            dict of node to query() result; nodes whose query failed map
+            to the exception that was raised
+
+        """
+        def queryNode(node):
+            "query() a single node, returning errors as values"
+            try:
+                return node, self.query(node, commands, daemon)
+            except Exception as e:  # reported per node
+                return node, e
+
+        nodes = list(nodes)
+        if not nodes:
+            return {}
+        pool = ThreadPool(min(maxThreads, len(nodes)))
+        try:
+            return dict(pool.map(queryNode, nodes))
+        finally:
+            pool.close()
+            pool.join()
+
+    def configure(self, node, commands, daemon='bgpd'):
+        """Apply configuration commands to a running daemon over its vty
+           commands: list of commands (entered in configure terminal mode)"""
+        return self.query(node, ['configure terminal'] + list(commands) +
+                          ['end'], daemon=daemon)
+
+    def getASN(self, node):
+        "Returns the AS number of a node's running bgpd (None if unset)"
+        for line in self.query(node, 'show running-config').splitlines():
+            if line.startswith('router bgp '):
+                return int(line.split()[2])
+        return None
+
+    def getRIB(self, node, command='show ip bgp'):
+        """Returns a node's BGP table as a RIB, parsed while it streams in
+           from bgpd (the full output is never held in memory)"""
+        parser = RIBParser()
+        self.query(node, command, daemon='bgpd',
+                   callback=lambda _, chunk: parser.feed(chunk))
+        return parser.close()
+
+    # Hot configuration reload #
+
+    def reload(self, node, newConfig, daemons=None, save=False):
+        """Applies a new configuration to a node's running daemons by
+           sending only the statements that differ from the running config
+
+        Args:
+            node: Node running the daemons
+            newConfig: config directory (holding <daemon>.conf files) or
+                dict of daemon name to config text
+            daemons: daemons to reload (default: all found in newConfig)
+            save (bool): write the applied config to the daemon's file
+
+        Returns:
+            dict with the number of commands applied per daemon, any
+            rejected commands (errors), and the time taken (seconds)
+
+        """
+        self.errIfNodeNotSubscribed(node)
+        started = time.time()
+        if isinstance(newConfig, basestring):
+            configDir, newConfig = newConfig, {}
+            for daemon in QUAGGA_DAEMONS:
+                path = os.path.join(configDir, '%s.conf' % (daemon))
+                if os.path.isfile(path):
+                    with open(path) as configFile:
+                        newConfig[daemon] = configFile.read()
+        if daemons is None:
+            daemons = [daemon for daemon in QUAGGA_DAEMONS
+                       if daemon in newConfig]
+
+        report = {'commands': {}, 'errors': []}
+        for daemon in daemons:
+            running = self.query(node, 'show running-config', daemon=daemon)
+            commands = diffConfig(running, newConfig[daemon])
+            report['commands'][daemon] = len(commands)
+            if not commands:
+                continue
+            commands = ['configure terminal'] + commands + ['end']
+            if save:
+                commands.append('write memory')
+            results = self.vtyPool.execute(node, daemon, commands)
+            report['errors'] += ['%s: %s: %s' % (daemon, command,
+                                                 output.strip())
+                                 for command, (status, output)
+                                 in zip(commands, results) if status != 0]
+        report['time'] = time.time() - started
+        return report
+
+    def reloadAll(self, configs, daemons=None, save=False, maxThreads=32):
+        """Reloads many nodes in parallel (see reload())
+           configs: dict of node to new config
+           returns: dict of node to reload() report (or exception)"""
+        def reloadNode(item):
+            "reload() a single node, returning errors as values"
+            node, newConfig = item
+            try:
+                return node, self.reload(node, newConfig, daemons, save)
+            except Exception as e:  # reported per node
+                return node, e
+
+        if not configs:
+            return {}
+        pool = ThreadPool(min(maxThreads, len(configs)))
+        try:
+            return dict(pool.map(reloadNode, list(configs.items())))
+        finally:
+            pool.close()
+            pool.join()
+
     def getDefaultGlobalParams(self):
         "Returns the default parameters for this service"
         defaults = {'startCmd': '/etc/init.d/quagga start',
                     'stopCmd': '/etc/init.d/quagga stop',
                     'autoStart': True,
                     'autoStop': True,
-                    'configPath': None}
+                    'configPath': None,
+                    'vtyDir': '/run/quagga',
+                    'vtyTimeout': 10.0,
+                    'fibInstall': True,
+                    'zebra': True,
+                    'directExec': False,
+                    'quaggaBinDir': '/usr/lib/quagga',
+                    'quaggaConfigBase': None,
+                    'quaggaConfigSize': None}
         return defaults
 
     def getDefaultGlobalMounts(self):
@@ -94,3 +1048,18 @@ class QuaggaService(Service):
         mountConfigPairs['quaggaConfigPath'] = quaggaConfigMount
 
         return mounts, mountConfigPairs
+
+    def getMountsForParams(self, params):
+        """Service mounts for a node's (merged) parameters. With
+           quaggaConfigBase set, /etc/quagga is an overlay of the node's
+           quaggaConfigPath (optional) over the shared base; permissions
+           are applied on the overlay, leaving both directories untouched"""
+        base = params.get('quaggaConfigBase')
+        if base is None or 'mounts' in params:
+            return Service.getMountsForParams(self, params)
+        _, mountConfigPairs = self.getDefaultGlobalMounts()
+        perms = mountConfigPairs['quaggaConfigPath'].source.perms
+        return [MountProperties(target='/etc/quagga',
+                                source=params.get('quaggaConfigPath'),
+                                mode='overlay', base=base, perms=perms,
+                                tmpfsSize=params.get('quaggaConfigSize'))]
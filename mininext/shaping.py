@@ -0,0 +1,150 @@
+"""
+Batched link shaping for MiniNExT.
+
+A LinkProfile describes the delay, jitter, rate and loss of a link; it is
+applied as a single netem qdisc on each end of the link. LinkShaper applies
+profiles to many interfaces at once with one 'tc -batch' per namespace
+(namespaces are handled concurrently) instead of a tc command per interface.
+"""
+
+import time
+from multiprocessing.pool import ThreadPool
+from subprocess import Popen, PIPE
+
+from mininet.log import debug
+
+
+def formatValue(value, unit):
+    "Returns a tc value: strings as given, numbers with a default unit"
+    if isinstance(value, basestring):
+        return value
+    return '%g%s' % (value, unit)
+
+
+class LinkProfile(object):
+
+    "Delay, jitter, rate and loss applied on each end of a link (netem)"
+
+    def __init__(self, delay=None, jitter=None, rate=None, loss=None,
+                 limit=None):
+        """delay: one-way delay (ms, or a tc time such as '10ms')
+           jitter: delay variation (ms, or a tc time), requires delay
+           rate: egress rate (Mbit/s, or a tc rate such as '1gbit')
+           loss: packet loss (percent)
+           limit: netem queue length (packets)"""
+        if jitter is not None and delay is None:
+            raise Exception("Link profile jitter requires a delay\n")
+        self.delay = delay
+        self.jitter = jitter
+        self.rate = rate
+        self.loss = loss
+        self.limit = limit
+
+    @classmethod
+    def make(cls, profile):
+        "Returns a LinkProfile from a LinkProfile or dict (None for None)"
+        if profile is None or isinstance(profile, LinkProfile):
+            return profile
+        if isinstance(profile, dict):
+            return cls(**profile)
+        raise Exception("Invalid link profile %r\n" % (profile,))
+
+    def netemArgs(self):
+        "Returns the arguments of the profile's netem qdisc"
+        args = []
+        if self.delay is not None:
+            args += ['delay', formatValue(self.delay, 'ms')]
+            if self.jitter is not None:
+                args.append(formatValue(self.jitter, 'ms'))
+        if self.loss is not None:
+            args += ['loss', formatValue(self.loss, '%')]
+        if self.rate is not None:
+            args += ['rate', formatValue(self.rate, 'mbit')]
+        if self.limit is not None:
+            args += ['limit', str(self.limit)]
+        return ' '.join(args)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__,
+                            self.netemArgs() or 'unshaped')
+
+
+class LinkShaper(object):
+
+    """Applies link profiles to interfaces, with a single 'tc -batch'
+       per namespace, running the namespaces concurrently"""
+
+    def __init__(self, maxThreads=32):
+        "maxThreads: maximum number of namespaces updated at once"
+        self.maxThreads = maxThreads
+        self.profiles = {}  # intf -> applied LinkProfile
+
+    def command(self, intf, profile):
+        "Returns the tc batch line setting (or removing) intf's profile"
+        if profile is None:
+            return 'qdisc del dev %s root\n' % (intf)
+        return 'qdisc replace dev %s root netem %s\n' % (intf,
+                                                         profile.netemArgs())
+
+    @staticmethod
+    def runBatch(node, batch):
+        """Run a tc batch in a node's namespace (the host's if None)
+           returns: (exit code, error output)"""
+        cmd = ['tc', '-force', '-batch', '-']
+        if node is None:
+            popen = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        else:
+            popen = node.popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        _, err = popen.communicate(batch)
+        return popen.wait(), err
+
+    def apply(self, settings):
+        """Set the profiles of many interfaces
+           settings: list of (intf, LinkProfile or None to remove shaping)
+           returns: {'interfaces', 'namespaces', 'time', 'errors'}, where
+                    errors maps a namespace (node name, '' for the host) to
+                    the error output of its batch; the profiles of a failed
+                    namespace are not recorded"""
+        started = time.time()
+        batches = {}  # node (None for the host) -> batch lines
+        changes = {}  # node -> [(intf, profile)]
+        for intf, profile in settings:
+            if profile is None and intf not in self.profiles:
+                continue
+            node = intf.node if getattr(intf.node, 'inNamespace',
+                                        False) else None
+            batches.setdefault(node, []).append(self.command(intf, profile))
+            changes.setdefault(node, []).append((intf, profile))
+
+        def run(item):
+            "Run a namespace's batch, returning errors as values"
+            node, lines = item
+            try:
+                ret, err = self.runBatch(node, ''.join(lines))
+            except (OSError, IOError) as e:
+                ret, err = -1, str(e)
+            debug('*** tc batch of %d commands in %s: %s\n'
+                  % (len(lines), node or 'host', ret))
+            return node, (err.strip() if ret != 0 else None)
+
+        results = []
+        if batches:
+            pool = ThreadPool(min(self.maxThreads, len(batches)))
+            try:
+                results = pool.map(run, list(batches.items()))
+            finally:
+                pool.close()
+                pool.join()
+        errors = {}
+        for node, err in results:
+            if err is not None:
+                errors[node.name if node is not None else ''] = err
+                continue
+            for intf, profile in changes[node]:
+                if profile is None:
+                    self.profiles.pop(intf, None)
+                else:
+                    self.profiles[intf] = profile
+        return {'interfaces': sum(len(lines) for lines in batches.values()),
+                'namespaces': len(batches),
+                'time': time.time() - started, 'errors': errors}
@@ -0,0 +1,356 @@
+"""
+Sharded (multi-process) orchestration for MiniNExT.
+
+With MiniNExT(shards=N), hosts are created and linked by the main
+(coordinator) process as usual, then N worker processes are forked, each
+owning a partition of the hosts. Workers configure their hosts (mounts,
+services, addresses, loopbacks), start and stop their services and run
+every shell command sent to them, so this work is spread over N cores
+instead of one Python process.
+
+The coordinator's host objects stay usable: cmd(), sendCmd() / monitor() /
+waitOutput() and service start / stop are forwarded to the owning worker by
+Node, while popen() and pexec() run directly from the coordinator (they only
+need the node's PID). As the worker reads the hosts' shells, the
+coordinator's copy of a host's stdout is replaced by a pipe that becomes
+readable when a forwarded command completes, which is what the CLI polls.
+A worker handles one request at a time; requests to different workers run
+concurrently.
+"""
+
+import multiprocessing
+import os
+import signal
+import threading
+
+from mininet.log import debug
+
+from mininext.link import LoopbackIntf
+from mininext.trace import continueTracing, stopTracing
+
+
+def partition(hosts, count):
+    "Returns count (round-robin) partitions of hosts"
+    return [hosts[index::count] for index in range(count)]
+
+
+def nodeState(host):
+    """Returns the state a worker changed while configuring a host
+       (addresses, loopbacks, mounts...) in a picklable form"""
+    loopbacks = []
+    for name, loNum in sorted(host.loIntfs.items()):
+        intf = host.nameToIntf.get(name)
+        if isinstance(intf, LoopbackIntf) and intf.ip is not None:
+            loopbacks.append((loNum, intf.ip, intf.prefixLen))
+    return {'intfs': dict((intf.name, (intf.ip, intf.prefixLen, intf.mac))
+                          for intf in host.intfList()),
+            'loopbacks': loopbacks,
+            'attrs': dict((attr, getattr(host, attr))
+                          for attr in ('privateMounts', 'sysctls',
+                                       'hasPrivateLogs', 'hasPrivateRun',
+                                       'overlayDirs'))}
+
+
+def applyNodeState(host, state):
+    "Update the coordinator's copy of a host with nodeState() from a worker"
+    for name, (ip, prefixLen, mac) in state['intfs'].items():
+        intf = host.nameToIntf.get(name)
+        if intf is not None:
+            intf.ip, intf.prefixLen, intf.mac = ip, prefixLen, mac
+    for loNum, ip, prefixLen in state['loopbacks']:
+        if 'lo:%d' % (loNum) not in host.loIntfs:
+            LoopbackIntf(node=host, loNum=loNum, configure=False,
+                         ip='%s/%d' % (ip, prefixLen))
+    for attr, value in state['attrs'].items():
+        setattr(host, attr, value)
+
+
+def serviceResults(returnCodes):
+    "Returns autoStart/StopServices() results keyed by service name"
+    if not returnCodes:
+        return None
+    return dict((str(service), returnCode)
+                for service, returnCode in returnCodes.items())
+
+
+# Worker #
+
+
+class ShardWorker(object):
+
+    "Owns a partition of the hosts; runs in a forked worker process"
+
+    def __init__(self, index, hosts, conn, inherited=()):
+        """index: shard number
+           hosts: hosts owned by the worker
+           conn: worker end of the coordinator's pipe
+           inherited: coordinator pipes the fork copies into the worker
+                      (connections, files and descriptors), closed so the
+                      worker sees EOF when the coordinator exits"""
+        self.index = index
+        self.hosts = hosts
+        self.byName = dict((host.name, host) for host in hosts)
+        self.conn = conn
+        self.inherited = inherited
+        self.shells = {}  # host name -> shell started by the coordinator
+        self.ops = {'configure': self.configure,
+                    'services': self.services,
+                    'cmd': self.cmd,
+                    'call': self.call,
+                    'serviceCall': self.serviceCall}
+
+    def run(self):
+        "Serve requests until the coordinator closes the shard"
+        # the CLI's ^C is meant for the coordinator
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for pipe in self.inherited:
+            if isinstance(pipe, int):
+                os.close(pipe)
+            else:
+                pipe.close()
+        self.inherited = ()
+        continueTracing('.shard%d' % (self.index))
+        self.shells = dict((host.name, host.shell) for host in self.hosts)
+        while True:
+            try:
+                request = self.conn.recv()
+            except EOFError:
+                break
+            if request is None:
+                break
+            op, args = request
+            try:
+                response = ('ok', self.ops[op](*args))
+            except Exception as e:  # returned to the coordinator
+                response = ('error', '%s: %s' % (e.__class__.__name__,
+                                                 str(e).strip()))
+            self.conn.send(response)
+        self.shutdown()
+
+    def shutdown(self):
+        "Kill shells started by this worker (e.g. of shell-less nodes)"
+        for host in self.hosts:
+            shell = host.shell
+            if shell is not None and shell is not self.shells.get(host.name):
+                shell.kill()
+                shell.wait()
+        stopTracing()
+
+    # Operations #
+
+    def configure(self):
+        "Configure the worker's hosts (see Mininet.configHosts())"
+        for host in self.hosts:
+            if host.defaultIntf():
+                host.configDefault()
+            else:
+                host.configDefault(ip=None, mac=None)
+        return dict((host.name, nodeState(host)) for host in self.hosts)
+
+    def services(self, method, names=None):
+        """Run autoStartServices() or autoStopServices() on hosts
+           names: host names (default: all of the worker's hosts)
+           returns: {host name: results keyed by service name}"""
+        hosts = self.hosts if names is None else \
+            [self.byName[name] for name in names]
+        return dict((host.name, serviceResults(getattr(host, method)()))
+                    for host in hosts)
+
+    def cmd(self, name, args, kwargs):
+        "Run a command in a host's shell"
+        return self.byName[name].cmd(*args, **kwargs)
+
+    def call(self, name, method, args, kwargs):
+        "Call a method of a host (the result must be picklable)"
+        return getattr(self.byName[name], method)(*args, **kwargs)
+
+    def serviceCall(self, name, serviceName, method, args, kwargs):
+        "Call a method of one of a host's services with the host"
+        host = self.byName[name]
+        for service in host.services:
+            if service.name == serviceName:
+                return getattr(service, method)(host, *args, **kwargs)
+        raise Exception("Node %s has no service %s" % (name, serviceName))
+
+
+# Coordinator #
+
+
+class ShardClient(object):
+
+    "Coordinator side of a shard: forwards requests to its worker"
+
+    def __init__(self, index, process, conn):
+        """index: shard number
+           process: worker process
+           conn: coordinator end of the worker's pipe"""
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.pending = {}  # host name -> (thread, result) of sendCmd()
+        self.signals = {}  # host name -> write end of the host's stdout
+        self.nodes = []  # attached nodes
+
+    def send(self, op, *args):
+        "Send a request (the caller holds self.lock)"
+        try:
+            self.conn.send((op, args))
+        except (IOError, OSError, EOFError):
+            raise Exception("Shard %d is not running\n" % (self.index))
+
+    def receive(self):
+        "Returns the result of the last request (the caller holds self.lock)"
+        try:
+            status, result = self.conn.recv()
+        except (IOError, OSError, EOFError):
+            raise Exception("Shard %d is not running\n" % (self.index))
+        if status == 'error':
+            raise Exception("Shard %d: %s\n" % (self.index, result))
+        return result
+
+    def call(self, op, *args):
+        "Run an operation in the worker, returns its result"
+        with self.lock:
+            self.send(op, *args)
+            return self.receive()
+
+    def close(self, timeout=10.0):
+        "Stop the worker"
+        with self.lock:
+            try:
+                self.conn.send(None)
+            except (IOError, OSError):
+                pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+        for writeFd in self.signals.values():
+            os.close(writeFd)
+        self.signals = {}
+        # give the nodes their shell's output back
+        for node in self.nodes:
+            node.stdout.close()
+            node.stdout = node.shell.stdout if node.shell else None
+            node.shard = None
+        self.nodes = []
+
+    def pipes(self):
+        "Returns the coordinator's ends of the shard's pipes"
+        return [self.conn] + list(self.signals.values()) + \
+            [node.stdout for node in self.nodes]
+
+    def attach(self, node):
+        """Forward the node's commands to the worker; the node's stdout
+           becomes a pipe signalled when a forwarded command completes"""
+        readFd, writeFd = os.pipe()
+        node.stdout = os.fdopen(readFd, 'rb', 0)
+        self.signals[node.name] = writeFd
+        self.nodes.append(node)
+        node.shard = self
+
+    # Node forwarding (see Node) #
+
+    def cmd(self, node, *args, **kwargs):
+        "Node.cmd() in the worker"
+        return self.call('cmd', node.name, args, kwargs)
+
+    def sendCmd(self, node, *args, **kwargs):
+        "Node.sendCmd(): run cmd() in the background, see monitor()"
+        result = {}
+
+        def run():
+            "Run the command, keeping errors as output"
+            try:
+                result['output'] = self.cmd(node, *args, **kwargs)
+            except Exception as e:  # shown like command output
+                result['output'] = '*** %s\n' % (str(e).strip())
+            os.write(self.signals[node.name], b'.')
+        thread = threading.Thread(target=run, name='mininext-shard-cmd')
+        thread.daemon = True
+        self.pending[node.name] = (thread, result)
+        node.waiting = True
+        thread.start()
+
+    def monitor(self, node, timeoutms=None):
+        "Node.monitor(): returns the command's output once it is done"
+        thread, result = self.pending.get(node.name, (None, None))
+        if thread is None:
+            node.waiting = False
+            return ''
+        thread.join(None if timeoutms is None else timeoutms / 1000.0)
+        if thread.is_alive():
+            return ''
+        del self.pending[node.name]
+        os.read(node.stdout.fileno(), 1)  # the completion signal
+        node.waiting = False
+        return result['output']
+
+    def waitOutput(self, node):
+        "Node.waitOutput()"
+        output = ''
+        while node.waiting:
+            output += self.monitor(node)
+        return output
+
+    def __repr__(self):
+        return '<%s %d pid=%s>' % (self.__class__.__name__, self.index,
+                                   self.process.pid)
+
+
+def startShards(hosts, count):
+    """Fork count workers owning (round-robin) partitions of hosts and
+       point the hosts at them
+       returns: [ShardClient]"""
+    # workers must be forked: they inherit the hosts' shells
+    context = multiprocessing.get_context('fork') \
+        if hasattr(multiprocessing, 'get_context') else multiprocessing
+    clients = []
+    for index, part in enumerate(partition(list(hosts), count)):
+        parentConn, childConn = context.Pipe()
+        inherited = [parentConn]
+        for client in clients:
+            inherited += client.pipes()
+        worker = ShardWorker(index, part, childConn, inherited)
+        process = context.Process(target=worker.run,
+                                  name='mininext-shard-%d' % (index))
+        process.daemon = True
+        process.start()
+        childConn.close()
+        client = ShardClient(index, process, parentConn)
+        for host in part:
+            client.attach(host)
+        debug('*** shard %d (pid %d): %s\n'
+              % (index, process.pid, ' '.join(str(host) for host in part)))
+        clients.append(client)
+    return clients
+
+
+def callShards(clients, op, *args):
+    """Run an operation in every worker concurrently
+       returns: merged dict results"""
+    for client in clients:
+        client.lock.acquire()
+    try:
+        for client in clients:
+            client.send(op, *args)
+        results, errors = {}, []
+        for client in clients:
+            try:
+                results.update(client.receive())
+            except Exception as e:  # collect them all
+                errors.append(str(e).strip())
+    finally:
+        for client in clients:
+            client.lock.release()
+    if errors:
+        raise Exception('\n'.join(errors) + '\n')
+    return results
+
+
+def stopShards(clients):
+    "Stop the workers"
+    for client in clients:
+        client.close()
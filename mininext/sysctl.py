@@ -0,0 +1,92 @@
+"""
+Named sysctl profiles for MiniNExT nodes.
+
+Profiles only contain network (net.*) settings that the kernel keeps per
+network namespace; they are written into the node's /proc/sys in one pass.
+Not every net.* setting is per namespace (e.g. net.core.rmem_max / wmem_max
+and the neighbour gc_thresh limits are host-wide, and net.ipv4.tcp_rmem /
+tcp_wmem are only per namespace since Linux 4.15): such settings must be
+raised on the host.
+"""
+
+import os
+import re
+
+# Neighbour entries for a large shared peering LAN (the gc_thresh limits
+# are only exposed in the host's namespace and must be raised there)
+NEIGH_LARGE = {'net.ipv4.neigh.default.gc_stale_time': 240,
+               'net.ipv4.neigh.default.unres_qlen': 1024,
+               'net.ipv6.neigh.default.gc_stale_time': 240,
+               'net.ipv6.neigh.default.unres_qlen': 1024}
+
+PROFILES = {
+    # forward packets between interfaces
+    'router': {'net.ipv4.ip_forward': 1,
+               'net.ipv6.conf.all.forwarding': 1},
+    # full-table BGP speakers: large routing tables, many sessions (socket
+    # buffers are host settings: net.core.rmem_max / wmem_max always, and
+    # net.ipv4.tcp_rmem / tcp_wmem before Linux 4.15; on later kernels they
+    # can be given per node through sysctls)
+    'bgp-large': {'net.ipv4.ip_forward': 1,
+                  'net.ipv6.conf.all.forwarding': 1,
+                  'net.ipv6.route.max_size': 4194304,
+                  'net.core.somaxconn': 4096},
+    # members and route servers attached to a shared IXP fabric
+    'ixp': dict(NEIGH_LARGE, **{'net.ipv4.ip_forward': 1,
+                                'net.ipv6.conf.all.forwarding': 1,
+                                'net.ipv4.conf.all.rp_filter': 0,
+                                'net.ipv4.conf.default.rp_filter': 0})}
+
+KEY_PATTERN = re.compile(r'^net(\.[A-Za-z0-9_\-]+)+$')
+VALUE_PATTERN = re.compile(r'^-?\d+(\s+-?\d+)*$')
+
+
+def resolveSysctls(profiles=None, sysctls=None):
+    """Returns the settings for a list of profiles plus explicit overrides
+       profiles: profile name or list of names (later names take priority)
+       sysctls: dict of additional settings (take priority over profiles)"""
+    settings = {}
+    if isinstance(profiles, basestring):
+        profiles = [profiles]
+    for profile in profiles or []:
+        if profile not in PROFILES:
+            raise Exception("Unknown sysctl profile %s (expected one of %s)"
+                            % (profile, ', '.join(sorted(PROFILES))))
+        settings.update(PROFILES[profile])
+    if sysctls is not None:
+        settings.update(sysctls)
+    return settings
+
+
+def validateSysctls(settings):
+    "Raises exception listing every invalid key / value in settings"
+    problems = []
+    for key, value in sorted(settings.items()):
+        if not KEY_PATTERN.match(key):
+            problems.append("%s: not a network namespace sysctl" % (key))
+        elif not VALUE_PATTERN.match(str(value).strip()):
+            problems.append("%s: invalid value %r" % (key, value))
+    if problems:
+        raise Exception("Invalid sysctl settings:\n  %s\n"
+                        % ('\n  '.join(problems)))
+
+
+def sysctlPath(key):
+    "Returns the /proc/sys path of a sysctl key"
+    return os.path.join('/proc/sys', *key.split('.'))
+
+
+def writeSysctls(settings):
+    """Writes settings into /proc/sys of the calling thread's namespace
+       returns: ({key: value read back}, {key: error})"""
+    applied, errors = {}, {}
+    for key, value in sorted(settings.items()):
+        path = sysctlPath(key)
+        try:
+            with open(path, 'w') as sysctlFile:
+                sysctlFile.write('%s\n' % (value,))
+            with open(path) as sysctlFile:
+                applied[key] = sysctlFile.read().strip()
+        except IOError as e:
+            errors[key] = e.strerror if e.strerror else str(e)
+    return applied, errors
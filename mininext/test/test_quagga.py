@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+"""Tests for the Quagga service's hot reload (configuration diffing)"""
+
+import unittest
+
+from mininext.services.quagga import diffConfig
+
+RUNNING_BGPD = """\
+!
+! Zebra configuration saved from vty
+!
+hostname r1
+password zebra
+log file /var/log/quagga/bgpd.log
+!
+router bgp 100
+ bgp router-id 10.0.0.1
+ neighbor 10.0.0.2 remote-as 200
+ neighbor 10.0.0.2 description upstream
+ neighbor 10.0.0.2 update-source lo
+ neighbor 10.0.0.2 route-map IMPORT in
+ neighbor 10.0.0.3 remote-as 300
+ neighbor 10.0.0.3 description old peer
+ neighbor 10.0.0.3 next-hop-self
+ network 10.1.0.0/16
+!
+ address-family ipv6
+ neighbor 10.0.0.2 activate
+ neighbor 10.0.0.3 activate
+ exit-address-family
+!
+access-list 10 permit 10.1.0.0 0.0.255.255
+access-list 10 deny any
+!
+ip prefix-list IMPORT seq 5 permit 10.2.0.0/16
+ip prefix-list IMPORT seq 10 deny any
+ip prefix-list NUMBERED seq 5 permit 10.3.0.0/16
+!
+route-map IMPORT permit 10
+ match ip address prefix-list IMPORT
+ set local-preference 100
+!
+line vty
+!
+end
+"""
+
+DESIRED_BGPD = """\
+hostname r1-new
+password zebra
+log file /var/log/quagga/bgpd.log
+!
+router bgp 100
+ bgp router-id 10.0.0.11
+ neighbor 10.0.0.2 remote-as 201
+ neighbor 10.0.0.2 description upstream
+ neighbor 10.0.0.2 update-source lo
+ neighbor 10.0.0.2 route-map IMPORT in
+ network 10.1.0.0/16
+!
+ address-family ipv6
+ neighbor 10.0.0.2 activate
+ exit-address-family
+!
+access-list 10 permit 10.1.0.0 0.0.255.255
+access-list 10 permit 10.4.0.0 0.0.255.255
+access-list 10 deny any
+!
+ip prefix-list IMPORT permit 10.2.0.0/16
+ip prefix-list IMPORT deny any
+ip prefix-list NUMBERED seq 5 permit 10.5.0.0/16
+!
+route-map IMPORT permit 10
+ match ip address prefix-list IMPORT
+ set local-preference 200
+!
+"""
+
+RUNNING_ZEBRA = """\
+hostname r1
+!
+interface eth0
+ ip address 10.0.0.1/24
+ ipv6 nd suppress-ra
+!
+interface eth1
+ ipv6 nd suppress-ra
+!
+interface lo
+!
+ip forwarding
+!
+line vty
+!
+"""
+
+DESIRED_ZEBRA = """\
+hostname r1
+!
+interface eth0
+ ip address 10.0.0.1/24
+ ip address 10.0.1.1/24
+ ipv6 nd suppress-ra
+!
+ip forwarding
+!
+"""
+
+
+class testDiffConfig(unittest.TestCase):
+
+    "Test the commands sent by QuaggaService.reload()"
+
+    def testUnchanged(self):
+        "A running config needs no commands to reach itself"
+        self.assertEqual(diffConfig(RUNNING_BGPD, RUNNING_BGPD), [])
+        self.assertEqual(diffConfig(RUNNING_ZEBRA, RUNNING_ZEBRA), [])
+
+    def testSingleValues(self):
+        "Single-value commands are replaced, never removed"
+        commands = diffConfig(RUNNING_BGPD, DESIRED_BGPD)
+        for command in ('hostname r1-new', 'bgp router-id 10.0.0.11',
+                        'neighbor 10.0.0.2 remote-as 201',
+                        'set local-preference 200',
+                        'ip prefix-list NUMBERED seq 5 permit 10.5.0.0/16'):
+            self.assertTrue(command in commands, command)
+        removals = ('no hostname', 'no bgp router-id', 'no neighbor 10.0.0.2',
+                    'no set local-preference', 'no ip prefix-list NUMBERED')
+        for command in commands:
+            self.assertFalse(command.startswith(removals), command)
+
+    def testPeerReset(self):
+        "A peer whose AS changes gets its other commands again, in order"
+        commands = diffConfig(RUNNING_BGPD, DESIRED_BGPD)
+        block = commands[commands.index('router bgp 100'):]
+        block = block[:block.index('exit') + 1]
+        remoteAS = block.index('neighbor 10.0.0.2 remote-as 201')
+        for command in ('neighbor 10.0.0.2 description upstream',
+                        'neighbor 10.0.0.2 update-source lo',
+                        'neighbor 10.0.0.2 route-map IMPORT in'):
+            self.assertTrue(block.index(command) > remoteAS, command)
+        family = commands[commands.index('address-family ipv6'):]
+        self.assertTrue('neighbor 10.0.0.2 activate' in
+                        family[:family.index('exit-address-family')])
+
+    def testPeerRemoved(self):
+        "A removed peer is deleted by a single command"
+        commands = diffConfig(RUNNING_BGPD, DESIRED_BGPD)
+        removed = [command for command in commands
+                   if command.startswith('no neighbor 10.0.0.3')]
+        self.assertEqual(removed, ['no neighbor 10.0.0.3 remote-as 300'])
+
+    def testOrderedLists(self):
+        "Changed access-lists and prefix-lists are rewritten as a whole"
+        commands = diffConfig(RUNNING_BGPD, DESIRED_BGPD)
+        start = commands.index('no access-list 10')
+        self.assertEqual(commands[start:start + 4],
+                         ['no access-list 10',
+                          'access-list 10 permit 10.1.0.0 0.0.255.255',
+                          'access-list 10 permit 10.4.0.0 0.0.255.255',
+                          'access-list 10 deny any'])
+        # the running config numbers entries that were given unnumbered
+        self.assertFalse([command for command in commands
+                          if command.startswith('ip prefix-list IMPORT')])
+
+    def testInterfaces(self):
+        "Interfaces missing from the desired config are left alone"
+        commands = diffConfig(RUNNING_ZEBRA, DESIRED_ZEBRA)
+        self.assertEqual(commands, ['interface eth0', 'ip address 10.0.1.1/24',
+                                    'exit'])
+
+
+if __name__ == '__main__':
+    unittest.main()
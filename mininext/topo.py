@@ -3,17 +3,33 @@ Extended "topo" module for MiniNExT.
 """
 
 from mininet.topo import Topo as BaseTopo
+from mininext.fabric import FABRICS, FabricBridge
 from mininext.node import Host
+from mininext.shaping import LinkProfile
 
 
 class Topo(BaseTopo):
 
     "Extended topology object to support MiniNExT customizations"
 
-    def __init__(self, nopts=None, **opts):
+    def __init__(self, nopts=None, sysctlProfile=None, sysctls=None,
+                 fabric='ovs', **opts):
         """Extended Topo object:
-           nopts: default NAT options"""
+           nopts: default NAT options
+           sysctlProfile: sysctl profile(s) applied to every host
+           sysctls: sysctl settings applied to every host
+           fabric: default type of segments added with addFabric()"""
         self.nopts = {} if nopts is None else nopts
+        self.sysctlProfile = sysctlProfile
+        self.sysctls = sysctls
+        if fabric not in FABRICS:
+            raise Exception("Unknown fabric %s (expected one of %s)"
+                            % (fabric, ', '.join(FABRICS)))
+        self.fabric = fabric
+        self.fabrics = {}  # fabric name -> fabric type
+        self.directMembers = {}  # direct fabric name -> [(node, opts)]
+        self.linkProfiles = {}  # profile name -> LinkProfile
+        self.shaping = {}  # (node, peer) -> LinkProfile of node's end
         BaseTopo.__init__(self, **opts)
 
     # Override addHost so that constructor defaults to MiniNExT host
@@ -24,9 +40,114 @@ class Topo(BaseTopo):
            opts: host options
            returns: host name"""
         if not opts and self.hopts:
-            opts = self.hopts
+            opts = dict(self.hopts)
+        # topology-wide sysctls, a host's own settings take priority
+        if self.sysctlProfile is not None:
+            opts.setdefault('sysctlProfile', self.sysctlProfile)
+        if self.sysctls is not None:
+            sysctls = dict(self.sysctls)
+            sysctls.update(opts.get('sysctls') or {})
+            opts['sysctls'] = sysctls
         return BaseTopo.addNode(self, name, cls=cls, **opts)
 
+    # Shared segments (fabrics) #
+
+    def addFabric(self, name, fabric=None, **opts):
+        """Adds a shared L2 segment (e.g. an IXP peering LAN); nodes join
+           it with addLink(node, name)
+           name: fabric name
+           fabric: 'ovs' (default switch class, needs a controller),
+                   'bridge' (kernel bridge, no controller) or 'direct' (the
+                   two members are linked directly, no switch); defaults
+                   to the topology's fabric
+           opts: switch options
+           returns: fabric name"""
+        fabric = fabric if fabric is not None else self.fabric
+        if fabric not in FABRICS:
+            raise Exception("Unknown fabric %s (expected one of %s)"
+                            % (fabric, ', '.join(FABRICS)))
+        self.fabrics[name] = fabric
+        if fabric == 'ovs':
+            return self.addSwitch(name, **opts)
+        if fabric == 'bridge':
+            return self.addSwitch(name, cls=FabricBridge, **opts)
+        self.directMembers[name] = []
+        return name
+
+    def addLink(self, node1, node2, port1=None, port2=None, profile=None,
+                **opts):
+        """Adds a link; links to a direct fabric are recorded, and its two
+           members are linked to each other once both have joined
+           node1, node2: nodes to link together
+           port1, port2: ports (optional)
+           profile: link profile (name from addLinkProfile(), LinkProfile
+                    or dict of its parameters) applied on both ends; on a
+                    direct fabric, only the member's end is shaped
+           opts: link options"""
+        if profile is not None:
+            profile = self.getLinkProfile(profile)
+        for fabric, member in ((node1, node2), (node2, node1)):
+            if self.fabrics.get(fabric) == 'direct':
+                if profile is not None:
+                    self.shaping[(member, fabric)] = profile
+                return self.addDirectMember(fabric, member, opts)
+        if profile is not None:
+            self.shaping[(node1, node2)] = profile
+            self.shaping[(node2, node1)] = profile
+        return BaseTopo.addLink(self, node1, node2, port1, port2, **opts)
+
+    # Link profiles (see mininext.shaping) #
+
+    def addLinkProfile(self, name, **params):
+        """Adds a named link profile to use with addLink(profile=name)
+           name: profile name
+           params: LinkProfile parameters (delay, jitter, rate, loss, limit)
+           returns: profile name"""
+        self.linkProfiles[name] = LinkProfile(**params)
+        return name
+
+    def getLinkProfile(self, profile):
+        "Returns the LinkProfile for a profile name, LinkProfile or dict"
+        if isinstance(profile, basestring):
+            if profile not in self.linkProfiles:
+                raise Exception("Unknown link profile %s\n" % (profile))
+            return self.linkProfiles[profile]
+        return LinkProfile.make(profile)
+
+    def getShaping(self):
+        """Returns {(node, peer): LinkProfile} for the end of each shaped
+           link on node, with direct fabrics replaced by their other member"""
+        shaping = {}
+        for (node, peer), profile in self.shaping.items():
+            if peer in self.directMembers:
+                others = [member for member, _ in self.directMembers[peer]
+                          if member != node]
+                if not others:
+                    continue
+                peer = others[0]
+            shaping[(node, peer)] = profile
+        return shaping
+
+    def addDirectMember(self, fabric, node, opts):
+        "Adds a node to a direct fabric, linking it to the other member"
+        members = self.directMembers[fabric]
+        if len(members) == 2:
+            raise Exception("Direct fabric %s already links %s and %s, "
+                            "use a bridge fabric for more members\n"
+                            % (fabric, members[0][0], members[1][0]))
+        members.append((node, opts))
+        if len(members) < 2:
+            return None
+        (first, firstOpts), (second, secondOpts) = members
+        linkOpts = dict(firstOpts)
+        linkOpts.update(secondOpts)
+        return BaseTopo.addLink(self, first, second, **linkOpts)
+
+    def needsController(self):
+        "Returns if any switch in the topology needs a controller"
+        return any(self.fabrics.get(switch) != 'bridge'
+                   for switch in self.switches())
+
     # Configure a loopback interface
     def addNodeLoopbackIntf(self, node, ip, loNum=None, **opts):
         """Adds a loopback interface to a specified host.
@@ -0,0 +1,305 @@
+"""
+Structured tracing of the commands MiniNExT runs inside nodes.
+
+When tracing is enabled (see startTracing() or MiniNExT(trace=path)), each
+command run through Node.popen(), pexec() or cmd() is written to a trace file
+as one JSON object per line:
+
+    {"kind": "popen", "node": "a1", "ns": ["net", "mnt"],
+     "argv": ["mount", "-n", "-B", ...], "start": 1234.5, "end": 1234.6,
+     "exit": 0, "bytes": 0}
+
+start and end are monotonic timestamps (seconds). Shell commands (kind
+"cmd") are recorded as given and have no exit code; popen() commands are
+recorded when they are waited for, with the size of their output if it
+was read with communicate(). Records are buffered in memory and written by a
+background thread, so tracing adds little to the commands themselves.
+
+The trace can be summarized with python -m mininext.trace <file>.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import threading
+import time
+from subprocess import Popen
+
+from mininet.log import warn
+
+# Monotonic clock #
+
+CLOCK_MONOTONIC = 1
+
+
+class _Timespec(ctypes.Structure):
+
+    "struct timespec for clock_gettime()"
+
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+
+def clockMonotonic():
+    "Returns the time (seconds) of the monotonic clock"
+    timespec = _Timespec()
+    if _libc.clock_gettime(CLOCK_MONOTONIC, ctypes.byref(timespec)) != 0:
+        return time.time()
+    return timespec.tv_sec + timespec.tv_nsec * 1e-9
+
+
+# time.monotonic() is only available from Python 3.3
+monotonic = getattr(time, 'monotonic', clockMonotonic)
+
+
+# Tracing #
+
+
+class CommandTracer(object):
+
+    """Buffers command records and writes them to a file as JSON lines from
+       a background thread"""
+
+    def __init__(self, path, flushInterval=0.5, batchSize=1000,
+                 maxBuffered=100000):
+        """path: trace file (appended to)
+           flushInterval: seconds between writes of buffered records
+           batchSize: write early once this many records are buffered
+           maxBuffered: drop records beyond this many unwritten ones"""
+        self.path = path
+        self.flushInterval = flushInterval
+        self.batchSize = batchSize
+        self.maxBuffered = maxBuffered
+        self.buffer = []
+        self.dropped = 0
+        self.written = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.traceFile = open(path, 'a')
+        self.thread = threading.Thread(target=self.run,
+                                       name='mininext-trace')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def record(self, node, kind, argv, start, end, exitCode, outputBytes):
+        """Record an executed command
+           node: node the command ran in
+           kind: 'popen' or 'cmd'
+           argv: command (list of arguments)
+           start, end: monotonic timestamps
+           exitCode: exit code (None if unknown)
+           outputBytes: size of the output (None if not read)"""
+        entry = {'kind': kind, 'node': node.name,
+                 'ns': node.namespaceFlags(), 'argv': argv,
+                 'start': start, 'end': end,
+                 'exit': exitCode, 'bytes': outputBytes}
+        with self.lock:
+            if self.closed or len(self.buffer) >= self.maxBuffered:
+                self.dropped += 1
+                return
+            self.buffer.append(entry)
+            full = len(self.buffer) >= self.batchSize
+        if full:
+            self.wakeup.set()
+
+    def flush(self):
+        "Write the buffered records"
+        with self.lock:
+            entries, self.buffer = self.buffer, []
+        if not entries:
+            return
+        # encoding happens here, off the traced code paths
+        self.traceFile.write(''.join(json.dumps(entry) + '\n'
+                                     for entry in entries))
+        self.traceFile.flush()
+        self.written += len(entries)
+
+    def run(self):
+        "Write buffered records periodically (runs in the background)"
+        while not self.closed:
+            self.wakeup.wait(self.flushInterval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except (IOError, OSError, ValueError) as e:
+                warn('*** Unable to write command trace: %s\n' % e)
+                return
+
+    def close(self):
+        "Write the remaining records and close the trace file"
+        if self.closed:
+            return
+        with self.lock:
+            self.closed = True
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
+        self.traceFile.close()
+        if self.dropped:
+            warn('*** Command trace dropped %d records\n' % (self.dropped))
+
+
+class TracedPopen(Popen):
+
+    "Popen that records the command with a tracer once it is waited for"
+
+    def __init__(self, args, tracer=None, node=None, argv=None, **kwargs):
+        """args, kwargs: Popen() arguments
+           tracer: CommandTracer
+           node: node the command runs in
+           argv: command as seen by the node (without mxexec)"""
+        self.tracer = tracer
+        self.traceNode = node
+        self.traceArgv = argv
+        self.traced = False
+        self.communicating = False
+        self.traceStart = monotonic()
+        Popen.__init__(self, args, **kwargs)
+
+    def communicate(self, *args, **kwargs):
+        "Popen.communicate(), recording the size of the output"
+        self.communicating = True
+        try:
+            out, err = Popen.communicate(self, *args, **kwargs)
+        finally:
+            self.communicating = False
+        self.traceExit(len(out or '') + len(err or ''))
+        return out, err
+
+    def wait(self, *args, **kwargs):
+        "Popen.wait(), recording the command"
+        exitCode = Popen.wait(self, *args, **kwargs)
+        if not self.communicating:
+            self.traceExit(None)
+        return exitCode
+
+    def traceExit(self, outputBytes):
+        "Record the command (once, after it exited)"
+        if self.traced or self.returncode is None:
+            return
+        self.traced = True
+        self.tracer.record(self.traceNode, 'popen', self.traceArgv,
+                           self.traceStart, monotonic(), self.returncode,
+                           outputBytes)
+
+
+_tracer = None
+
+
+def getTracer():
+    "Returns the active CommandTracer, or None if tracing is disabled"
+    return _tracer
+
+
+def startTracing(path, **params):
+    """Trace the commands run in nodes to path
+       params: CommandTracer parameters
+       returns: CommandTracer"""
+    global _tracer
+    stopTracing()
+    _tracer = CommandTracer(path, **params)
+    return _tracer
+
+
+def continueTracing(suffix):
+    """Continue tracing in a forked child process: the child writes its own
+       records to the trace path plus suffix (records still buffered by the
+       parent are left to the parent)
+       returns: the child's CommandTracer, None if tracing is disabled"""
+    global _tracer
+    tracer = _tracer
+    if tracer is None:
+        return None
+    _tracer = CommandTracer(tracer.path + suffix,
+                            flushInterval=tracer.flushInterval,
+                            batchSize=tracer.batchSize,
+                            maxBuffered=tracer.maxBuffered)
+    return _tracer
+
+
+def stopTracing():
+    "Stop tracing, writing out the buffered records"
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.close()
+
+
+# Summaries #
+
+
+def loadTrace(path):
+    "Returns the records of a trace file (skipping truncated lines)"
+    records = []
+    with open(path) as traceFile:
+        for line in traceFile:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def summarizeTrace(records, top=10):
+    """Summarize trace records
+       records: records (see loadTrace())
+       top: number of slowest commands to list
+       returns: dict with the number of commands, their total time, the
+                slowest commands and per node counts, times and failures"""
+    perNode = {}
+    for record in records:
+        duration = record['end'] - record['start']
+        stats = perNode.setdefault(record['node'], {'commands': 0,
+                                                    'time': 0.0,
+                                                    'failed': 0})
+        stats['commands'] += 1
+        stats['time'] += duration
+        if record['exit'] not in (None, 0):
+            stats['failed'] += 1
+    slowest = sorted(records, key=lambda record: record['start'] -
+                     record['end'])[:top]
+    return {'commands': len(records),
+            'time': sum(stats['time'] for stats in perNode.values()),
+            'slowest': [(record['end'] - record['start'], record['node'],
+                         record['kind'], record['argv'])
+                        for record in slowest],
+            'perNode': perNode}
+
+
+def formatSummary(summary):
+    "Returns a trace summary (see summarizeTrace()) as text"
+    lines = ['%d commands, %.3f s in total'
+             % (summary['commands'], summary['time']),
+             '', 'Slowest commands:']
+    for duration, node, kind, argv in summary['slowest']:
+        lines.append('  %9.3f s  %-12s %-5s %s'
+                     % (duration, node, kind, ' '.join(argv)))
+    lines += ['', 'Commands per node:']
+    for node, stats in sorted(summary['perNode'].items(),
+                              key=lambda item: -item[1]['time']):
+        lines.append('  %-12s %6d commands %9.3f s %4d failed'
+                     % (node, stats['commands'], stats['time'],
+                        stats['failed']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    "Print a summary of a trace file"
+    parser = argparse.ArgumentParser(
+        description='Summarize a MiniNExT command trace')
+    parser.add_argument('trace', help='trace file')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of slowest commands to show')
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.trace):
+        parser.error('no such trace file: %s' % (args.trace))
+    print(formatSummary(summarizeTrace(loadTrace(args.trace), args.top)))
+
+
+if __name__ == '__main__':
+    main()
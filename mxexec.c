@@ -13,6 +13,9 @@
 
 #define _GNU_SOURCE
 #include <stdio.h>
+#include <errno.h>
+#include <signal.h>
+#include <string.h>
 #include <linux/sched.h>
 #include <unistd.h>
 #include <limits.h>
@@ -40,16 +43,18 @@
 void usage(char *name) {
     printf(
             "Execution utility for MiniNExT (MiniNet ExTended)\n\n"
-            "Usage: %s [-cdnmiufp] [-a pid] [-b pid] [-k pid] [-j pid] [-g group] [-r rtprio] cmd args...\n\n"
+            "Usage: %s [-cdnmSiufpt] [-a pid] [-b pid] [-k pid] [-j pid] [-g group] [-r rtprio] cmd args...\n\n"
             "Options:\n"
             "  -c: close all file descriptors except stdin/out/error\n"
             "  -d: detach from tty by calling setsid()\n"
             "  -n: run in new network namespace\n"
-            "  -m: run in new mount namespace\n"
+            "  -m: run in new mount namespace (with private propagation)\n"
+            "  -S: use slave rather than private propagation for -m\n"
             "  -i: run in new PID namespace\n"
             "  -u: run in new UTS namespace\n"
             "  -f: mount procfs (requires new PID namespace)\n"
             "  -p: print ^A + pid\n"
+            "  -t: run a minimal init as PID 1 (requires new PID namespace)\n"
             "  -a: pid: attach to pid's network namespace\n"
             "  -b: pid: attach to pid's mount namespace\n"
             "  -k: pid: attach to pid's PID namespace\n"
@@ -63,11 +68,11 @@ int setns(int fd, int nstype) {
     return syscall(__NR_setns, fd, nstype);
 }
 
-/* Validate alphanumeric path foo1/bar2/baz */
+/* Validate alphanumeric path foo1/bar2/baz (node names may use - and _) */
 void validate(char *path) {
     char *s;
     for (s = path; *s; s++) {
-        if (!isalnum(*s) && *s != '/') {
+        if (!isalnum(*s) && *s != '/' && *s != '-' && *s != '_') {
             fprintf(stderr, "invalid path: %s\n", path);
             exit(1);
         }
@@ -113,6 +118,66 @@ int attachToNS(char *path) {
     return 0;
 }
 
+/* Child process of the minimal init */
+static pid_t initChild = 0;
+
+/* Forward a signal received by the minimal init to its child */
+void forwardSignal(int sig) {
+    if (initChild > 0)
+        kill(initChild, sig);
+}
+
+/* Minimal init for new PID namespaces: runs cmd as a child, forwards
+ * signals to it, and reaps orphaned processes until cmd exits */
+int runInit(char **cmd, int detach) {
+    static int forwarded[] = { SIGHUP, SIGINT, SIGQUIT, SIGTERM, SIGUSR1,
+            SIGUSR2, SIGCONT, SIGWINCH, 0 };
+    struct sigaction sa;
+    int status;
+    int *sig;
+    pid_t pid;
+
+    /* PID 1 only receives signals it has handlers for (besides SIGKILL) */
+    memset(&sa, 0, sizeof(sa));
+    sa.sa_handler = forwardSignal;
+    sigemptyset(&sa.sa_mask);
+    for (sig = forwarded; *sig; sig++)
+        sigaction(*sig, &sa, NULL);
+
+    /* make init a process group leader so killpg() on it works */
+    setpgid(0, 0);
+
+    initChild = fork();
+    switch (initChild) {
+    case -1:
+        perror("fork");
+        return 1;
+    case 0: /* child (handlers are reset by exec) */
+        if (detach == 1)
+            setsid();
+        execvp(cmd[0], cmd);
+        perror(cmd[0]);
+        _exit(1);
+    }
+
+    /* reap every process (including orphans) until the child exits */
+    for (;;) {
+        pid = waitpid(-1, &status, 0);
+        if (pid == -1) {
+            if (errno == EINTR)
+                continue;
+            return 1;
+        }
+        if (pid != initChild)
+            continue;
+        if (WIFEXITED(status))
+            return WEXITSTATUS(status);
+        if (WIFSIGNALED(status))
+            return 128 + WTERMSIG(status);
+        return 1;
+    }
+}
+
 int main(int argc, char *argv[]) {
     int c;
     int fd;
@@ -125,8 +190,10 @@ int main(int argc, char *argv[]) {
     int pidns = 0;
     int printpid = 0;
     int mountprocfs = 0;
+    int runinit = 0;
+    unsigned long propagation = MS_PRIVATE;
     static struct sched_param sp;
-    while ((c = getopt(argc, argv, "+cdnmiufpa:b:k:j:g:r:vh")) != -1)
+    while ((c = getopt(argc, argv, "+cdnmSiufpta:b:k:j:g:r:vh")) != -1)
         switch (c) {
         case 'c':
             /* close file descriptors except stdin/out/error */
@@ -154,6 +221,10 @@ int main(int argc, char *argv[]) {
             /* mount sysfs to pick up the new network namespace */
             mountns = MOUNT_NS_CREATE; /* delay mount of /sysfs */
             break;
+        case 'S':
+            /* receive (but do not send) mount events from the host */
+            propagation = MS_SLAVE;
+            break;
         case 'i':
             /* run in new PID namespace */
             if (unshare(CLONE_NEWPID) == -1) {
@@ -177,6 +248,10 @@ int main(int argc, char *argv[]) {
             /* print pid */
             printpid = TRUE; /* delay printing PID until after NS procesisng*/
             break;
+        case 't':
+            /* run minimal init as PID 1 (for new PID namespaces) */
+            runinit = TRUE; /* delay until new PID namespace established */
+            break;
         case 'a':
             /* Attach to pid's network namespace */
             pid = atoi(optarg);
@@ -231,6 +306,14 @@ int main(int argc, char *argv[]) {
             exit(1);
         }
 
+    /* stop mounts propagating between the new mount namespace and its
+     * peers (the host and other nodes), which grows every mount table */
+    if (mountns == MOUNT_NS_CREATE
+            && mount("none", "/", NULL, MS_REC | propagation, NULL) != 0) {
+        perror("mount");
+        return 1;
+    }
+
     /* fork to create / join PID namespace */
     if (pidns == PID_NS_CREATE || pidns == PID_NS_JOIN) {
         int status = 0;
@@ -315,6 +398,14 @@ int main(int argc, char *argv[]) {
         fflush(stdout);
     }
 
+    /* run minimal init as PID 1 if requested */
+    if (runinit && pidns != PID_NS_CREATE) {
+        /* requested init, but not in a new PID namespace */
+        return 1;
+    }
+    if (runinit && optind < argc)
+        return runInit(&argv[optind], detach);
+
     /* launch if requested */
     if (optind < argc) {
         execvp(argv[optind], &argv[optind]);